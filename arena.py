@@ -0,0 +1,148 @@
+import os
+import struct
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+"""
+    An append-only file of glyph bitmaps, read through a shared read-only
+    memory map so that bitmaps load as views of the mapped pages rather than
+    as decoded copies. Processes that map the same file share its pages
+    through the operating system's page cache, so reading many glyph sets
+    from many processes costs one copy of the pixels in memory, not one per
+    process, and pages that are not being read can be dropped.
+
+    Format version 1: a file header of the magic bytes b"GBA", a version byte
+    and four bytes of padding, then one record per bitmap starting at a
+    multiple of 8 bytes: rows and columns as little-endian uint32, then the
+    pixels row by row as uint8 0s and 1s. A bitmap is found by the offset of
+    its record, which records its shape.
+
+    The file is not touched until a bitmap is appended or read, and is
+    created by the first append. Any number of processes may append to the
+    same file: each append holds an exclusive lock on it while it finds the
+    end of the file and writes its record there.
+"""
+class BitmapArena:
+    MAGIC = b"GBA"
+    VERSION = 1
+    FILE_HEADER = struct.Struct("<3sB4x")
+    HEADER = struct.Struct("<II")
+    ALIGNMENT = 8
+    # Windows locks byte ranges, and readers of a locked range fail, so
+    # appends lock a byte far past the end of any arena instead of the file
+    LOCK_OFFSET = 2**40
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+
+    """
+        Writes a bitmap of 0s and 1s to the end of the arena and returns the
+        offset of its record.
+    """
+    def append(self, bitmap):
+        bitmap = np.asarray(bitmap)
+        if bitmap.ndim != 2:
+            raise ValueError("Bitmaps must be two dimensional, got shape {0}".format(bitmap.shape))
+        if not np.all((bitmap == 0) | (bitmap == 1)):
+            raise ValueError("Only monochrome bitmaps of 0s and 1s can be stored in an arena")
+
+        if self._file is None:
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                self._check_header()
+            self._file = open(self.path, "ab")
+
+        pixels = np.ascontiguousarray(bitmap, dtype=np.uint8).tobytes()
+        padding = -(self.HEADER.size + len(pixels)) % self.ALIGNMENT
+        record = self.HEADER.pack(bitmap.shape[0], bitmap.shape[1]) + pixels + bytes(padding)
+
+        self._lock()
+        try:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            if offset == 0:
+                # The first writer writes the file header
+                self._file.write(self.FILE_HEADER.pack(self.MAGIC, self.VERSION))
+                offset = self.FILE_HEADER.size
+            self._file.write(record)
+            # Flush so that the record can be mapped straight away, and is
+            # written before another process finds the end of the file
+            self._file.flush()
+        finally:
+            self._unlock()
+        return offset
+
+    def _lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            return
+        self._file.seek(self.LOCK_OFFSET)
+        while True:
+            try:
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after 10 attempts a second apart
+                continue
+
+    def _unlock(self):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            return
+        self._file.seek(self.LOCK_OFFSET)
+        msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    """
+        Returns the bitmap whose record starts at offset, as a read-only
+        uint8 view of the mapped file.
+    """
+    def get(self, offset):
+        if offset < self.FILE_HEADER.size or offset % self.ALIGNMENT != 0:
+            raise ValueError("No bitmap record at offset {0}".format(offset))
+
+        end = offset + self.HEADER.size
+        if self._map is None or end > len(self._map):
+            self._remap(end)
+        rows, cols = self.HEADER.unpack_from(self._map, offset)
+
+        start, end = end, end + rows * cols
+        if end > len(self._map):
+            self._remap(end)
+        return self._map[start:end].reshape(rows, cols)
+
+    """
+        Maps the file again once it has grown past the current map. Views of
+        the old map keep it open until they are released.
+    """
+    def _remap(self, end):
+        if self._map is None:
+            if not os.path.exists(self.path):
+                raise ValueError("Bitmap arena {0} does not exist".format(self.path))
+            self._check_header()
+
+        size = os.path.getsize(self.path)
+        if end > size:
+            raise ValueError("Bitmap record ends at {0}, past the end of {1}".format(end, self.path))
+        self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+
+    def _check_header(self):
+        with open(self.path, "rb") as f:
+            header = f.read(self.FILE_HEADER.size)
+        if len(header) < self.FILE_HEADER.size or header[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError("{0} is not a bitmap arena".format(self.path))
+        magic, version = self.FILE_HEADER.unpack(header)
+        if version != self.VERSION:
+            raise ValueError("Unsupported bitmap arena version {0}".format(version))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._map = None
@@ -0,0 +1,592 @@
+import ctypes
+from datetime import datetime
+from itertools import combinations
+import io
+import json
+import os
+import pickle
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+from peewee import BlobField, Model, SqliteDatabase
+
+import data
+import kernels
+import shapes
+import sounds
+import systematicity
+from arena import BitmapArena
+from data import ArenaBitmapField, PackedBitmapField, PickleBlobField
+from fontstore import FontStore
+
+"""
+    Benchmarks for comparing the performance of implementation choices.
+    Run this file directly to print all benchmark results and write them to
+    a JSON file (benchmarks.json, or the path given as the first argument)
+    so that runs can be compared.
+
+    The pipeline benchmarks render fonts generated on the fly by
+    build_fixture_font, which needs fontTools.
+"""
+
+# Font sizes and character sets the pipeline stages are measured with
+PIPELINE_SIZES = (12, 24, 48, 96)
+LATIN_CHARS = sorted(sounds.phonemes.keys())
+LARGE_CHARS = [chr(0x4E00 + i) for i in range(300)]
+
+# Variation axes of the variable fixture font: tag, minimum, default, maximum, name
+FIXTURE_AXES = [("wght", 100, 400, 900, "Weight"), ("wdth", 75, 100, 125, "Width")]
+FIXTURE_UNITS_PER_EM = 1000
+
+"""
+    Generates deterministic monochrome bitmaps resembling aligned glyphs of
+    the given height: 0 for ink and 1 for background, as float64 arrays.
+"""
+def get_sample_bitmaps(size, count, seed=0):
+    rng = np.random.RandomState(seed)
+    rows = int(size * 1.2)
+    cols = int(size * 0.9)
+
+    bitmaps = []
+    for _ in range(count):
+        bitmap = np.ones((rows, cols))
+        for _ in range(3):
+            top, left = rng.randint(0, rows // 2), rng.randint(0, cols // 2)
+            height, width = rng.randint(1, rows // 2 + 1), rng.randint(1, cols // 2 + 1)
+            bitmap[top:top + height, left:left + width] = 0
+        bitmaps.append(bitmap)
+    return bitmaps
+
+"""
+    Returns a GlyphRenderer for each fixture font with the design coordinates
+    to render it at: the static font at its defaults, and the variable font
+    at its defaults, its minimums, its maximums and a mixed point.
+"""
+def get_fixture_renderers(chars):
+    renderers = [("static", shapes.GlyphRenderer(io.BytesIO(build_fixture_font(chars))), [None])]
+    renderer = shapes.GlyphRenderer(io.BytesIO(build_fixture_font(chars, variable=True)))
+    axes = renderer._axes
+    renderers.append(("variable", renderer, [
+        None,
+        [axis.minimum for axis in axes],
+        [axis.maximum for axis in axes],
+        [round(axis.minimum + (axis.maximum - axis.minimum) * (i + 1) / 3, 4) for i, axis in enumerate(axes)]]))
+    return renderers
+
+"""
+    Decodes a rendered glyph's monochrome buffer one byte at a time with
+    GlyphRenderer.pixels_to_list, as render did before unpack_mono_buffer.
+"""
+def decode_reference(renderer, bitmap):
+    # Bitmap.buffer copies the whole buffer to a list each time it is read
+    buffer = bitmap.buffer
+    pixels = []
+    for i in range(bitmap.rows):
+        row = []
+        for j in range(bitmap.pitch):
+            row.extend(renderer.pixels_to_list(buffer[i*bitmap.pitch+j]))
+        pixels.extend(row[:bitmap.width])
+    return np.array(pixels).reshape(bitmap.rows, bitmap.width)
+
+"""
+    Measures glyphs decoded per second by unpack_mono_buffer and by the
+    reference pixels_to_list decoder, over every character of the fixture
+    fonts at each point size and design coordinates.
+    tests/test_decoders.py checks that they decode identical bitmaps.
+"""
+def bitmap_decoders(sizes=(6, 9, 12, 24, 48, 96), chars=LATIN_CHARS + LARGE_CHARS[:50]):
+    results = []
+    for name, renderer, coords_list in get_fixture_renderers(chars):
+        for size in sizes:
+            decode_time = 0
+            reference_time = 0
+            count = 0
+            for coords in coords_list:
+                renderer.configure_font(size, coords)
+                for char in chars:
+                    renderer.render(char)
+                    bitmap = renderer._face.glyph.bitmap
+                    buffer = ctypes.string_at(bitmap._FT_Bitmap.buffer, bitmap.rows*bitmap.pitch)
+
+                    start = time.perf_counter()
+                    shapes.unpack_mono_buffer(buffer, bitmap.rows, bitmap.width, bitmap.pitch)
+                    decode_time += time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    decode_reference(renderer, bitmap)
+                    reference_time += time.perf_counter() - start
+                    count += 1
+
+            results.append({
+                "font": name,
+                "size": size,
+                "glyphs": count,
+                "decode_per_sec": count / decode_time,
+                "reference_per_sec": count / reference_time,
+            })
+
+    return results
+
+"""
+    Compares the pickled, packed and arena storage formats for Glyph.bitmap.
+    For each point size, measures encode and decode throughput of the field
+    types, bulk insert and select throughput through SQLite, and the stored
+    bytes per glyph, counting an arena's file. Returns one dict of results
+    per format and size. tests/test_bitmap_storage.py checks that each
+    format round-trips bitmaps.
+"""
+def bitmap_storage(sizes=(12, 24, 48, 96), count=2000, batch_size=100):
+    storage, arena = data.bitmap_storage, data.bitmap_arena
+    results = []
+    for size in sizes:
+        bitmaps = get_sample_bitmaps(size, count)
+
+        for name, field in [("pickle", PickleBlobField()), ("packed", PackedBitmapField()), ("arena", ArenaBitmapField())]:
+            if name == "arena":
+                arena_dir = tempfile.TemporaryDirectory()
+                data.bitmap_storage = "arena"
+                data.bitmap_arena = BitmapArena(os.path.join(arena_dir.name, "glyphs.arena"))
+
+            start = time.perf_counter()
+            encoded = [field.db_value(bitmap) for bitmap in bitmaps]
+            encode_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decoded = [field.python_value(value) for value in encoded]
+            decode_time = time.perf_counter() - start
+
+            stored_bytes = sum(len(value) for value in encoded)
+            if name == "arena":
+                stored_bytes += os.path.getsize(data.bitmap_arena.path) - BitmapArena.FILE_HEADER.size
+
+            db = SqliteDatabase(":memory:")
+            class StoredBitmap(Model):
+                bitmap = field.__class__()
+                class Meta:
+                    database = db
+            db.create_tables([StoredBitmap])
+
+            start = time.perf_counter()
+            with db.atomic():
+                StoredBitmap.bulk_create([StoredBitmap(bitmap=bitmap) for bitmap in bitmaps], batch_size=batch_size)
+            store_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            loaded = [row.bitmap for row in StoredBitmap.select()]
+            load_time = time.perf_counter() - start
+            db.close()
+
+            if name == "arena":
+                # Release the views of the mapped file before removing it
+                del decoded, loaded
+                data.bitmap_arena.close()
+                data.bitmap_storage, data.bitmap_arena = storage, arena
+                arena_dir.cleanup()
+
+            results.append({
+                "format": name,
+                "size": size,
+                "glyphs": count,
+                "bytes_per_glyph": stored_bytes / count,
+                "encode_per_sec": count / encode_time,
+                "decode_per_sec": count / decode_time,
+                "store_per_sec": count / store_time,
+                "load_per_sec": count / load_time,
+            })
+
+    return results
+
+"""
+    Compares Hausdorff distances computed from all ink pixels with those
+    computed from glyph boundaries only. For each point size, measures pairs
+    per second over every pair of sample bitmaps, and the mean points per
+    glyph, of each mode.
+"""
+def hausdorff_point_modes(sizes=(12, 24, 48, 96), count=20):
+    results = []
+    for size in sizes:
+        bitmaps = get_sample_bitmaps(size, count)
+        pairs = list(combinations(range(count), 2))
+        results += [dict(size=size, **result) for result in compare_point_modes(bitmaps, pairs)]
+    return results
+
+"""
+    The same comparison as hausdorff_point_modes over the aligned glyphs of
+    the fixture fonts, rendered by FreeType at each point size and design
+    coordinates, for up to max_pairs pairs of glyphs each time.
+"""
+def rendered_point_modes(sizes=(12, 24, 48, 96), chars=LATIN_CHARS, max_pairs=100):
+    results = []
+    pairs = list(combinations(range(len(chars)), 2))[:max_pairs]
+    for name, renderer, coords_list in get_fixture_renderers(chars):
+        for size in sizes:
+            for coords in coords_list:
+                bitmaps = renderer.align_glyphs(renderer.glyph_bitmaps(chars, size, coords))
+                results += [dict(font=name, size=size, coords=coords, **result) 
+                                for result in compare_point_modes(bitmaps, pairs)]
+    return results
+
+"""
+    Times the all and boundary point modes over pairs of bitmaps. Returns the
+    points per glyph and pairs per second of each mode.
+    tests/test_point_modes.py checks that they give the same distances.
+"""
+def compare_point_modes(bitmaps, pairs):
+    results = []
+    for mode in ["all", "boundary"]:
+        start = time.perf_counter()
+        for i, j in pairs:
+            shapes.hausdorff_distance(bitmaps[i], bitmaps[j], mode)
+        elapsed = time.perf_counter() - start
+
+        results.append({
+            "mode": mode,
+            "pairs": len(pairs),
+            "points_per_glyph": float(np.mean([len(shapes.get_points(b, mode)) for b in bitmaps])),
+            "pairs_per_sec": len(pairs) / elapsed,
+        })
+
+    return results
+
+"""
+    Compares the speed of the NumPy and compiled (Numba) kernel backends of
+    shapes. For each point size, measures get_points,
+    points_hausdorff_distance one pair at a time and
+    pairwise_hausdorff_distances over all pairs of sample bitmaps. The
+    compiled kernels are compiled before timing. Returns no results if Numba
+    is not installed. tests/test_kernels.py checks that the backends agree.
+"""
+def kernel_backends(sizes=(12, 24, 48, 96), count=40):
+    if not kernels.available:
+        print("Numba is not installed: skipping kernel backend benchmarks")
+        return []
+
+    results = []
+    backend = shapes.kernel_backend
+    try:
+        for size in sizes:
+            bitmaps = get_sample_bitmaps(size, count)
+            pairs = list(combinations(range(count), 2))
+
+            for name in ["numpy", "numba"]:
+                shapes.kernel_backend = name
+                # Compile, and warm up caches, before timing
+                shapes.pairwise_hausdorff_distances([shapes.get_points(bitmap) for bitmap in bitmaps[:2]])
+
+                start = time.perf_counter()
+                points = [shapes.get_points(bitmap) for bitmap in bitmaps]
+                points_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for i, j in pairs:
+                    shapes.points_hausdorff_distance(points[i], points[j])
+                pair_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                shapes.pairwise_hausdorff_distances(points)
+                pairwise_time = time.perf_counter() - start
+
+                results.append({
+                    "backend": name,
+                    "size": size,
+                    "pairs": len(pairs),
+                    "get_points_ms": points_time * 1000,
+                    "pairs_per_sec": len(pairs) / pair_time,
+                    "pairwise_per_sec": len(pairs) / pairwise_time,
+                })
+    finally:
+        shapes.kernel_backend = backend
+
+    return results
+
+"""
+    Builds a deterministic TrueType font for benchmarks, with one glyph of
+    overlapping strokes per character. Each glyph depends only on its
+    character and the seed, so adding characters does not change the others.
+    A variable font has the FIXTURE_AXES: weight thickens the strokes and
+    width stretches them horizontally. Returns the font file as bytes.
+"""
+def build_fixture_font(chars, variable=False, seed=0):
+    try:
+        from fontTools.fontBuilder import FontBuilder
+        from fontTools.pens.ttGlyphPen import TTGlyphPen
+        from fontTools.ttLib.tables.TupleVariation import TupleVariation
+    except ImportError:
+        raise ImportError("Building fixture fonts requires fontTools (pip install fonttools)")
+
+    glyph_order = [".notdef"] + ["uni{0:04X}".format(ord(char)) for char in chars]
+    cmap = {ord(char): name for char, name in zip(chars, glyph_order[1:])}
+
+    glyphs = {}
+    variations = {}
+    for name, char in zip(glyph_order, [None] + list(chars)):
+        strokes = [] if char is None else get_fixture_strokes(char, seed)
+        pen = TTGlyphPen(None)
+        for x0, y0, x1, y1 in strokes:
+            # Clockwise, as TrueType outlines are
+            pen.moveTo((x0, y0))
+            pen.lineTo((x0, y1))
+            pen.lineTo((x1, y1))
+            pen.lineTo((x1, y0))
+            pen.closePath()
+        glyphs[name] = pen.glyph()
+
+        if variable:
+            variations[name] = get_fixture_variations(strokes, TupleVariation)
+
+    builder = FontBuilder(FIXTURE_UNITS_PER_EM, isTTF=True)
+    builder.setupGlyphOrder(glyph_order)
+    builder.setupCharacterMap(cmap)
+    builder.setupGlyf(glyphs)
+    glyph_table = builder.font["glyf"]
+    builder.setupHorizontalMetrics({name: (700, getattr(glyph_table[name], "xMin", 0)) for name in glyph_order})
+    builder.setupHorizontalHeader(ascent=800, descent=-200)
+    builder.setupNameTable({"familyName": "Benchmark Fixture", "styleName": "Regular"})
+    builder.setupOS2(sTypoAscender=800, sTypoDescender=-200, usWinAscent=800, usWinDescent=200)
+    builder.setupPost()
+
+    if variable:
+        builder.setupFvar(axes=FIXTURE_AXES, instances=[])
+        builder.setupGvar(variations)
+
+    # Fixed timestamps, so the same characters always give the same bytes
+    builder.updateHead(created=0, modified=0)
+    builder.font.recalcTimestamp = False
+
+    stream = io.BytesIO()
+    builder.save(stream)
+    return stream.getvalue()
+
+"""
+    Returns the strokes of a fixture glyph as (x0, y0, x1, y1) rectangles in
+    font units. Strokes may reach below the baseline, so glyphs in a set have
+    different extents, as real glyphs do.
+"""
+def get_fixture_strokes(char, seed=0):
+    rng = random.Random(seed * 1000003 + ord(char))
+
+    strokes = []
+    for _ in range(rng.randint(2, 4)):
+        if rng.random() < 0.5:
+            # Vertical stroke
+            x0, y0 = rng.randint(60, 520), rng.randint(-180, 300)
+            strokes.append((x0, y0, x0 + rng.randint(50, 110), y0 + rng.randint(250, 520)))
+        else:
+            # Horizontal stroke
+            x0, y0 = rng.randint(40, 300), rng.randint(0, 650)
+            strokes.append((x0, y0, x0 + rng.randint(200, 380), y0 + rng.randint(50, 100)))
+    return strokes
+
+"""
+    Returns the gvar variations of a fixture glyph: at maximum weight each
+    stroke grows by 25 units on every side and at minimum weight it shrinks by
+    10, while maximum and minimum width move points away from and towards the
+    middle of the glyph by a quarter of their distance from it.
+"""
+def get_fixture_variations(strokes, TupleVariation):
+    weight_max, weight_min, width_max, width_min = [], [], [], []
+    for x0, y0, x1, y1 in strokes:
+        for x, y, dx, dy in [(x0, y0, -1, -1), (x0, y1, -1, 1), (x1, y1, 1, 1), (x1, y0, 1, -1)]:
+            weight_max.append((25 * dx, 25 * dy))
+            weight_min.append((-10 * dx, -10 * dy))
+            width_max.append((round((x - 350) * 0.25), 0))
+            width_min.append((round((x - 350) * -0.25), 0))
+
+    # Phantom points for the glyph metrics do not vary
+    phantom = [(0, 0)] * 4
+    return [
+        TupleVariation({"wght": (0.0, 1.0, 1.0)}, weight_max + phantom),
+        TupleVariation({"wght": (-1.0, -1.0, 0.0)}, weight_min + phantom),
+        TupleVariation({"wdth": (0.0, 1.0, 1.0)}, width_max + phantom),
+        TupleVariation({"wdth": (-1.0, -1.0, 0.0)}, width_min + phantom),
+    ]
+
+"""
+    Returns deterministic Euclidean, Edit and Edit_Sum sound distances for
+    every pair of chars, as sounds.calculate_sound_distances saves them. The
+    phoneme vectors of sounds.phonemes are used where they exist, and random
+    vectors of the same length otherwise.
+"""
+def get_fixture_sound_distances(chars, seed=0):
+    rng = np.random.RandomState(seed)
+    length = len(next(iter(sounds.phonemes.values())))
+
+    vectors = {}
+    for char in chars:
+        vector = sounds.phonemes.get(char)
+        vectors[char] = np.array(vector if vector is not None else rng.choice([-1, -0.5, 0, 0.5, 1], length))
+
+    sound_distances = []
+    for char1, char2 in combinations(chars, 2):
+        difference = vectors[char1] - vectors[char2]
+        for metric, distance in [
+                ("Euclidean", np.sqrt(np.sum(difference**2))),
+                ("Edit", np.count_nonzero(difference)),
+                ("Edit_Sum", np.sum(np.abs(difference)))]:
+            sound_distances.append(data.SoundDistance(char1=char1, char2=char2, metric=metric, distance=float(distance)))
+    return sound_distances
+
+"""
+    Times each stage of a systematicity evaluation separately, for a static
+    and a variable fixture font, each character set and each size. The
+    variable font is measured half way between its default and maximum
+    coordinates. Every font and character set gets its own temporary SQLite
+    database in place of data.db.
+
+    Stages: rendering the glyphs (GlyphRenderer.render for each character),
+    align_glyphs, get_points, hausdorff_distance over at most max_pairs pairs,
+    hausdorff_matrix and outline_hausdorff_matrix (including reading the
+    outlines) over all pairs, a full evaluate with empty renderer and sound distance caches,
+    get_shape_distances and get_correlation for the evaluated glyph set.
+    Returns one dict of results per stage, font, character set and size.
+"""
+def pipeline(sizes=PIPELINE_SIZES, char_sets=(LATIN_CHARS, LARGE_CHARS), max_pairs=1000):
+    results = []
+    database = data.db.database
+    font_store = data.font_store
+
+    for variable in [False, True]:
+        for chars in char_sets:
+            font_file = build_fixture_font(chars, variable)
+
+            with tempfile.TemporaryDirectory() as directory:
+                data.db.init(os.path.join(directory, "benchmarks.db"))
+                data.font_store = FontStore(os.path.join(directory, "fonts"))
+                try:
+                    data.create()
+                    data.db.connect()
+                    results += pipeline_font(font_file, variable, chars, sizes, max_pairs)
+                finally:
+                    data.db.close()
+                    data.db.init(database)
+                    data.font_store = font_store
+                    systematicity.sound_distances.clear()
+                    systematicity.font_hashes.clear()
+                    shapes.renderer_pool.clear()
+
+    return results
+
+def pipeline_font(font_file, variable, chars, sizes, max_pairs):
+    with data.db.atomic():
+        data.SoundDistance.bulk_create(get_fixture_sound_distances(chars), batch_size=100)
+
+    font = data.Font.create(name="fixture", file_name="fixture.ttf", font_file=font_file, 
+                            is_variable=variable, is_serif=False)
+    renderer = shapes.GlyphRenderer(io.BytesIO(font_file))
+    coords = None
+    if variable:
+        coords = [round(axis.default + (axis.maximum - axis.default) / 2, 4) for axis in renderer._axes]
+
+    pairs = list(combinations(range(len(chars)), 2))[:max_pairs]
+
+    results = []
+    def add_result(stage, size, items, elapsed):
+        results.append({
+            "stage": stage,
+            "font": "variable" if variable else "static",
+            "chars": len(chars),
+            "size": size,
+            "items": items,
+            "ms": elapsed * 1000,
+            "per_sec": items / elapsed,
+        })
+
+    for size in sizes:
+        start = time.perf_counter()
+        glyph_bitmaps = renderer.glyph_bitmaps(chars, size, coords)
+        add_result("render", size, len(chars), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        bitmaps = renderer.align_glyphs(glyph_bitmaps)
+        add_result("align_glyphs", size, len(chars), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for bitmap in bitmaps:
+            shapes.get_points(bitmap)
+        add_result("get_points", size, len(chars), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for i, j in pairs:
+            shapes.hausdorff_distance(bitmaps[i], bitmaps[j])
+        add_result("hausdorff_distance", size, len(pairs), time.perf_counter() - start)
+
+        pair_count = len(chars) * (len(chars) - 1) // 2
+        start = time.perf_counter()
+        shapes.hausdorff_matrix(bitmaps)
+        add_result("hausdorff_matrix", size, pair_count, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        shapes.outline_hausdorff_matrix(renderer.outlines(chars, size, coords, systematicity.outline_tolerance))
+        add_result("outline_hausdorff_matrix", size, pair_count, time.perf_counter() - start)
+
+        systematicity.sound_distances.clear()
+        shapes.renderer_pool.clear()
+        start = time.perf_counter()
+        result = systematicity.evaluate(chars, font, size, coords)
+        add_result("evaluate", size, 1, time.perf_counter() - start)
+
+        glyphs = [glyph for glyph in data.Glyph
+                    .select()
+                    .where(data.Glyph.glyph_set_id == result.glyph_set_id)
+                    .order_by(data.Glyph.id)]
+        start = time.perf_counter()
+        shape_distances = systematicity.get_shape_distances(glyphs)
+        add_result("get_shape_distances", size, len(shape_distances), time.perf_counter() - start)
+
+        # Drop the correlations evaluate saved, so they are calculated again
+        data.Correlation.delete().where(data.Correlation.glyph_set_id == result.glyph_set_id).execute()
+        start = time.perf_counter()
+        systematicity.get_correlation(result.glyph_set_id, "Edit", "hausdorff")
+        add_result("get_correlation", size, 1, time.perf_counter() - start)
+
+    return results
+
+def print_results(title, results):
+    print(title)
+    columns = list(results[0].keys())
+    print("\t".join(columns))
+    for result in results:
+        print("\t".join(
+            "{0:.1f}".format(result[c]) if isinstance(result[c], float) else str(result[c]) 
+            for c in columns))
+
+"""
+    Writes benchmark results to a JSON file, with details of the environment
+    they were measured in. sections maps each benchmark name to its results.
+"""
+def write_results(path, sections):
+    output = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "benchmarks": sections,
+    }
+    with open(path, "w") as results_file:
+        json.dump(output, results_file, indent=2)
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "benchmarks.json"
+
+    sections = {
+        "bitmap_decoders": bitmap_decoders(),
+        "bitmap_storage": bitmap_storage(),
+        "hausdorff_point_modes": hausdorff_point_modes(),
+        "rendered_point_modes": rendered_point_modes(),
+        "kernel_backends": kernel_backends(),
+        "pipeline": pipeline(),
+    }
+    print_results("Glyph bitmap decoders", sections["bitmap_decoders"])
+    print_results("Glyph bitmap storage", sections["bitmap_storage"])
+    print_results("Hausdorff point modes", sections["hausdorff_point_modes"])
+    print_results("Hausdorff point modes, rendered glyphs", sections["rendered_point_modes"])
+    if len(sections["kernel_backends"]) > 0:
+        print_results("Kernel backends", sections["kernel_backends"])
+    print_results("Pipeline stages", sections["pipeline"])
+
+    write_results(path, sections)
+    print("Results written to {0}".format(path))
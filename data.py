@@ -1,11 +1,44 @@
 import io
 import json
+import os
 import pickle
+import struct
+
+import numpy as np
 
 from peewee import *
 from datetime import date
 
-db = SqliteDatabase(r'data\results.db')
+from arena import BitmapArena
+from fontstore import FontStore
+
+class CountingSqliteDatabase(SqliteDatabase):
+    """
+        SQLite database that counts the SQL statements it executes, so that
+        instrumentation can report the statements each call issues.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = 0
+
+    def execute_sql(self, *args, **kwargs):
+        self.statements += 1
+        return super().execute_sql(*args, **kwargs)
+
+db = CountingSqliteDatabase(r'data\results.db')
+
+# Where new glyph bitmaps are saved: "packed" keeps them in the database, one
+# bit per pixel, and "arena" appends them to bitmap_arena, with only a
+# reference to them in the database. Bitmaps are read from wherever they were
+# saved, whatever this is set to.
+bitmap_storage = "packed"
+
+# The file of glyph bitmaps saved with bitmap_storage "arena", kept with the
+# database. It is created when the first bitmap is saved to it.
+bitmap_arena = BitmapArena(r'data\glyphs.arena')
+
+# Where font binaries are kept, as files named by the hash of their content.
+font_store = FontStore(r'data\fonts')
 
 class PickleBlobField(BlobField):
     def db_value(self, value):
@@ -14,37 +47,227 @@ class PickleBlobField(BlobField):
     def python_value(self, value):
         return value if value is None else pickle.loads(value)
 
+class PackedBitmapField(BlobField):
+    """
+        Stores monochrome bitmaps as a small versioned header followed by one
+        bit per pixel, rather than as a pickled float64 array. Values decode
+        to float64 arrays of 0s and 1s, as the bitmaps were rendered.
+
+        Format version 1: the magic bytes b"PBM", a version byte, rows and
+        columns as little-endian uint32, then the pixels row by row as packed
+        by np.packbits (most significant bit first, 1 for non-zero pixels).
+    """
+    MAGIC = b"PBM"
+    VERSION = 1
+    HEADER = struct.Struct("<3sBII")
+
+    def db_value(self, value):
+        return value if value is None else self.encode(value)
+
+    def python_value(self, value):
+        return value if value is None else self.decode(value)
+
+    @classmethod
+    def encode(cls, bitmap):
+        bitmap = np.asarray(bitmap)
+        if bitmap.ndim != 2:
+            raise ValueError("Bitmaps must be two dimensional, got shape {0}".format(bitmap.shape))
+        if not np.all((bitmap == 0) | (bitmap == 1)):
+            raise ValueError("Only monochrome bitmaps of 0s and 1s can be packed")
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, bitmap.shape[0], bitmap.shape[1])
+        return header + np.packbits((bitmap != 0).ravel()).tobytes()
+
+    @classmethod
+    def decode(cls, value):
+        value = bytes(value)
+        if not cls.is_packed(value):
+            raise ValueError("Value is not a packed bitmap. Databases created before packed bitmaps "
+                                "need data_migrations.apply_v4.")
+
+        magic, version, rows, cols = cls.HEADER.unpack_from(value)
+        if version != cls.VERSION:
+            raise ValueError("Unsupported packed bitmap version {0}".format(version))
+
+        packed = np.frombuffer(value, dtype=np.uint8, offset=cls.HEADER.size)
+        bits = np.unpackbits(packed)[:rows*cols]
+        return bits.reshape(rows, cols).astype(np.float64)
+
+    @classmethod
+    def is_packed(cls, value):
+        return bytes(value[:len(cls.MAGIC)]) == cls.MAGIC
+
+class ArenaBitmapField(PackedBitmapField):
+    """
+        Stores bitmaps in data.bitmap_arena when data.bitmap_storage is
+        "arena", and as packed bitmaps otherwise. Bitmaps in an arena are
+        stored as a reference to their record and load as read-only uint8
+        views of the mapped arena file, rather than as decoded copies.
+
+        Bitmaps are appended to the arena as their values are converted,
+        before the statement saving them runs, so glyphs that are rolled back
+        or deleted leave unused records behind. compact_bitmap_arena removes
+        them.
+
+        Reference format version 1: the magic bytes b"GBR", a version byte,
+        then the offset of the bitmap's record as a little-endian uint64.
+    """
+    REFERENCE_MAGIC = b"GBR"
+    REFERENCE_VERSION = 1
+    REFERENCE = struct.Struct("<3sBQ")
+
+    def db_value(self, value):
+        if value is None or bitmap_storage != "arena":
+            return super().db_value(value)
+        return self.reference(bitmap_arena.append(value))
+
+    def python_value(self, value):
+        if value is None or not self.is_reference(value):
+            return super().python_value(value)
+        return bitmap_arena.get(self.get_offset(value))
+
+    @classmethod
+    def reference(cls, offset):
+        return cls.REFERENCE.pack(cls.REFERENCE_MAGIC, cls.REFERENCE_VERSION, offset)
+
+    @classmethod
+    def get_offset(cls, value):
+        magic, version, offset = cls.REFERENCE.unpack(bytes(value))
+        if version != cls.REFERENCE_VERSION:
+            raise ValueError("Unsupported bitmap reference version {0}".format(version))
+        return offset
+
+    @classmethod
+    def is_reference(cls, value):
+        return bytes(value[:len(cls.REFERENCE_MAGIC)]) == cls.REFERENCE_MAGIC
+
+class ArrayField(BlobField):
+    """
+        Stores a NumPy array as its raw bytes after a small versioned header,
+        so arrays load without pickle.
+
+        Format version 1: the magic bytes b"ARR", a version byte, the dtype
+        string (such as "<f8") padded with spaces to 4 bytes, the number of
+        dimensions as a byte, each dimension as a little-endian uint32, then
+        the array data in C order.
+    """
+    MAGIC = b"ARR"
+    VERSION = 1
+    HEADER = struct.Struct("<3sB4sB")
+
+    def db_value(self, value):
+        return value if value is None else self.encode(value)
+
+    def python_value(self, value):
+        return value if value is None else self.decode(value)
+
+    @classmethod
+    def encode(cls, array):
+        array = np.ascontiguousarray(array)
+        dtype = array.dtype.str.encode("ascii").ljust(4)
+        header = cls.HEADER.pack(cls.MAGIC, cls.VERSION, dtype, array.ndim)
+        shape = struct.pack("<{0}I".format(array.ndim), *array.shape)
+        return header + shape + array.tobytes()
+
+    @classmethod
+    def decode(cls, value):
+        value = bytes(value)
+        magic, version, dtype, ndim = cls.HEADER.unpack_from(value)
+        if magic != cls.MAGIC:
+            raise ValueError("Value is not a stored array")
+        if version != cls.VERSION:
+            raise ValueError("Unsupported array version {0}".format(version))
+
+        shape = struct.unpack_from("<{0}I".format(ndim), value, cls.HEADER.size)
+        offset = cls.HEADER.size + 4 * ndim
+        count = int(np.prod(shape))
+        return np.frombuffer(value, dtype=np.dtype(dtype.decode("ascii").strip()), 
+                            count=count, offset=offset).reshape(shape)
+
 class BaseModel(Model):
     class Meta:
         database = db
 
 class Font(BaseModel):
+    """
+        Font binaries are kept in data.font_store under file_hash, the SHA-1
+        hash of their content, so that selecting fonts does not load them.
+        font_file reads the binary on access, and setting it stores the
+        binary. Fonts imported before the store keep their binary in the
+        font_file column, as stored_file, until data_migrations.apply_v11.
+    """
     name = CharField()
     file_name = CharField()
-    font_file = BlobField()
+    stored_file = BlobField(null=True, column_name="font_file")
+    file_hash = CharField(max_length=40, null=True, index=True)
     is_variable = BitField()
     is_serif = BitField()
     axes = CharField(max_length=1000, null=True)
 
+    @property
+    def font_file(self):
+        if self.stored_file is not None:
+            return self.stored_file
+        return font_store.get(self.file_hash)
+
+    @font_file.setter
+    def font_file(self, content):
+        self.file_hash = font_store.put(content)
+        self.stored_file = None
+
+    """
+        The path of the stored font file, or the binary itself for fonts
+        still kept in the database: what renderers and worker processes open
+        the font from.
+    """
+    @property
+    def font_source(self):
+        if self.stored_file is not None:
+            return self.stored_file
+        return font_store.path(self.file_hash)
+
 class GlyphSet(BaseModel):
     font = ForeignKeyField(Font, backref='glyph_sets')
     coords = CharField(max_length=1000, null=True)
     size = IntegerField()
     chars = CharField(max_length=1000)    
+    cache_key = CharField(max_length=40, null=True, unique=True)
+    coords_key = CharField(max_length=40, null=True, index=True)
 
 class Glyph(BaseModel):
     glyph_set = ForeignKeyField(GlyphSet, backref='glyphs')
     character = FixedCharField(max_length=1)
-    bitmap = PickleBlobField()
+    # None for glyphs saved by outline measurements, until they are rendered
+    bitmap = ArenaBitmapField(null=True)
+    metrics = CharField(max_length=100, null=True)
 
 class ShapeDistance(BaseModel):
     glyph1 = ForeignKeyField(Glyph)
     glyph2 = ForeignKeyField(Glyph)
-    metric = CharField(max_length=20)
+    metric = CharField(max_length=40)
     distance = FloatField()
     points1 = CharField(max_length=100, null=True)
     points2 = CharField(max_length=100, null=True)
 
+class ShapeDistanceMatrix(BaseModel):
+    """
+        All pairwise shape distances of a glyph set in one record, in place of
+        one ShapeDistance row per pair. Distances are condensed, in the order
+        of itertools.combinations over glyph_ids. points1 and points2 hold the
+        contributing points of each pair, laid out as in ShapeDistance.
+    """
+    glyph_set = ForeignKeyField(GlyphSet, backref='shape_distance_matrices')
+    metric = CharField(max_length=40)
+    glyph_ids = ArrayField()
+    distances = ArrayField()
+    points1 = ArrayField()
+    points2 = ArrayField()
+
+    class Meta:
+        indexes = (
+            (('glyph_set', 'metric'), True),
+        )
+
 class SoundDistance(BaseModel):
     char1 = FixedCharField(max_length=1)
     char2 = FixedCharField(max_length=1)
@@ -69,10 +292,91 @@ class ExperimentGlyphSet(BaseModel):
     experiment = ForeignKeyField(Experiment)
     glyph_set = ForeignKeyField(GlyphSet)
 
+class ExperimentProfile(BaseModel):
+    """
+        Totals of the instrumented calls of one stage over the evaluations of
+        an experiment, as recorded by instrumentation.save_profile.
+    """
+    experiment = ForeignKeyField(Experiment, backref='profiles')
+    stage = CharField(max_length=50)
+    calls = IntegerField()
+    wall_time = FloatField()
+    cpu_time = FloatField()
+    peak_memory = IntegerField()
+    pixels = IntegerField()
+    points = IntegerField()
+    queries = IntegerField()
+
+    class Meta:
+        indexes = (
+            (('experiment', 'stage'), True),
+        )
+
+class ExperimentCheckpoint(BaseModel):
+    """
+        The last saved state of a run an experiment belongs to, as JSON, for
+        experiments.resume_experiment. Removed when the run finishes.
+    """
+    experiment = ForeignKeyField(Experiment, backref='checkpoints', unique=True)
+    iteration = IntegerField()
+    state = TextField()
+    saved_time = DateTimeField()
+
+class FontSource(BaseModel):
+    """
+        A font file fonts.load_fonts has imported, by absolute path, with the
+        size, modification time in nanoseconds and content hash it had then,
+        so that files that have not changed are skipped when importing again.
+        Files modified just before they were imported are recorded with an
+        mtime of -1, so that they are read again.
+    """
+    path = CharField(max_length=1000, unique=True)
+    size = BigIntegerField()
+    mtime = BigIntegerField()
+    file_hash = CharField(max_length=40)
+
 def create():
     db.connect()
-    db.create_tables([Font, GlyphSet, Glyph, ShapeDistance, SoundDistance, Correlation, Experiment, ExperimentGlyphSet])
+    db.create_tables([Font, GlyphSet, Glyph, ShapeDistance, ShapeDistanceMatrix, SoundDistance, Correlation, Experiment, ExperimentGlyphSet, ExperimentProfile, ExperimentCheckpoint, FontSource])
     db.close()
 
+"""
+    Rewrites bitmap_arena with only the bitmaps that glyphs still refer to,
+    dropping the records left by rolled back saves, deleted glyph sets and
+    re-rendered glyphs. The live records are copied to a new file, and the
+    glyphs' references are updated and the new file replaces the old in one
+    transaction. No other process may use the database or the arena while
+    it runs. Returns the number of bytes freed.
+"""
+def compact_bitmap_arena():
+    if not os.path.exists(bitmap_arena.path):
+        return 0
+
+    compact_path = bitmap_arena.path + ".compact"
+    if os.path.exists(compact_path):
+        os.remove(compact_path)
+    compacted = BitmapArena(compact_path)
+
+    updates = []
+    for glyph_id, value in db.execute_sql("select id, bitmap from glyph where bitmap is not null order by id").fetchall():
+        if ArenaBitmapField.is_reference(value):
+            offset = compacted.append(bitmap_arena.get(ArenaBitmapField.get_offset(value)))
+            updates.append((ArenaBitmapField.reference(offset), glyph_id))
+    compacted.close()
+
+    # An arena that no glyph refers to is removed rather than rewritten
+    compact_size = os.path.getsize(compact_path) if len(updates) > 0 else 0
+    freed = os.path.getsize(bitmap_arena.path) - compact_size
+    with db.atomic():
+        for update in updates:
+            db.execute_sql("update glyph set bitmap = ? where id = ?", update)
+        bitmap_arena.close()
+        if len(updates) > 0:
+            os.replace(compact_path, bitmap_arena.path)
+        else:
+            os.remove(bitmap_arena.path)
+
+    return freed
+
 if __name__ == "__main__":
     create()
\ No newline at end of file
@@ -1,6 +1,14 @@
+import hashlib
+import json
+import pickle
+
 from peewee import CharField, SqliteDatabase
 from playhouse.migrate import SqliteMigrator, migrate
 
+import data
+from data import ArenaBitmapField, ExperimentCheckpoint, ExperimentProfile, FontSource, PackedBitmapField, ShapeDistanceMatrix
+import systematicity
+
 """
     Data migrations - for users of earlier version.
     Data.py is kept up-to-date with these changes and they
@@ -29,5 +37,259 @@ def apply_v3():
         migrator.rename_column("sounddistance", "char_2", "char2")
     )
 
+"""
+    Converts glyph bitmaps from pickled arrays to the packed bit format of
+    PackedBitmapField. Rows are converted in batches, each in its own
+    transaction, so an interrupted migration can simply be run again: rows
+    that are already packed are skipped.
+"""
+def apply_v4(batch_size=1000, vacuum=True):
+    db = SqliteDatabase(r"data\results.db")
+
+    last_id = 0
+    converted = 0
+    while True:
+        rows = db.execute_sql(
+            "select id, bitmap from glyph where id > ? order by id limit ?", 
+            (last_id, batch_size)).fetchall()
+        if len(rows) == 0:
+            break
+
+        updates = []
+        for glyph_id, bitmap in rows:
+            if bitmap is not None and not PackedBitmapField.is_packed(bitmap):
+                updates.append((PackedBitmapField.encode(pickle.loads(bitmap)), glyph_id))
+
+        with db.atomic():
+            for update in updates:
+                db.execute_sql("update glyph set bitmap = ? where id = ?", update)
+
+        converted += len(updates)
+        last_id = rows[-1][0]
+        print("Converted {0} glyphs".format(converted))
+
+    if vacuum:
+        # Return the space freed by the smaller bitmaps to the file system
+        db.execute_sql("vacuum")
+
+"""
+    Adds the table for glyph set distance matrices. Existing per-pair
+    ShapeDistance rows stay where they are and are still read.
+"""
+def apply_v5():
+    db = SqliteDatabase(r"data\results.db")
+    with db.bind_ctx([ShapeDistanceMatrix]):
+        db.create_tables([ShapeDistanceMatrix])
+
+"""
+    Adds GlyphSet.cache_key, fills it in for existing glyph sets in batches and
+    indexes it, along with the foreign keys used to look up a set's glyphs,
+    distances and correlations. Where earlier duplicates of a glyph set exist,
+    only the oldest gets the key.
+"""
+def apply_v6(batch_size=1000):
+    db = SqliteDatabase(r"data\results.db")
+    migrator = SqliteMigrator(db)
+
+    columns = [column.name for column in db.get_columns("glyphset")]
+    if "cache_key" not in columns:
+        migrate(migrator.add_column("glyphset", "cache_key", CharField(max_length=40, null=True)))
+
+    font_hashes = {}
+    for (font_id,) in db.execute_sql("select id from font").fetchall():
+        font_file = db.execute_sql("select font_file from font where id = ?", (font_id,)).fetchone()[0]
+        font_hashes[font_id] = hashlib.sha1(font_file).hexdigest()
+
+    keys = set(key for (key,) in db.execute_sql(
+        "select cache_key from glyphset where cache_key is not null").fetchall())
+
+    last_id = 0
+    duplicates = 0
+    while True:
+        rows = db.execute_sql(
+            "select id, font_id, size, coords, chars from glyphset where id > ? and cache_key is null order by id limit ?",
+            (last_id, batch_size)).fetchall()
+        if len(rows) == 0:
+            break
+
+        updates = []
+        for glyph_set_id, font_id, size, coords, chars in rows:
+            coords = None if coords is None else json.loads(coords)
+            key = systematicity.get_glyph_set_key(font_hashes[font_id], size, coords, json.loads(chars))
+            if key in keys:
+                duplicates += 1
+                continue
+            keys.add(key)
+            updates.append((key, glyph_set_id))
+
+        with db.atomic():
+            for update in updates:
+                db.execute_sql("update glyphset set cache_key = ? where id = ?", update)
+
+        last_id = rows[-1][0]
+        print("Keyed glyph sets up to id {0}, {1} duplicates left unkeyed".format(last_id, duplicates))
+
+    with db.atomic():
+        db.execute_sql("create unique index if not exists glyphset_cache_key on glyphset (cache_key)")
+        db.execute_sql("create index if not exists glyph_glyph_set_id on glyph (glyph_set_id)")
+        db.execute_sql("create index if not exists shapedistance_glyph1_id on shapedistance (glyph1_id)")
+        db.execute_sql("create index if not exists shapedistance_glyph2_id on shapedistance (glyph2_id)")
+        db.execute_sql("create index if not exists correlation_glyph_set_id on correlation (glyph_set_id)")
+
+"""
+    Adds Glyph.metrics, which records how each glyph was aligned so that
+    systematicity.extend_glyph_set can reuse it. Glyphs saved before then
+    have no metrics, and their glyph sets are not reused.
+"""
+def apply_v7():
+    db = SqliteDatabase(r"data\results.db")
+    migrator = SqliteMigrator(db)
+
+    columns = [column.name for column in db.get_columns("glyph")]
+    if "metrics" not in columns:
+        migrate(migrator.add_column("glyph", "metrics", CharField(max_length=100, null=True)))
+
+"""
+    Adds the table for per-experiment totals of instrumented calls.
+"""
+def apply_v8():
+    db = SqliteDatabase(r"data\results.db")
+    with db.bind_ctx([ExperimentProfile]):
+        db.create_tables([ExperimentProfile])
+
+def apply_v9():
+    db = SqliteDatabase(r"data\results.db")
+    with db.bind_ctx([ExperimentCheckpoint]):
+        db.create_tables([ExperimentCheckpoint])
+
+"""
+    Moves glyph bitmaps out of the database into data.bitmap_arena, leaving a
+    reference to each in its row. Set data.bitmap_storage to "arena" to save
+    new glyphs there too. Rows are moved in batches, each in its own
+    transaction, so an interrupted migration can simply be run again: rows
+    that already refer to the arena are skipped, and bitmaps appended by an
+    interrupted batch are left unused until data.compact_bitmap_arena.
+"""
+def apply_v10(batch_size=1000, vacuum=True):
+    db = SqliteDatabase(r"data\results.db")
+    arena = data.bitmap_arena
+
+    last_id = 0
+    moved = 0
+    while True:
+        rows = db.execute_sql(
+            "select id, bitmap from glyph where id > ? order by id limit ?", 
+            (last_id, batch_size)).fetchall()
+        if len(rows) == 0:
+            break
+
+        updates = []
+        for glyph_id, bitmap in rows:
+            if bitmap is not None and not ArenaBitmapField.is_reference(bitmap):
+                offset = arena.append(PackedBitmapField.decode(bitmap))
+                updates.append((ArenaBitmapField.reference(offset), glyph_id))
+
+        with db.atomic():
+            for update in updates:
+                db.execute_sql("update glyph set bitmap = ? where id = ?", update)
+
+        moved += len(updates)
+        last_id = rows[-1][0]
+        print("Moved {0} glyphs".format(moved))
+
+    if vacuum:
+        db.execute_sql("vacuum")
+
+"""
+    Moves font binaries out of the database into data.font_store, adding
+    Font.file_hash to find them by and letting the font_file column be empty.
+    Fonts are moved one at a time, each in its own transaction, so an
+    interrupted migration can simply be run again: fonts already moved are
+    skipped. Identical fonts are stored once.
+"""
+def apply_v11(vacuum=True):
+    db = SqliteDatabase(r"data\results.db")
+    migrator = SqliteMigrator(db)
+
+    columns = {column.name: column for column in db.get_columns("font")}
+    if "file_hash" not in columns:
+        migrate(migrator.add_column("font", "file_hash", CharField(max_length=40, null=True)))
+    if not columns["font_file"].null:
+        migrate(migrator.drop_not_null("font", "font_file"))
+    db.execute_sql("create index if not exists font_file_hash on font (file_hash)")
+
+    font_ids = [font_id for (font_id,) in db.execute_sql(
+        "select id from font where font_file is not null order by id").fetchall()]
+    for font_id in font_ids:
+        font_file = db.execute_sql("select font_file from font where id = ?", (font_id,)).fetchone()[0]
+        file_hash = data.font_store.put(font_file)
+        with db.atomic():
+            db.execute_sql("update font set file_hash = ?, font_file = null where id = ?", (file_hash, font_id))
+        print("Moved font {0}".format(font_id))
+
+    if vacuum:
+        db.execute_sql("vacuum")
+
+"""
+    Adds the table of imported font files that fonts.load_fonts checks to
+    skip files it has already imported.
+"""
+def apply_v12():
+    db = SqliteDatabase(r"data\results.db")
+    with db.bind_ctx([FontSource]):
+        db.create_tables([FontSource])
+
+"""
+    Adds GlyphSet.coords_key, which find_related_glyph_set looks glyph sets up
+    by, fills it in for existing glyph sets in batches and indexes it. Glyph
+    sets already keyed are skipped, so an interrupted migration can simply be
+    run again.
+"""
+def apply_v13(batch_size=1000):
+    db = SqliteDatabase(r"data\results.db")
+    migrator = SqliteMigrator(db)
+
+    columns = [column.name for column in db.get_columns("glyphset")]
+    if "coords_key" not in columns:
+        migrate(migrator.add_column("glyphset", "coords_key", CharField(max_length=40, null=True)))
+
+    font_hashes = {}
+    for (font_id, file_hash) in db.execute_sql("select id, file_hash from font").fetchall():
+        if file_hash is None:
+            font_file = db.execute_sql("select font_file from font where id = ?", (font_id,)).fetchone()[0]
+            file_hash = hashlib.sha1(font_file).hexdigest()
+        font_hashes[font_id] = file_hash
+
+    keyed = 0
+    while True:
+        rows = db.execute_sql(
+            "select id, font_id, size, coords from glyphset where coords_key is null order by id limit ?",
+            (batch_size,)).fetchall()
+        if len(rows) == 0:
+            break
+
+        with db.atomic():
+            for glyph_set_id, font_id, size, coords in rows:
+                coords = None if coords is None else json.loads(coords)
+                key = systematicity.get_coords_key(font_hashes[font_id], size, coords)
+                db.execute_sql("update glyphset set coords_key = ? where id = ?", (key, glyph_set_id))
+
+        keyed += len(rows)
+        print("Keyed {0} glyph sets".format(keyed))
+
+    db.execute_sql("create index if not exists glyphset_coords_key on glyphset (coords_key)")
+
+"""
+    Lets Glyph.bitmap be empty, for glyphs saved by outline measurements
+    without being rendered.
+"""
+def apply_v14():
+    db = SqliteDatabase(r"data\results.db")
+    migrator = SqliteMigrator(db)
+
+    columns = {column.name: column for column in db.get_columns("glyph")}
+    if not columns["bitmap"].null:
+        migrate(migrator.drop_not_null("glyph", "bitmap"))
+
 if __name__ == "__main__":
-    apply_v3()
+    apply_v14()
@@ -21,6 +21,9 @@ class EuclideanDistance():
 class HaussdorffDistance():    
     def get_distance(char1, char2):
         return (directed_hausdorff(char1, char2), directed_hausdorff(char2, char1))
+
+    def get_directed_distance(char1, char2):
+        return directed_hausdorff(char1, char2)
         
     def get_distances(chars1, chars2):
         if len(chars1) != len(chars2):
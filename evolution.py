@@ -0,0 +1,118 @@
+import math
+
+import numpy as np
+
+"""
+    Evolution strategies for optimizers that evaluate a whole population of
+    candidates at a time, so each generation can be spread over every worker.
+"""
+
+"""
+    Covariance matrix adaptation evolution strategy (CMA-ES), maximizing over
+    coordinates scaled to [0, 1] along each axis. Each generation, ask returns
+    population_size candidates drawn from a multivariate normal distribution,
+    and tell updates the distribution's mean, covariance and step size sigma
+    from how the candidates ranked. Step sizes adapt on their own, so sigma
+    only sets where the search starts: 0.3 is about a third of each axis.
+
+    Candidates outside [0, 1] are redrawn a few times and then clipped to the
+    bounds; the update uses the clipped candidates, as they were evaluated.
+    Follows Hansen, "The CMA Evolution Strategy: A Tutorial" (2016).
+"""
+class CMAES:
+    def __init__(self, mean, sigma=0.3, population_size=None):
+        n = len(mean)
+        self.dims = n
+        self.population_size = population_size or 4 + int(3 * math.log(n))
+        self.mu = self.population_size // 2
+
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / (self.weights ** 2).sum()
+
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.sigma = sigma
+        self.covariance = np.eye(n)
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.generation = 0
+
+    """
+        Returns population_size candidates as lists, drawn with random_state,
+        a NumPy RandomState.
+    """
+    def ask(self, random_state, max_redraws=10):
+        eigenvalues, eigenvectors = np.linalg.eigh(self.covariance)
+        scale = eigenvectors * np.sqrt(np.maximum(eigenvalues, 0.0))
+
+        candidates = []
+        for _ in range(self.population_size):
+            for _ in range(max_redraws):
+                candidate = self.mean + self.sigma * scale.dot(random_state.standard_normal(self.dims))
+                if np.all((candidate >= 0) & (candidate <= 1)):
+                    break
+            candidates.append(np.clip(candidate, 0.0, 1.0).tolist())
+        return candidates
+
+    """
+        Updates the distribution from the candidates of a generation and
+        their fitness, higher being better. Give candidates that could not
+        be evaluated a fitness of -math.inf.
+    """
+    def tell(self, candidates, fitness):
+        n = self.dims
+        order = np.argsort(-np.asarray(fitness, dtype=np.float64), kind="stable")
+        selected = np.asarray(candidates, dtype=np.float64)[order[:self.mu]]
+
+        old_mean = self.mean
+        self.mean = self.weights.dot(selected)
+        steps = (selected - old_mean) / self.sigma
+        step = (self.mean - old_mean) / self.sigma
+
+        eigenvalues, eigenvectors = np.linalg.eigh(self.covariance)
+        inverse_sqrt = eigenvectors.dot(np.diag(1 / np.sqrt(np.maximum(eigenvalues, 1e-20)))).dot(eigenvectors.T)
+
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * inverse_sqrt.dot(step)
+        self.generation += 1
+        ps_norm = np.linalg.norm(self.ps)
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi_n < 1.4 + 2 / (n + 1)
+
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+        rank_mu = (self.weights[:, None] * steps).T.dot(steps)
+        self.covariance = ((1 - self.c1 - self.cmu) * self.covariance
+                            + self.c1 * (np.outer(self.pc, self.pc) + (1 - hsig) * self.cc * (2 - self.cc) * self.covariance)
+                            + self.cmu * rank_mu)
+        self.covariance = (self.covariance + self.covariance.T) / 2
+
+        self.sigma *= math.exp((self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+
+    """
+        The largest standard deviation of the distribution along any
+        direction, in [0, 1] coordinates.
+    """
+    @property
+    def spread(self):
+        return self.sigma * math.sqrt(max(np.linalg.eigvalsh(self.covariance).max(), 0.0))
+
+    """
+        Returns the changing state of the strategy as lists and numbers, so
+        that it can be checkpointed as JSON, and restores it.
+    """
+    def get_state(self):
+        return {"mean":self.mean.tolist(), "sigma":self.sigma, "covariance":self.covariance.tolist(),
+            "pc":self.pc.tolist(), "ps":self.ps.tolist(), "generation":self.generation}
+
+    def set_state(self, state):
+        self.mean = np.asarray(state["mean"])
+        self.sigma = state["sigma"]
+        self.covariance = np.asarray(state["covariance"])
+        self.pc = np.asarray(state["pc"])
+        self.ps = np.asarray(state["ps"])
+        self.generation = state["generation"]
@@ -1,25 +1,50 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from  datetime import datetime
-import io
 import json
 import math
+import os
 import random
 from enum import Enum
+from itertools import product
+from typing import NamedTuple
+
+import numpy as np
 
 import data
-from data import Font, Experiment, ExperimentGlyphSet
+import evolution
+from data import Font, Experiment, ExperimentCheckpoint, ExperimentGlyphSet
+import instrumentation
+import memo
 import shapes
+import surrogate
 import systematicity
 
 class ExperimentType(Enum):
     DefaultSystematicity = "default"
     GridSearch = "grid"
     RandomSearch = "random"
+    DesignSpaceSearch = "design space"
     SimulatedAnnealing = "simulated annealing",
     SimulatedAnnealingMin = "simulated annealing minimize"
+    ParallelTempering = "parallel tempering"
+    ParallelTemperingMin = "parallel tempering minimize"
+    BayesianOptimization = "bayesian optimization"
+    BayesianOptimizationMin = "bayesian optimization minimize"
+    CMAES = "cma-es"
+    CMAESMin = "cma-es minimize"
 
 
 random_seed = None
 
+# Iterations between saved checkpoints of a run's state, or None to save none.
+# See resume_experiment.
+checkpoint_interval = 10
+
+# Outcomes of evaluations already made in this process, shared by all experiment
+# drivers. Replace with memo.EvaluationMemo(tolerance=...) to also reuse the
+# outcomes of nearby points, and clear it after deleting glyph sets.
+evaluation_memo = memo.EvaluationMemo()
+
 """
     Method for setting initial seed for when repeatable experiments
     are desired.
@@ -53,233 +78,1189 @@ def get_grid_coords(minimum, maximum, points):
     Generates the number of randomly selected points for the specified
     font axes.
 """
-def get_random_coords(axes, num_points):
+def get_random_coords(axes, num_points, rng=random):
     points = []
     for i in range(num_points):
         coords = []
         for axis in axes:
-            coords.append(round(random.uniform(axis.minimum, axis.maximum), 4))
+            coords.append(round(rng.uniform(axis.minimum, axis.maximum), 4))
         points.append(coords)
     return points
 
+"""
+    Generates up to num_points points covering the joint space of the font
+    axes, for design_space_search. Designs are:
+
+        factorial - a full grid with the same number of evenly spaced levels
+                    on every axis, as many as fit in num_points. Best for
+                    fonts with one or two axes.
+        latin     - a Latin hypercube: each axis is split into num_points
+                    equal strata, and each stratum is sampled exactly once.
+        sobol     - a scrambled Sobol sequence, which fills the space more
+                    evenly than random points however many are taken.
+                    Requires scipy 1.7 or later.
+
+    A font without axes gives the one point of its defaults, whatever the
+    design.
+"""
+def get_design_coords(axes, num_points, design="latin", rng=random):
+    if design not in ("factorial", "latin", "sobol"):
+        raise Exception("Unknown design {0}".format(design))
+    if len(axes) == 0:
+        # A font without axes has a single design: its defaults
+        return [[]]
+
+    if design == "factorial":
+        levels = int(round(num_points ** (1 / len(axes)), 6))
+        if levels < 2:
+            raise Exception("A factorial design over {0} axes needs at least {1} points".format(len(axes), 2 ** len(axes)))
+        grids = [get_grid_coords(axis.minimum, axis.maximum, levels) for axis in axes]
+        return [list(coords) for coords in product(*grids)]
+
+    if design == "latin":
+        strata = []
+        for axis in axes:
+            order = list(range(num_points))
+            rng.shuffle(order)
+            strata.append(order)
+        samples = [[(strata[a][i] + rng.random()) / num_points for a in range(len(axes))] for i in range(num_points)]
+    else:
+        try:
+            from scipy.stats import qmc
+        except ImportError:
+            raise ImportError("Sobol designs require scipy 1.7 or later")
+        sampler = qmc.Sobol(len(axes), scramble=True, seed=rng.randrange(2**32))
+        samples = sampler.random_base2(max(0, math.ceil(math.log2(num_points))))[:num_points].tolist()
+
+    return [[round(axis.minimum + sample[a] * (axis.maximum - axis.minimum), 4) for a, axis in enumerate(axes)]
+                for sample in samples]
+
 """
     Get best systematiciy performing a grid search over the possible values of
     each individual axis. Modifies only a single axis at a time: all other axes
     are set to their default values.
+
+    Set workers above 1 to spread rendering and distance calculations for
+    the fonts and sizes over that many processes.
 """
-def grid_search(chars, fonts, font_sizes, grid_count):
-    for font in fonts:
-        for font_size in font_sizes:
-            experiment_name = "Grid: {0} size {1}, {2} facets.".format(font.name, font_size, grid_count)
-            experiment = Experiment(
-                name = experiment_name,
-                method = ExperimentType.GridSearch,
-                start_time = datetime.now(),
-                hyperparameters = json.dumps({"facets":grid_count}))
-            experiment.save()
-            print(experiment_name)
+def grid_search(chars, fonts, font_sizes, grid_count, workers=1):
+    consume(grid_search_results(chars, fonts, font_sizes, grid_count, workers))
 
-            random.seed(random_seed)
-        
-            renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
-            defaults = [axis.default for axis in renderer._axes]
-            best_corr = 0.0
-
-            for index in range(len(renderer._axes)):
-                axis = renderer._axes[index]
-                vals = get_grid_coords(axis.minimum, axis.maximum, grid_count)
-                best_axis_corr = 0.0
-
-                for idx, val in enumerate(vals):
-                    coords = defaults.copy()
-                    coords[index] = val
-                    
-                    try:
-                        result = systematicity.evaluate(chars, font, font_size, coords)
-                    except systematicity.FailedRenderException:
-                        # ignore failed render and carry on
-                        print("Failed render at point {0}".format(coords))
-                        continue
-
-                    save_result(experiment.id, result)
-                    
-                    print("Corr {0:.4f} for {1} pt {2} for {3} value of {4}".format(result.edit_correlation, font_size, font.name, axis.name, val))
-                    if result.edit_correlation > best_axis_corr:
-                        best_axis_corr = result.edit_correlation
-                    if result.edit_correlation > best_corr:
-                        best_corr = result.edit_correlation
-            
-                print("Best corr: {0:.4f} for axis {1}".format(best_axis_corr, axis.name))
+"""
+    Generator form of grid_search, yielding an ExperimentResult for each
+    point as its evaluation completes. See stream_experiments.
+"""
+def grid_search_results(chars, fonts, font_sizes, grid_count, workers=1):
+    runs = [(font, font_size, grid_search_run(chars, font, font_size, grid_count))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def grid_search_run(chars, font, font_size, grid_count, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+    defaults = [axis.default for axis in renderer._axes]
+
+    if checkpoint is None:
+        experiment_name = "Grid: {0} size {1}, {2} facets.".format(font.name, font_size, grid_count)
+        experiment = Experiment(
+            name = experiment_name,
+            method = ExperimentType.GridSearch,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"facets":grid_count}))
+        experiment.save()
+        print(experiment_name)
+        checkpoints = RunCheckpoint([experiment], ExperimentType.GridSearch, chars, font, font_size, {"grid_count":grid_count})
+
+        # Queue of (axis index, value) points still to evaluate
+        points = [[index, val] for index, axis in enumerate(renderer._axes) 
+                    for val in get_grid_coords(axis.minimum, axis.maximum, grid_count)]
+        best_corr = 0.0
+        best_axis_corr = 0.0
+        completed = 0
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        points = state["points"]
+        best_corr = state["best_corr"]
+        best_axis_corr = state["best_axis_corr"]
+        completed = checkpoint["iteration"]
+        print("Resuming {0} with {1} points left".format(experiment.name, len(points)))
+
+    while len(points) > 0:
+        checkpoints.save(completed, lambda: {"points":points, "best_corr":best_corr, "best_axis_corr":best_axis_corr})
+
+        index, val = points[0]
+        axis = renderer._axes[index]
+        coords = defaults.copy()
+        coords[index] = val
+
+        try:
+            result = yield coords
+        except systematicity.FailedRenderException:
+            # ignore failed render and carry on
+            print("Failed render at point {0}".format(coords))
+            result = None
+
+        if result is not None:
+            save_result(experiment.id, result)
             
-            print("Best corr: {0:.4f}".format(best_corr))
-            experiment.end_time = datetime.now()
-            experiment.save()
+            print("Corr {0:.4f} for {1} pt {2} for {3} value of {4}".format(result.edit_correlation, font_size, font.name, axis.name, val))
+            if result.edit_correlation > best_axis_corr:
+                best_axis_corr = result.edit_correlation
+            if result.edit_correlation > best_corr:
+                best_corr = result.edit_correlation
+
+        points.pop(0)
+        completed += 1
+        if len(points) == 0 or points[0][0] != index:
+            print("Best corr: {0:.4f} for axis {1}".format(best_axis_corr, axis.name))
+            best_axis_corr = 0.0
+    
+    print("Best corr: {0:.4f}".format(best_corr))
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
 
 """
     Perform a random search over the possible values of each font's axes.
     Generates num_points candidates.
 """
-def random_search(chars, fonts, font_sizes, num_points):
-    for font in fonts:
-        for font_size in font_sizes:
-            experiment_name = "Random: {0} size {1}, {2} points.".format(font.name, font_size, num_points)
-            experiment = Experiment(
-                name = experiment_name,
-                method = ExperimentType.RandomSearch,
-                start_time = datetime.now(),
-                hyperparameters = json.dumps({"points":num_points}))
-            experiment.save()
-            print(experiment_name)
+def random_search(chars, fonts, font_sizes, num_points, workers=1):
+    consume(random_search_results(chars, fonts, font_sizes, num_points, workers))
 
-            random.seed(random_seed)
+"""
+    Generator form of random_search, yielding an ExperimentResult for each
+    point as its evaluation completes. See stream_experiments.
+"""
+def random_search_results(chars, fonts, font_sizes, num_points, workers=1):
+    runs = [(font, font_size, random_search_run(chars, font, font_size, num_points))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def random_search_run(chars, font, font_size, num_points, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
 
-            renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
+    if checkpoint is None:
+        experiment_name = "Random: {0} size {1}, {2} points.".format(font.name, font_size, num_points)
+        experiment = Experiment(
+            name = experiment_name,
+            method = ExperimentType.RandomSearch,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"points":num_points}))
+        experiment.save()
+        print(experiment_name)
+        checkpoints = RunCheckpoint([experiment], ExperimentType.RandomSearch, chars, font, font_size, {"num_points":num_points})
 
-            points = get_random_coords(renderer._axes, num_points)
-            # Include min and max
-            points.insert(0, [axis.minimum for axis in renderer._axes])
-            points.append([axis.maximum for axis in renderer._axes])
+        # Each run has its own generator so that concurrent runs stay repeatable
+        rng = random.Random(random_seed)
 
-            best_corr = 0.0
+        points = get_random_coords(renderer._axes, num_points, rng)
+        # Include min and max
+        points.insert(0, [axis.minimum for axis in renderer._axes])
+        points.append([axis.maximum for axis in renderer._axes])
 
-            iteration = 1
-            for point in points:
-                try:
-                    result = systematicity.evaluate(chars, font, font_size, point)
-                except systematicity.FailedRenderException:
-                        # ignore failed render and carry on to next point
-                        print("{0} Failed render at point {1}".format(iteration, point))
-                        continue
-                save_result(experiment.id, result)
+        best_corr = 0.0
+        iteration = 1
+        completed = 0
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        points = state["points"]
+        best_corr = state["best_corr"]
+        iteration = state["iteration"]
+        completed = checkpoint["iteration"]
+        print("Resuming {0} with {1} points left".format(experiment.name, len(points)))
 
-                print("{0} Corr: {1:.4f} for {2} pt {3} with coords {4}...".format(
-                    iteration, result.edit_correlation, font_size, font.name, point))
-                if result.edit_correlation > best_corr:
-                    best_corr = result.edit_correlation
+    while len(points) > 0:
+        checkpoints.save(completed, lambda: {"points":points, "best_corr":best_corr, "iteration":iteration})
 
-                iteration += 1
-            print("Best corr: {0:.4f}".format(best_corr))
+        point = points.pop(0)
+        completed += 1
+        try:
+            result = yield point
+        except systematicity.FailedRenderException:
+                # ignore failed render and carry on to next point
+                print("{0} Failed render at point {1}".format(iteration, point))
+                continue
+        save_result(experiment.id, result)
 
-            experiment.end_time = datetime.now()
-            experiment.save()
+        print("{0} Corr: {1:.4f} for {2} pt {3} with coords {4}...".format(
+            iteration, result.edit_correlation, font_size, font.name, point))
+        if result.edit_correlation > best_corr:
+            best_corr = result.edit_correlation
+
+        iteration += 1
+    print("Best corr: {0:.4f}".format(best_corr))
+
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
+
+"""
+    Search the joint space of each font's axes, evaluating points of a
+    design from get_design_coords in batches of batch_size. Unlike
+    grid_search, every axis varies at once.
+
+    With workers > 1 the points of each batch are evaluated side by side.
+    Points in a batch are ordered by their coordinates, so that neighbouring
+    points, which often share glyph sets once rounded, are evaluated
+    together.
+"""
+def design_space_search(chars, fonts, font_sizes, num_points, design="latin", batch_size=16, workers=1):
+    consume(design_space_search_results(chars, fonts, font_sizes, num_points, design, batch_size, workers))
+
+"""
+    Generator form of design_space_search, yielding an ExperimentResult for
+    each point as its evaluation completes. See stream_experiments.
+"""
+def design_space_search_results(chars, fonts, font_sizes, num_points, design="latin", batch_size=16, workers=1):
+    runs = [(font, font_size, design_space_run(chars, font, font_size, num_points, design, batch_size))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def design_space_run(chars, font, font_size, num_points, design, batch_size, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+
+    if checkpoint is None:
+        experiment_name = "Design space: {0} size {1}, {2} {3} points.".format(font.name, font_size, num_points, design)
+        experiment = Experiment(
+            name = experiment_name,
+            method = ExperimentType.DesignSpaceSearch,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"points":num_points, "design":design, "batch_size":batch_size}))
+        experiment.save()
+        print(experiment_name)
+        checkpoints = RunCheckpoint([experiment], ExperimentType.DesignSpaceSearch, chars, font, font_size, 
+            {"num_points":num_points, "design":design, "batch_size":batch_size})
+
+        rng = random.Random(random_seed)
+        # Sorted as a whole, so that each batch holds neighbouring designs,
+        # which differ in as few axes as the design allows
+        points = sorted(get_design_coords(renderer._axes, num_points, design, rng))
+        best_corr = 0.0
+        best_point = None
+        completed = 0
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        points = state["points"]
+        best_corr = state["best_corr"]
+        best_point = state["best_point"]
+        completed = checkpoint["iteration"]
+        print("Resuming {0} with {1} points left".format(experiment.name, len(points)))
+
+    while len(points) > 0:
+        checkpoints.save(completed, lambda: {"points":points, "best_corr":best_corr, "best_point":best_point})
+
+        batch = points[:batch_size]
+        outcomes = yield EvaluationBatch(batch)
+
+        for point, result in zip(batch, outcomes):
+            if isinstance(result, systematicity.FailedRenderException):
+                # ignore failed render and carry on
+                print("Failed render at point {0}".format(point))
+                continue
+            save_result(experiment.id, result)
+
+            print("Corr: {0:.4f} for {1} pt {2} with coords {3}".format(result.edit_correlation, font_size, font.name, point))
+            if result.edit_correlation > best_corr:
+                best_corr = result.edit_correlation
+                best_point = point
+
+        del points[:batch_size]
+        completed += 1
+
+    print("Best corr: {0:.4f} at {1}".format(best_corr, best_point))
+
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
 
 """
    Simulated annealing algorithm for finding optimal coordinates. 
 """
-def simulated_annealing(chars, fonts, font_sizes, init_temp, time, alter_type="gaussian", alter_range="0.1", method=ExperimentType.SimulatedAnnealing):
+def simulated_annealing(chars, fonts, font_sizes, init_temp, time, alter_type="gaussian", alter_range="0.1", method=ExperimentType.SimulatedAnnealing, workers=1):
+    consume(simulated_annealing_results(chars, fonts, font_sizes, init_temp, time, alter_type, alter_range, method, workers))
+
+"""
+    Generator form of simulated_annealing, yielding an ExperimentResult for
+    each candidate as its evaluation completes. See stream_experiments.
+"""
+def simulated_annealing_results(chars, fonts, font_sizes, init_temp, time, alter_type="gaussian", alter_range="0.1", method=ExperimentType.SimulatedAnnealing, workers=1):
     if method not in [ExperimentType.SimulatedAnnealing, ExperimentType.SimulatedAnnealingMin]:
         raise("Method must be one of the simulated annealing types")
 
-    for font in fonts:
-        for font_size in font_sizes:
-            experiment_name = "Simulated Annealing: {0} size {1}, initial temp {2}, {3} iterations.".format(font.name, font_size, init_temp, time)
+    runs = [(font, font_size, simulated_annealing_run(chars, font, font_size, init_temp, time, alter_type, alter_range, method))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def simulated_annealing_run(chars, font, font_size, init_temp, time, alter_type, alter_range, method, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+
+    if checkpoint is None:
+        experiment_name = "Simulated Annealing: {0} size {1}, initial temp {2}, {3} iterations.".format(font.name, font_size, init_temp, time)
+        experiment = Experiment(
+            name = experiment_name,
+            method = method,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"temp":init_temp, "iterations":time, "alteration_type":alter_type, "alteration_range":alter_range}))
+        experiment.save()
+        checkpoints = RunCheckpoint([experiment], method, chars, font, font_size, 
+            {"init_temp":init_temp, "time":time, "alter_type":alter_type, "alter_range":alter_range})
+        
+        rng = random.Random(random_seed)
+
+        print(experiment_name)
+        temperature = init_temp
+        #candidate = get_random_coords(renderer._axes, 1)[0]
+        candidate = [axis.default for axis in renderer._axes]
+        corr = None
+        iteration = 0
+        best_candidate = candidate
+        best_corr = None
+        best_iteration = iteration
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        rng = random.Random()
+        set_rng_state(rng, state["rng"])
+        temperature = state["temperature"]
+        candidate = state["candidate"]
+        corr = state["corr"]
+        iteration = state["iteration"]
+        best_candidate = state["best_candidate"]
+        best_corr = state["best_corr"]
+        best_iteration = state["best_iteration"]
+        print("Resuming {0} at iteration {1}".format(experiment.name, iteration))
+
+    def get_state():
+        return {"rng":get_rng_state(rng), "temperature":temperature, "candidate":candidate, "corr":corr, "iteration":iteration,
+            "best_candidate":best_candidate, "best_corr":best_corr, "best_iteration":best_iteration}
+
+    if corr is None:
+        # The starting candidate has not been evaluated yet
+        checkpoints.save(iteration, get_state)
+        result = yield candidate
+        save_result(experiment.id, result)
+        corr = result.edit_correlation
+        
+        iteration = 1
+        
+        best_candidate = candidate
+        best_corr = corr
+        best_iteration = iteration
+
+        print("Starting at {0}, {1}".format(best_candidate, best_corr))
+
+    while iteration < time and temperature > 0:
+        checkpoints.save(iteration, get_state)
+
+        if alter_type == "gaussian":
+            new_candidate = alter_gaussian(candidate, renderer._axes, alter_range, rng)
+        else:
+            new_candidate = alter_uniform(candidate, renderer._axes, alter_range, rng)
+        
+        try:
+            result = yield new_candidate
+        except systematicity.FailedRenderException:
+            # ignore failed render and carry on to a new candidate
+            continue
+
+        save_result(experiment.id, result)
+        new_corr = result.edit_correlation
+        
+        delta = new_corr - corr
+        if method == ExperimentType.SimulatedAnnealingMin:
+            delta = -(delta)
+
+        p = rng.uniform(0.0, 1.0)
+        
+        if math.exp(delta/temperature) > p:
+            print("{0:3d} MOVE: {1:.4f}, {2:.4f} > {3:.4f}, temp: {4:.4f}, {5}".format(iteration, new_corr, math.exp(delta/temperature), p, temperature, new_candidate))
+            
+            candidate = new_candidate
+            corr = new_corr                
+        else:
+            print("{0:3d} STAY: {1:.4f}, {2:.4f} <= {3:.4f}, temp: {4:.4f}, {5}".format(iteration, new_corr, math.exp(delta/temperature), p, temperature, new_candidate))
+
+        if ((method == ExperimentType.SimulatedAnnealing and corr > best_corr) or
+           (method == ExperimentType.SimulatedAnnealingMin and corr < best_corr)):                    
+            best_corr = corr
+            best_candidate = candidate
+            best_iteration = iteration
+
+        iteration += 1
+        temperature = init_temp * (1 - iteration/time)
+
+    print("Best candidate for {0} size {1} in iteration {2}: {3:.4f}, {4}".format(font.name, font_size, best_iteration, best_corr, best_candidate))
+    
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
+
+"""
+    Generates a geometric ladder of chain temperatures for parallel tempering,
+    from min_temp up to max_temp.
+"""
+def get_temperature_ladder(min_temp, max_temp, chains):
+    if chains < 2:
+        return [max_temp]
+    if min_temp <= 0 or min_temp > max_temp:
+        raise Exception("Temperatures must satisfy 0 < min_temp <= max_temp")
+
+    ratio = (max_temp / min_temp) ** (1 / (chains - 1))
+    return [min_temp * ratio ** i for i in range(chains)]
+
+"""
+    Parallel tempering (replica exchange) search for optimal coordinates. Runs
+    one Metropolis chain per temperature, all starting at the default
+    coordinates. Each iteration evaluates one proposal per chain as a single
+    batch, so with workers > 1 the chains are rendered and measured
+    concurrently. Every swap_interval iterations, neighbouring chains exchange
+    states with the usual replica exchange acceptance probability, letting
+    good regions found by hot chains move down to the cold ones.
+
+    Each chain is recorded as its own Experiment, holding the glyph sets of
+    all the proposals evaluated at that temperature.
+"""
+def parallel_tempering(chars, fonts, font_sizes, temperatures, time, swap_interval=10, alter_type="gaussian", alter_range=0.1, method=ExperimentType.ParallelTempering, workers=1):
+    consume(parallel_tempering_results(chars, fonts, font_sizes, temperatures, time, swap_interval, alter_type, alter_range, method, workers))
+
+"""
+    Generator form of parallel_tempering, yielding an ExperimentResult for
+    each proposal as its evaluation completes. The index of a result is the
+    chain that made the proposal. See stream_experiments.
+"""
+def parallel_tempering_results(chars, fonts, font_sizes, temperatures, time, swap_interval=10, alter_type="gaussian", alter_range=0.1, method=ExperimentType.ParallelTempering, workers=1):
+    if method not in [ExperimentType.ParallelTempering, ExperimentType.ParallelTemperingMin]:
+        raise Exception("Method must be one of the parallel tempering types")
+
+    runs = [(font, font_size, parallel_tempering_run(chars, font, font_size, temperatures, time, swap_interval, alter_type, alter_range, method))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def parallel_tempering_run(chars, font, font_size, temperatures, time, swap_interval, alter_type, alter_range, method, checkpoint=None):
+    chain_count = len(temperatures)
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+
+    if checkpoint is None:
+        experiments = []
+        for chain, temperature in enumerate(temperatures):
+            experiment_name = "Parallel Tempering: {0} size {1}, chain {2} of {3}, temp {4:.4f}, {5} iterations.".format(
+                font.name, font_size, chain + 1, chain_count, temperature, time)
             experiment = Experiment(
                 name = experiment_name,
                 method = method,
                 start_time = datetime.now(),
-                hyperparameters = json.dumps({"temp":init_temp, "iterations":time, "alteration_type":alter_type, "alteration_range":alter_range}))
+                hyperparameters = json.dumps({"temp":temperature, "chain":chain, "temperatures":temperatures, "iterations":time,
+                    "swap_interval":swap_interval, "alteration_type":alter_type, "alteration_range":alter_range}))
             experiment.save()
-            
-            random.seed(random_seed)
-
+            experiments.append(experiment)
             print(experiment_name)
-            temperature = init_temp
-            renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
-            #candidate = get_random_coords(renderer._axes, 1)[0]
-            candidate = [axis.default for axis in renderer._axes]
-            
-            result = systematicity.evaluate(chars, font, font_size, candidate)
-            save_result(experiment.id, result)
-            corr = result.edit_correlation
-            
-            iteration = 1
-            
-            best_candidate = candidate
-            best_corr = corr
-            best_iteration = iteration
+        checkpoints = RunCheckpoint(experiments, method, chars, font, font_size, 
+            {"temperatures":temperatures, "time":time, "swap_interval":swap_interval, "alter_type":alter_type, "alter_range":alter_range})
+
+        rng = random.Random(random_seed)
+        candidates = [[axis.default for axis in renderer._axes] for _ in range(chain_count)]
+        corrs = None
+        iteration = 0
+        best_candidate = candidates[0]
+        best_corr = None
+        best_iteration = 0
+    else:
+        checkpoints, experiments = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        rng = random.Random()
+        set_rng_state(rng, state["rng"])
+        candidates = state["candidates"]
+        corrs = state["corrs"]
+        iteration = state["iteration"]
+        best_candidate = state["best_candidate"]
+        best_corr = state["best_corr"]
+        best_iteration = state["best_iteration"]
+        print("Resuming parallel tempering for {0} size {1} at iteration {2}".format(font.name, font_size, iteration))
+
+    def get_state():
+        return {"rng":get_rng_state(rng), "candidates":candidates, "corrs":corrs, "iteration":iteration,
+            "best_candidate":best_candidate, "best_corr":best_corr, "best_iteration":best_iteration}
+
+    def improves(corr, other_corr):
+        if method == ExperimentType.ParallelTemperingMin:
+            return corr < other_corr
+        return corr > other_corr
+
+    if corrs is None:
+        # The starting candidates have not been evaluated yet
+        checkpoints.save(iteration, get_state)
+        outcomes = yield EvaluationBatch(candidates)
+        for outcome in outcomes:
+            if isinstance(outcome, systematicity.FailedRenderException):
+                raise outcome
+        for chain in range(chain_count):
+            save_result(experiments[chain].id, outcomes[chain])
+        corrs = [outcome.edit_correlation for outcome in outcomes]
+
+        best_candidate = candidates[0]
+        best_corr = corrs[0]
+        best_iteration = 0
+        iteration = 1
+        print("Starting at {0}, {1}".format(best_candidate, best_corr))
+
+    while iteration < time:
+        checkpoints.save(iteration, get_state)
+
+        proposals = []
+        for chain in range(chain_count):
+            if alter_type == "gaussian":
+                proposals.append(alter_gaussian(candidates[chain], renderer._axes, alter_range, rng))
+            else:
+                proposals.append(alter_uniform(candidates[chain], renderer._axes, alter_range, rng))
+
+        outcomes = yield EvaluationBatch(proposals)
+
+        for chain in range(chain_count):
+            result = outcomes[chain]
+            if isinstance(result, systematicity.FailedRenderException):
+                # ignore failed render, the chain stays where it is
+                continue
+
+            save_result(experiments[chain].id, result)
+            new_corr = result.edit_correlation
 
-            print("Starting at {0}, {1}".format(best_candidate, best_corr))
-
-            while iteration < time and temperature > 0:
-                if alter_type == "gaussian":
-                    new_candidate = alter_gaussian(candidate, renderer._axes, alter_range)
-                else:
-                    new_candidate = alter_uniform(candidate, renderer._axes, alter_range)
-                
-                try:
-                    result = systematicity.evaluate(chars, font, font_size, new_candidate)
-                except systematicity.FailedRenderException:
-                    # ignore failed render and carry on to a new candidate
-                    continue
-
-                save_result(experiment.id, result)
-                new_corr = result.edit_correlation
-                
-                delta = new_corr - corr
-                if method == ExperimentType.SimulatedAnnealingMin:
+            delta = new_corr - corrs[chain]
+            if method == ExperimentType.ParallelTemperingMin:
+                delta = -(delta)
+
+            p = rng.uniform(0.0, 1.0)
+            acceptance = math.exp(min(delta/temperatures[chain], 0.0))
+            if acceptance > p:
+                print("{0:3d} chain {1} MOVE: {2:.4f}, {3:.4f} > {4:.4f}, temp: {5:.4f}, {6}".format(
+                    iteration, chain + 1, new_corr, acceptance, p, temperatures[chain], proposals[chain]))
+                candidates[chain] = proposals[chain]
+                corrs[chain] = new_corr
+            else:
+                print("{0:3d} chain {1} STAY: {2:.4f}, {3:.4f} <= {4:.4f}, temp: {5:.4f}, {6}".format(
+                    iteration, chain + 1, new_corr, acceptance, p, temperatures[chain], proposals[chain]))
+
+            if improves(corrs[chain], best_corr):
+                best_corr = corrs[chain]
+                best_candidate = candidates[chain]
+                best_iteration = iteration
+
+        if iteration % swap_interval == 0:
+            # Alternate between even and odd neighbour pairs
+            offset = (iteration // swap_interval) % 2
+            for chain in range(offset, chain_count - 1, 2):
+                delta = (corrs[chain + 1] - corrs[chain]) * (1/temperatures[chain] - 1/temperatures[chain + 1])
+                if method == ExperimentType.ParallelTemperingMin:
                     delta = -(delta)
 
-                p = random.uniform(0.0, 1.0)
-                
-                if math.exp(delta/temperature) > p:
-                    print("{0:3d} MOVE: {1:.4f}, {2:.4f} > {3:.4f}, temp: {4:.4f}, {5}".format(iteration, new_corr, math.exp(delta/temperature), p, temperature, new_candidate))
-                    
-                    candidate = new_candidate
-                    corr = new_corr                
-                else:
-                    print("{0:3d} STAY: {1:.4f}, {2:.4f} <= {3:.4f}, temp: {4:.4f}, {5}".format(iteration, new_corr, math.exp(delta/temperature), p, temperature, new_candidate))
-
-                if ((method == ExperimentType.SimulatedAnnealing and corr > best_corr) or
-                   (method == ExperimentType.SimulatedAnnealingMin and corr < best_corr)):                    
-                    best_corr = corr
-                    best_candidate = candidate
-                    best_iteration = iteration
-
-                iteration += 1
-                temperature = init_temp * (1 - iteration/time)
+                p = rng.uniform(0.0, 1.0)
+                if math.exp(min(delta, 0.0)) > p:
+                    print("{0:3d} SWAP: chains {1} and {2}".format(iteration, chain + 1, chain + 2))
+                    candidates[chain], candidates[chain + 1] = candidates[chain + 1], candidates[chain]
+                    corrs[chain], corrs[chain + 1] = corrs[chain + 1], corrs[chain]
+
+        iteration += 1
+
+    print("Best candidate for {0} size {1} in iteration {2}: {3:.4f}, {4}".format(font.name, font_size, best_iteration, best_corr, best_candidate))
+
+    checkpoints.finish()
+    for experiment in experiments:
+        experiment.end_time = datetime.now()
+        experiment.save()
+
+"""
+    Evolution strategy search of coordinates (CMA-ES, see evolution.py).
+    Each generation, a population of candidates is drawn around the current
+    mean and evaluated as one batch, so with workers > 1 the whole population
+    is evaluated side by side. The distribution adapts its own step sizes
+    and their directions from the best candidates, so unlike
+    simulated_annealing there is no alter_range to tune. sigma is the
+    initial step size as a fraction of each axis's range.
+
+    Stops after the given number of generations, or once the distribution
+    has narrowed below the precision coordinates are rounded to.
+"""
+def cma_es(chars, fonts, font_sizes, generations, population_size=None, sigma=0.3, method=ExperimentType.CMAES, workers=1):
+    consume(cma_es_results(chars, fonts, font_sizes, generations, population_size, sigma, method, workers))
+
+"""
+    Generator form of cma_es, yielding an ExperimentResult for each
+    candidate as its evaluation completes. See stream_experiments.
+"""
+def cma_es_results(chars, fonts, font_sizes, generations, population_size=None, sigma=0.3, method=ExperimentType.CMAES, workers=1):
+    if method not in [ExperimentType.CMAES, ExperimentType.CMAESMin]:
+        raise Exception("Method must be one of the CMA-ES types")
+
+    runs = [(font, font_size, cma_es_run(chars, font, font_size, generations, population_size, sigma, method))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def cma_es_run(chars, font, font_size, generations, population_size, sigma, method, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+    axes = renderer._axes
+    if len(axes) == 0:
+        # A font without axes has only its defaults to evaluate
+        yield from defaults_run(font, font_size, "CMA-ES", method,
+            {"generations":generations, "population":population_size, "sigma":sigma})
+        return
+    strategy = evolution.CMAES(surrogate.to_unit([axis.default for axis in axes], axes), sigma, population_size)
+
+    if checkpoint is None:
+        experiment_name = "CMA-ES: {0} size {1}, population {2}, {3} generations.".format(
+            font.name, font_size, strategy.population_size, generations)
+        experiment = Experiment(
+            name = experiment_name,
+            method = method,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"generations":generations, "population":strategy.population_size, "sigma":sigma}))
+        experiment.save()
+        print(experiment_name)
+        checkpoints = RunCheckpoint([experiment], method, chars, font, font_size, 
+            {"generations":generations, "population_size":population_size, "sigma":sigma})
+
+        rng = random.Random(random_seed)
+        best_candidate = None
+        best_corr = None
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        rng = random.Random()
+        set_rng_state(rng, state["rng"])
+        strategy.set_state(state["strategy"])
+        best_candidate = state["best_candidate"]
+        best_corr = state["best_corr"]
+        print("Resuming {0} at generation {1}".format(experiment.name, strategy.generation))
+
+    sign = -1 if method == ExperimentType.CMAESMin else 1
+
+    # Below this spread, candidates differ by less than the rounding of coordinates
+    min_spread = 0.5 * 10 ** -memo.COORDINATE_DECIMALS / max(axis.maximum - axis.minimum for axis in axes)
+
+    while strategy.generation < generations and strategy.spread > min_spread:
+        checkpoints.save(strategy.generation, lambda: {"rng":get_rng_state(rng), "strategy":strategy.get_state(),
+            "best_candidate":best_candidate, "best_corr":best_corr})
+
+        population = strategy.ask(np.random.RandomState(rng.randrange(2**32)))
+        candidates = [surrogate.from_unit(point, axes) for point in population]
+        outcomes = yield EvaluationBatch(candidates)
+
+        fitness = []
+        for candidate, result in zip(candidates, outcomes):
+            if isinstance(result, systematicity.FailedRenderException):
+                # rank failed renders last
+                print("{0:3d} Failed render at point {1}".format(strategy.generation, candidate))
+                fitness.append(-math.inf)
+                continue
+            save_result(experiment.id, result)
+            fitness.append(sign * result.edit_correlation)
+            if best_corr is None or sign * result.edit_correlation > sign * best_corr:
+                best_corr = result.edit_correlation
+                best_candidate = candidate
+
+        strategy.tell(population, fitness)
+        print("{0:3d} Best: {1}, sigma: {2:.4f}, mean: {3}".format(
+            strategy.generation, best_corr, strategy.sigma, surrogate.from_unit(strategy.mean.tolist(), axes)))
+
+    if best_corr is not None:
+        print("Best candidate for {0} size {1}: {2:.4f}, {3}".format(font.name, font_size, best_corr, best_candidate))
+
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
+
+"""
+    Run generator that evaluates a font's default coordinates once, for
+    searches over the axes of fonts that have none.
+"""
+def defaults_run(font, font_size, label, method, hyperparameters):
+    experiment_name = "{0}: {1} size {2}, defaults only (no axes).".format(label, font.name, font_size)
+    experiment = Experiment(
+        name = experiment_name,
+        method = method,
+        start_time = datetime.now(),
+        hyperparameters = json.dumps(hyperparameters))
+    experiment.save()
+    print(experiment_name)
+
+    (result,) = yield EvaluationBatch([[]])
+    if isinstance(result, systematicity.FailedRenderException):
+        print("Failed render at the defaults of {0}".format(font.name))
+    else:
+        save_result(experiment.id, result)
+        print("Corr: {0:.4f} for {1} pt {2} at its defaults".format(result.edit_correlation, font_size, font.name))
+
+    experiment.end_time = datetime.now()
+    experiment.save()
+
+"""
+    Bayesian optimization of coordinates. A Gaussian process model of
+    correlation over the axes (see surrogate.py) is fitted to the points
+    evaluated so far, and the points with the highest expected improvement
+    are evaluated next, so few evaluations are spent far from promising
+    regions. Stops after time evaluations.
+
+    Starts by evaluating the default coordinates and initial_points points of
+    a Latin hypercube (by default, twice the number of axes) together. After
+    that, batch_size points are proposed at a time; with workers > 1, a
+    batch_size of at least workers keeps them busy.
+"""
+def bayesian_optimization(chars, fonts, font_sizes, time, initial_points=None, batch_size=1, method=ExperimentType.BayesianOptimization, workers=1):
+    consume(bayesian_optimization_results(chars, fonts, font_sizes, time, initial_points, batch_size, method, workers))
+
+"""
+    Generator form of bayesian_optimization, yielding an ExperimentResult for
+    each point as its evaluation completes. See stream_experiments.
+"""
+def bayesian_optimization_results(chars, fonts, font_sizes, time, initial_points=None, batch_size=1, method=ExperimentType.BayesianOptimization, workers=1):
+    if method not in [ExperimentType.BayesianOptimization, ExperimentType.BayesianOptimizationMin]:
+        raise Exception("Method must be one of the bayesian optimization types")
+
+    runs = [(font, font_size, bayesian_optimization_run(chars, font, font_size, time, initial_points, batch_size, method))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def bayesian_optimization_run(chars, font, font_size, time, initial_points, batch_size, method, checkpoint=None):
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
+    axes = renderer._axes
+    if len(axes) == 0:
+        # A font without axes has only its defaults to evaluate
+        yield from defaults_run(font, font_size, "Bayesian Optimization", method,
+            {"iterations":time, "initial_points":0, "batch_size":batch_size})
+        return
+
+    if checkpoint is None:
+        if initial_points is None:
+            initial_points = 2 * len(axes)
+
+        experiment_name = "Bayesian Optimization: {0} size {1}, {2} evaluations.".format(font.name, font_size, time)
+        experiment = Experiment(
+            name = experiment_name,
+            method = method,
+            start_time = datetime.now(),
+            hyperparameters = json.dumps({"iterations":time, "initial_points":initial_points, "batch_size":batch_size}))
+        experiment.save()
+        print(experiment_name)
+        checkpoints = RunCheckpoint([experiment], method, chars, font, font_size, 
+            {"time":time, "initial_points":initial_points, "batch_size":batch_size})
+
+        rng = random.Random(random_seed)
+        pending = [[axis.default for axis in axes]] + get_design_coords(axes, initial_points, "latin", rng)
+        # [coords, correlation] of each point evaluated
+        observations = []
+        evaluations = 0
+        iteration = 0
+    else:
+        checkpoints, (experiment,) = RunCheckpoint.load(checkpoint)
+        state = checkpoint["state"]
+        rng = random.Random()
+        set_rng_state(rng, state["rng"])
+        pending = state["pending"]
+        observations = state["observations"]
+        evaluations = state["evaluations"]
+        iteration = state["iteration"]
+        print("Resuming {0} after {1} evaluations".format(experiment.name, evaluations))
+
+    def get_state():
+        return {"rng":get_rng_state(rng), "pending":pending, "observations":observations, 
+            "evaluations":evaluations, "iteration":iteration}
+
+    sign = -1 if method == ExperimentType.BayesianOptimizationMin else 1
+
+    while evaluations < time:
+        checkpoints.save(iteration, get_state)
+
+        count = time - evaluations
+        if len(pending) > 0:
+            batch = pending[:count]
+            pending = []
+        elif len(observations) < 2:
+            # Too little to model yet
+            batch = get_random_coords(axes, min(batch_size, count), rng)
+        else:
+            x = [surrogate.to_unit(coords, axes) for coords, _ in observations]
+            y = [sign * corr for _, corr in observations]
+            random_state = np.random.RandomState(rng.randrange(2**32))
+            batch = [surrogate.from_unit(point, axes) 
+                        for point in surrogate.propose(x, y, min(batch_size, count), random_state)]
+
+        outcomes = yield EvaluationBatch(batch)
+
+        for point, result in zip(batch, outcomes):
+            if isinstance(result, systematicity.FailedRenderException):
+                # ignore failed render, the model learns nothing from it
+                print("{0:3d} Failed render at point {1}".format(iteration, point))
+                continue
+            save_result(experiment.id, result)
+            observations.append([point, result.edit_correlation])
+            print("{0:3d} Corr: {1:.4f} for {2} pt {3} with coords {4}".format(
+                iteration, result.edit_correlation, font_size, font.name, point))
+
+        evaluations += len(batch)
+        iteration += 1
+
+    if len(observations) > 0:
+        best_candidate, best_corr = max(observations, key=lambda observation: sign * observation[1])
+        print("Best candidate for {0} size {1}: {2:.4f}, {3}".format(font.name, font_size, best_corr, best_candidate))
+
+    checkpoints.finish()
+    experiment.end_time = datetime.now()
+    experiment.save()
+
+def default_systematicity(chars, fonts, font_sizes, workers=1):
+    consume(default_systematicity_results(chars, fonts, font_sizes, workers))
+
+"""
+    Generator form of default_systematicity, yielding an ExperimentResult for
+    each font and size as its evaluation completes. See stream_experiments.
+"""
+def default_systematicity_results(chars, fonts, font_sizes, workers=1):
+    runs = [(font, font_size, default_systematicity_run(chars, font, font_size))
+                for font in fonts for font_size in font_sizes]
+    yield from stream_experiments(chars, runs, workers)
+
+"""
+    Run generator for a single font and size. See run_experiments.
+"""
+def default_systematicity_run(chars, font, font_size):
+    experiment_name = "Default: {0} size {1}.".format(font.name, font_size)
+    experiment = Experiment(
+        name = experiment_name,
+        method = ExperimentType.DefaultSystematicity,
+        start_time = datetime.now(),
+        hyperparameters = None)
+    experiment.save()
+    print(experiment_name)
+
+    try:
+        result = yield None
+    except systematicity.FailedRenderException:
+        print("Unable to determine systematicity for {0} pt {1} because at least one glyph failed to render."
+            .format(font_size, font.name))
+        return
+
+    save_result(experiment.id, result)
+
+    print("Corr: {0:.4f} for {1} pt {2}.".format(
+            result.edit_correlation, font_size, font.name))
     
-            print("Best candidate for {0} size {1} in iteration {2}: {3:.4f}, {4}".format(font.name, font_size, best_iteration, best_corr, best_candidate))
-            
-            experiment.end_time = datetime.now()
-            experiment.save()
+    experiment.end_time = datetime.now()
+    experiment.save()
 
-def default_systematicity(chars, fonts, font_sizes):
-    for font in fonts:
-        for font_size in font_sizes:
-            with data.db.atomic():
-                experiment_name = "Default: {0} size {1}.".format(font.name, font_size)
-                experiment = Experiment(
-                    name = experiment_name,
-                    method = ExperimentType.DefaultSystematicity,
-                    start_time = datetime.now(),
-                    hyperparameters = None)
-                experiment.save()
-                print(experiment_name)
-
-                renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
-                defaults = [axis.default for axis in renderer._axes]
-
-                try:
-                    result = systematicity.evaluate(chars, font, font_size, coords=None)
-                except systematicity.FailedRenderException:
-                    print("Unable to determine systematicity for {0} pt {1} because at least one glyph failed to render."
-                        .format(font_size, font.name))
-                    continue
-
-                save_result(experiment.id, result)
-
-                print("Corr: {0:.4f} for {1} pt {2}.".format(
-                        result.edit_correlation, font_size, font.name))
-                
-                experiment.end_time = datetime.now()
-                experiment.save()
-            
+"""
+    Resumes a run that was interrupted, from the last checkpoint saved for
+    experiment_id (see checkpoint_interval). Any experiment of the run may be
+    given, such as any chain of a parallel tempering run. Points evaluated
+    after the checkpoint are evaluated again, and are answered from the
+    stored glyph sets where possible.
+"""
+def resume_experiment(experiment_id, workers=1):
+    consume(resume_experiment_results(experiment_id, workers))
+
+"""
+    Generator form of resume_experiment. See stream_experiments.
+"""
+def resume_experiment_results(experiment_id, workers=1):
+    record = ExperimentCheckpoint.get_or_none(ExperimentCheckpoint.experiment == experiment_id)
+    if record is None:
+        raise Exception("No checkpoint saved for experiment {0}".format(experiment_id))
+
+    checkpoint = json.loads(record.state)
+    font = Font.get_by_id(checkpoint["font_id"])
+    chars = checkpoint["chars"]
+    font_size = checkpoint["font_size"]
+    method = ExperimentType[checkpoint["method"]]
+    parameters = checkpoint["parameters"]
+
+    if method == ExperimentType.GridSearch:
+        run = grid_search_run(chars, font, font_size, parameters["grid_count"], checkpoint)
+    elif method == ExperimentType.RandomSearch:
+        run = random_search_run(chars, font, font_size, parameters["num_points"], checkpoint)
+    elif method == ExperimentType.DesignSpaceSearch:
+        run = design_space_run(chars, font, font_size, parameters["num_points"], parameters["design"], 
+            parameters["batch_size"], checkpoint)
+    elif method in (ExperimentType.SimulatedAnnealing, ExperimentType.SimulatedAnnealingMin):
+        run = simulated_annealing_run(chars, font, font_size, parameters["init_temp"], parameters["time"],
+            parameters["alter_type"], parameters["alter_range"], method, checkpoint)
+    elif method in (ExperimentType.ParallelTempering, ExperimentType.ParallelTemperingMin):
+        run = parallel_tempering_run(chars, font, font_size, parameters["temperatures"], parameters["time"],
+            parameters["swap_interval"], parameters["alter_type"], parameters["alter_range"], method, checkpoint)
+    elif method in (ExperimentType.BayesianOptimization, ExperimentType.BayesianOptimizationMin):
+        run = bayesian_optimization_run(chars, font, font_size, parameters["time"], parameters["initial_points"],
+            parameters["batch_size"], method, checkpoint)
+    elif method in (ExperimentType.CMAES, ExperimentType.CMAESMin):
+        run = cma_es_run(chars, font, font_size, parameters["generations"], parameters["population_size"],
+            parameters["sigma"], method, checkpoint)
+    else:
+        raise Exception("Experiments of method {0} cannot be resumed".format(method.name))
+
+    yield from stream_experiments(chars, [(font, font_size, run)], workers)
+
+"""
+    Runs experiments to completion. See stream_experiments.
+"""
+def run_experiments(chars, runs, workers=1):
+    consume(stream_experiments(chars, runs, workers))
+
+"""
+    Runs experiments, yielding an ExperimentResult for each point as its
+    evaluation completes. Each run is a (font, font_size, generator) tuple,
+    where the generator yields the coordinates it wants evaluated and is sent
+    the SystematicityResult for them, or has FailedRenderException raised at
+    the yield if a glyph failed to render. A generator may instead yield an
+    EvaluationBatch of several coordinates, in which case it is sent a list
+    holding a SystematicityResult or FailedRenderException per point.
+
+    Each result is yielded before its run is sent it, so consumers see it
+    as soon as it is known. Closing the generator early, for example to stop
+    once a good enough point is found, closes all the runs, which then leave
+    their experiments without an end time.
+
+    With workers > 1, runs are interleaved and their rendering and distance
+    calculations are spread over a pool of worker processes. This process
+    still performs all database reads and writes, and glyph sets that are
+    already stored are evaluated here without a round trip to a worker.
+
+    Points found in evaluation_memo are answered from it, without rendering
+    or reading the database.
+"""
+def stream_experiments(chars, runs, workers=1):
+    runs = list(runs)
+    try:
+        if workers is None or workers <= 1:
+            for font, font_size, run in runs:
+                request = advance_run(run)
+                iteration = 0
+                while request is not RUN_FINISHED:
+                    outcomes = []
+                    for index, coords in enumerate(request_points(request)):
+                        outcomes.append(evaluate_memoized(chars, font, font_size, coords, 
+                                lambda: systematicity.evaluate(chars, font, font_size, coords)))
+                        yield get_experiment_result(font, font_size, coords, iteration, index, outcomes[-1])
+                    request = resume_run(run, request, outcomes)
+                    iteration += 1
+            return
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, 
+                                    initargs=(shapes.kernel_backend,)) as pool:
+            pending = {}
+            try:
+                for font, font_size, run in runs:
+                    yield from schedule_run(pool, pending, chars, font, font_size, run, advance_run(run), 0)
+
+                while len(pending) > 0:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        state, index = pending.pop(future)
+                        coords = state.points[index]
+                        state.outcomes[index] = evaluate_outcome(lambda: systematicity.evaluate_measurement(
+                            chars, state.font, state.font_size, coords, future.result()))
+                        evaluation_memo.put(chars, state.font, state.font_size, coords, state.outcomes[index])
+                        state.remaining -= 1
+                        yield get_experiment_result(state.font, state.font_size, coords, state.iteration, index, state.outcomes[index])
+
+                        if state.remaining == 0:
+                            # Repeated points in a batch were left for the first copy to store
+                            for i, coords in enumerate(state.points):
+                                if state.outcomes[i] is None:
+                                    state.outcomes[i] = evaluate_memoized(chars, state.font, state.font_size, coords,
+                                        lambda: systematicity.evaluate(chars, state.font, state.font_size, coords))
+                                    yield get_experiment_result(state.font, state.font_size, coords, state.iteration, i, state.outcomes[i])
+
+                            request = resume_run(state.run, state.request, state.outcomes)
+                            yield from schedule_run(pool, pending, chars, state.font, state.font_size, state.run, request, 
+                                state.iteration + 1)
+            finally:
+                # Drop work that has not started if the consumer stopped early
+                for future in pending:
+                    future.cancel()
+    finally:
+        for _, _, run in runs:
+            run.close()
+
+"""
+    Exhausts a generator of experiment results, for callers that only want
+    the experiments run and saved.
+"""
+def consume(results):
+    for _ in results:
+        pass
+
+def get_experiment_result(font, font_size, coords, iteration, index, outcome):
+    return ExperimentResult(
+        font = font,
+        font_size = font_size,
+        coords = coords,
+        iteration = iteration,
+        index = index,
+        result = None if isinstance(outcome, systematicity.FailedRenderException) else outcome)
+
+class ExperimentResult(NamedTuple):
+    """
+        Class to represent the outcome of evaluating one point of a run.
+        iteration counts the requests the run made before this point's, and
+        index is the point's position in its request, which is 0 unless the
+        run requested an EvaluationBatch. result is None if a glyph failed to
+        render.
+    """
+    font: Font
+    font_size: int
+    coords: list
+    iteration: int
+    index: int
+    result: systematicity.SystematicityResult
+
+class EvaluationBatch(NamedTuple):
+    """Class to represent a set of coordinates a run wants evaluated together. """
+    points: list
+
+class PendingRequest():
+    """Class to track a run's request while its points are evaluated by workers. """
+    def __init__(self, font, font_size, run, request, iteration, outcomes, remaining):
+        self.font = font
+        self.font_size = font_size
+        self.run = run
+        self.request = request
+        self.iteration = iteration
+        self.points = request_points(request)
+        self.outcomes = outcomes
+        self.remaining = remaining
+
+# Marks a run generator that has completed
+RUN_FINISHED = object()
+
+"""
+    Resumes a run generator with the outcome of its last evaluation, returning
+    its next request or RUN_FINISHED.
+"""
+def advance_run(run, result=None, error=None):
+    try:
+        if error is not None:
+            return run.throw(error)
+        return run.send(result)
+    except StopIteration:
+        return RUN_FINISHED
+
+def request_points(request):
+    return request.points if isinstance(request, EvaluationBatch) else [request]
+
+"""
+    Resumes a run generator with the outcomes for its request, which are
+    sent as a list for batches and as a single result or raised exception
+    otherwise.
+"""
+def resume_run(run, request, outcomes):
+    if isinstance(request, EvaluationBatch):
+        return advance_run(run, outcomes)
+    if isinstance(outcomes[0], systematicity.FailedRenderException):
+        return advance_run(run, error=outcomes[0])
+    return advance_run(run, outcomes[0])
+
+def evaluate_outcome(evaluation):
+    try:
+        return evaluation()
+    except systematicity.FailedRenderException as e:
+        return e
+
+"""
+    Returns the memoized outcome for a point if there is one, and otherwise
+    runs the evaluation and memoizes its outcome.
+"""
+def evaluate_memoized(chars, font, font_size, coords, evaluation):
+    outcome = evaluation_memo.get(chars, font, font_size, coords)
+    if outcome is None:
+        outcome = evaluate_outcome(evaluation)
+        evaluation_memo.put(chars, font, font_size, coords, outcome)
+    return outcome
+
+"""
+    Sets up a worker process of stream_experiments with this process's
+    settings. Workers started by spawn, as on Windows, import the modules
+    afresh and would otherwise use their default settings.
+"""
+def init_worker(kernel_backend):
+    shapes.kernel_backend = kernel_backend
+
+"""
+    Submits the points of a run's request to the worker pool. Points with a
+    stored glyph set are evaluated immediately instead, unless its bitmap
+    distances are still to be measured from the bitmap arena, and a run whose
+    request needs no workers at all is advanced straight away. Yields an
+    ExperimentResult for each point evaluated here.
+"""
+def schedule_run(pool, pending, chars, font, font_size, run, request, iteration):
+    while request is not RUN_FINISHED:
+        points = request_points(request)
+        outcomes = [None] * len(points)
+        futures = []
+        submitted = set()
+
+        for index, coords in enumerate(points):
+            key = None if coords is None else tuple(coords)
+            if key in submitted:
+                continue
+
+            outcomes[index] = evaluation_memo.get(chars, font, font_size, coords)
+            if outcomes[index] is not None:
+                yield get_experiment_result(font, font_size, coords, iteration, index, outcomes[index])
+                continue
+
+            glyph_set_id = systematicity.find_glyph_set(chars, font, font_size, coords)
+            offsets = None
+            if (glyph_set_id is not None and systematicity.shape_metric == "hausdorff" 
+                    and not systematicity.has_shape_distances(glyph_set_id)):
+                # Stored bitmaps in the arena are measured by a worker mapping it
+                offsets = systematicity.get_arena_offsets(glyph_set_id)
+
+            if glyph_set_id is not None and offsets is None:
+                outcomes[index] = evaluate_outcome(lambda: systematicity.evaluate(chars, font, font_size, coords))
+                evaluation_memo.put(chars, font, font_size, coords, outcomes[index])
+                yield get_experiment_result(font, font_size, coords, iteration, index, outcomes[index])
+            elif glyph_set_id is not None:
+                submitted.add(key)
+                futures.append((index, pool.submit(systematicity.measure_arena_glyphs, os.path.abspath(data.bitmap_arena.path),
+                                                        offsets, instrumentation.profiler.enabled)))
+            else:
+                submitted.add(key)
+                futures.append((index, pool.submit(systematicity.measure_glyphs, font.id, font.font_source, chars, font_size, coords,
+                                                        instrumentation.profiler.enabled, systematicity.shape_metric,
+                                                        systematicity.outline_tolerance)))
+
+        if len(futures) > 0:
+            state = PendingRequest(font, font_size, run, request, iteration, outcomes, len(futures))
+            for index, future in futures:
+                pending[future] = (state, index)
+            return
+
+        request = resume_run(run, request, outcomes)
+        iteration += 1
 
 """
     Randomly alter the set of axis coordinates uniformly bounded by the 
     +/- percent of possible range defined by step_range.
 """
-def alter_uniform(coords, axes, step_range):
+def alter_uniform(coords, axes, step_range, rng=random):
     if step_range > 1 or step_range <= 0:
         raise Exception("Invalid step_range: {0}. Should be 0 < step_range <= 1.".format(step_range))
 
@@ -293,7 +1274,7 @@ def alter_uniform(coords, axes, step_range):
         conv_range = (axis_range * step_range)
         
         while True:
-            new_coord = round(coord + random.uniform(-conv_range, conv_range), 4)
+            new_coord = round(coord + rng.uniform(-conv_range, conv_range), 4)
             if new_coord >= axis.minimum and new_coord <= axis.maximum:
                 break
 
@@ -308,7 +1289,7 @@ def alter_uniform(coords, axes, step_range):
     var_range of 0.01 for axes with ranges of [20, 80, 100] will yield 
     variances of [0.2, 0.8, 1].
 """
-def alter_gaussian(coords, axes, var_range):
+def alter_gaussian(coords, axes, var_range, rng=random):
     if var_range <= 0:
         raise Exception("Invalid var_range: {0}. var_range should be > 0"
             .format(var_range))
@@ -326,7 +1307,7 @@ def alter_gaussian(coords, axes, var_range):
         variance = axis_range * var_range
         
         while True:
-            new_coord = round(coord + random.gauss(0, variance), 4)
+            new_coord = round(coord + rng.gauss(0, variance), 4)
             if new_coord >= axis.minimum and new_coord <= axis.maximum:
                 break
 
@@ -334,7 +1315,85 @@ def alter_gaussian(coords, axes, var_range):
 
     return new_coords
 
+"""
+    Saves the state of a run every checkpoint_interval iterations, as one
+    ExperimentCheckpoint per experiment of the run, so that it can be resumed
+    with resume_experiment. The checkpoint also records what is needed to
+    start the run again: its method, characters, font, size and parameters.
+"""
+class RunCheckpoint:
+    def __init__(self, experiments, method, chars, font, font_size, parameters):
+        self.experiments = experiments
+        self.method = method
+        self.chars = chars
+        self.font_id = font.id
+        self.font_size = font_size
+        self.parameters = parameters
+        self.iteration = None
+
+    """
+        Saves the state returned by get_state if iteration is due a
+        checkpoint. get_state is only called when saving, and must return
+        something json.dumps can write.
+    """
+    def save(self, iteration, get_state):
+        if checkpoint_interval is None or iteration % checkpoint_interval != 0 or iteration == self.iteration:
+            return
+
+        state = json.dumps({
+            "method": self.method.name,
+            "chars": self.chars,
+            "font_id": self.font_id,
+            "font_size": self.font_size,
+            "parameters": self.parameters,
+            "experiment_ids": [experiment.id for experiment in self.experiments],
+            "iteration": iteration,
+            "state": get_state()})
+
+        with data.db.atomic():
+            for experiment in self.experiments:
+                (ExperimentCheckpoint
+                    .insert(experiment=experiment.id, iteration=iteration, state=state, saved_time=datetime.now())
+                    .on_conflict_replace()
+                    .execute())
+        self.iteration = iteration
+
+    """
+        Removes the run's checkpoints once it has finished.
+    """
+    def finish(self):
+        (ExperimentCheckpoint
+            .delete()
+            .where(ExperimentCheckpoint.experiment << [experiment.id for experiment in self.experiments])
+            .execute())
+
+    """
+        Returns the RunCheckpoint and experiments of a loaded checkpoint.
+    """
+    @classmethod
+    def load(cls, checkpoint):
+        experiments = [Experiment.get_by_id(experiment_id) for experiment_id in checkpoint["experiment_ids"]]
+        checkpoints = cls(experiments, ExperimentType[checkpoint["method"]], checkpoint["chars"], Font(id=checkpoint["font_id"]), 
+                            checkpoint["font_size"], checkpoint["parameters"])
+        checkpoints.iteration = checkpoint["iteration"]
+        return checkpoints, experiments
+
+def get_rng_state(rng):
+    version, internal_state, gauss_next = rng.getstate()
+    return [version, list(internal_state), gauss_next]
+
+def set_rng_state(rng, state):
+    version, internal_state, gauss_next = state
+    rng.setstate((version, tuple(internal_state), gauss_next))
+
 def save_result(experiment_id, systematicity_result):
+    # Add the evaluation's instrumentation to the experiment's totals. Results
+    # answered from the memo have no profile.
+    if instrumentation.profiler.enabled:
+        profile = instrumentation.profiler.take(systematicity_result.glyph_set_id)
+        if profile is not None:
+            instrumentation.save_profile(experiment_id, profile)
+
     join = (ExperimentGlyphSet
             .select()
             .where(
@@ -351,4 +1410,4 @@ def save_result(experiment_id, systematicity_result):
 
 if __name__ == "__main__":
     font = Font.select().where(Font.name == 'amstelvar-roman').first()
-    renderer = shapes.GlyphRenderer(font.font_file)
+    renderer = shapes.renderer_pool.get(font.id, font.font_source)
@@ -1,55 +1,140 @@
-import io
+from concurrent.futures import ProcessPoolExecutor
 import json
 import os
 from pathlib import Path
+import time
+
+import freetype
 
 import data
+from data import Font, FontSource
+from fontstore import FontStore
 import shapes
 
+# The coarsest resolution, in seconds, of file modification times: 2 seconds
+# on FAT. A file changed again within this time of being imported may keep
+# its size and modification time, so files imported that soon after they were
+# modified are recorded as unverified, and read again by the next import.
+timestamp_resolution = 2
+
+# The modification time recorded for files that must be read again
+UNVERIFIED_MTIME = -1
+
 """
-    Load all fonts from a specified directory into the data store for 
+    Load all fonts from a specified directory into the data store for
     rendering and analysis. Only OpenType (*.otf) and TrueType (*.ttf) fonts
-    are supported. 
-"""
+    are supported.
 
-def load_fonts(font_dir):
+    Font files are read, stored in data.font_store and parsed for their
+    variation axes by up to workers processes at once. Fonts whose content is
+    already stored, from any directory, are not imported again. With
+    incremental set, files whose size and modification time are the same as
+    when they were last imported are not even read, unless they had been
+    modified within timestamp_resolution of that import. With verify set as
+    well, those files are hashed, and read again if their content differs
+    from what was imported. New fonts, and the record of every file read, are
+    saved together in one transaction.
+"""
+def load_fonts(font_dir, workers=1, incremental=True, verify=False):
     # Only use OpenType and TrueType font files
     font_files = [_ for _ in Path(font_dir).glob("**/*.otf")]
     font_files += [_ for _ in Path(font_dir).glob("**/*.ttf")]
 
     data.db.connect()
-    for file_path in font_files:
-        print("Importing {0}".format(file_path))
-        file_name = os.path.basename(file_path)
-        font_name = os.path.splitext(file_name)[0]
-        
-        with open(os.path.join(file_path), mode='rb') as font_file:
-            font_blob = font_file.read()
-            font = data.Font(name=font_name, file_name=file_name, font_file=font_blob)
-
-            file_stream = io.BytesIO(font_blob)
-            
+    try:
+        sources = {source.path: source for source in FontSource.select()} if incremental else {}
+
+        # Files modified after this may change again unnoticed
+        racy_after = time.time_ns() - timestamp_resolution * 10**9
+
+        changed = []
+        for file_path in sorted(os.path.abspath(file_path) for file_path in font_files):
+            stat = os.stat(file_path)
+            source = sources.get(file_path)
+            mtime = stat.st_mtime_ns if stat.st_mtime_ns <= racy_after else UNVERIFIED_MTIME
+            if (source is None or source.size != stat.st_size or source.mtime != stat.st_mtime_ns
+                    or (verify and get_file_hash(file_path) != source.file_hash)):
+                changed.append((file_path, stat.st_size, mtime))
+
+        known = set(file_hash for (file_hash,) in Font
+                        .select(Font.file_hash)
+                        .where(Font.file_hash.is_null(False))
+                        .tuples())
+
+        fonts = []
+        records = []
+        for (file_path, size, mtime), result in zip(changed, read_font_files([c[0] for c in changed], workers)):
+            if result is None:
+                continue
+            file_hash, axes = result
+            records.append({"path":file_path, "size":size, "mtime":mtime, "file_hash":file_hash})
+            if file_hash in known:
+                continue
+            known.add(file_hash)
+
+            print("Importing {0}".format(file_path))
+            file_name = os.path.basename(file_path)
+            font = Font(name=os.path.splitext(file_name)[0], file_name=file_name, file_hash=file_hash)
+
             # Add data for OpenType variation fonts
-            renderer = shapes.GlyphRenderer(file_stream)
-            if len(renderer._axes) > 0:
-                axes = []
-                for axis in renderer._axes:
-                    obj = {
-                        'name': axis.name, 
+            if len(axes) > 0:
+                font.is_variable = True
+                font.axes = json.dumps({"axes":[{
+                        'name': axis.name,
                         'default':axis.default,
                         'minimum':axis.minimum,
                         'maximum':axis.maximum
-                    }
-                    axes.append(obj)                
-                
-                font.is_variable = True
-                font.axes = json.dumps({"axes":axes})
+                    } for axis in axes]})
+            fonts.append(font)
+
+        with data.db.atomic():
+            Font.bulk_create(fonts, batch_size=100)
+            for i in range(0, len(records), 100):
+                FontSource.insert_many(records[i:i + 100]).on_conflict_replace().execute()
+
+        print("Imported {0} fonts from {1}: {2} unchanged, {3} already stored".format(
+            len(fonts), font_dir, len(font_files) - len(changed), len(records) - len(fonts)))
+    finally:
+        data.db.close()
+
+"""
+    Returns the hash a font file's content is stored under.
+"""
+def get_file_hash(file_path):
+    with open(file_path, mode='rb') as font_file:
+        return FontStore.get_hash(font_file.read())
 
-            font.save()
+"""
+    Reads each font file with read_font_file, in up to workers processes,
+    returning the results in the order of file_paths.
+"""
+def read_font_files(file_paths, workers=1):
+    directories = [data.font_store.directory] * len(file_paths)
+    if workers is None or workers <= 1 or len(file_paths) <= 1:
+        return list(map(read_font_file, file_paths, directories))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(read_font_file, file_paths, directories, chunksize=8))
+
+"""
+    Stores a font file in the font store in store_directory and reads its
+    variation axes, opening the file directly rather than from a copy in
+    memory. Returns the font's hash and a list of FontAxis, or None, with a
+    message, if FreeType cannot open the file. Runs in worker processes.
+"""
+def read_font_file(file_path, store_directory):
+    try:
+        _, axes = shapes.get_variations(freetype.Face(file_path))
+    except freetype.FT_Exception as e:
+        print("Skipping {0}: {1}".format(file_path, e))
+        return None
 
-    data.db.close()
+    with open(file_path, mode='rb') as font_file:
+        file_hash = FontStore(store_directory).put(font_file.read())
+    return file_hash, axes
 
 if __name__ == "__main__":
-    load_fonts(r"C:\Windows\Fonts")
-    load_fonts(r"data\variable-fonts")
-    load_fonts(r"data\chinese-fonts")
\ No newline at end of file
+    workers = os.cpu_count()
+    load_fonts(r"C:\Windows\Fonts", workers)
+    load_fonts(r"data\variable-fonts", workers)
+    load_fonts(r"data\chinese-fonts", workers)
@@ -0,0 +1,52 @@
+import hashlib
+import os
+import tempfile
+
+"""
+    A directory of font files named by the SHA-1 hash of their content, so
+    that a font imported any number of times, from anywhere, is stored once.
+    Fonts are opened straight from their stored files, and read into memory
+    only when their content is asked for.
+"""
+class FontStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    """
+        Stores a font's content if it is not already stored, and returns its
+        hash. Files are written under a temporary name and then renamed, so
+        that processes storing the same font at once never see a partial file.
+    """
+    def put(self, content):
+        file_hash = self.get_hash(content)
+        path = self.path(file_hash)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(handle, "wb") as temp_file:
+                    temp_file.write(content)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return file_hash
+
+    @staticmethod
+    def get_hash(content):
+        return hashlib.sha1(content).hexdigest()
+
+    def get(self, file_hash):
+        with open(self.path(file_hash), "rb") as font_file:
+            return font_file.read()
+
+    """
+        Returns the absolute path of a stored font, so that it stays valid
+        in worker processes and after the working directory changes.
+    """
+    def path(self, file_hash):
+        return os.path.abspath(os.path.join(self.directory, file_hash))
+
+    def __contains__(self, file_hash):
+        return os.path.exists(self.path(file_hash))
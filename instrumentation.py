@@ -0,0 +1,256 @@
+from collections import deque
+import functools
+import time
+import tracemalloc
+from typing import NamedTuple
+
+import data
+from data import ExperimentProfile
+
+"""
+    Opt-in instrumentation of systematicity evaluations, for finding out
+    which stage of an evaluation, and which fonts and sizes, are slow.
+    Enable the shared profiler before a run:
+
+        instrumentation.profiler.enable()
+
+    Each call to an instrumented function then records a CallProfile, nested
+    as the calls were. Completed top-level calls are kept in
+    profiler.profiles, and experiments aggregate the profiles of their
+    evaluations per Experiment into ExperimentProfile records.
+"""
+
+class CallProfile(NamedTuple):
+    """
+        Class to represent the measurements of one instrumented call, which
+        include those of the calls it made.
+
+        Times are in seconds. peak_memory is the most memory allocated by
+        Python and NumPy during the call, in bytes above what was allocated
+        when it started. pixels counts the bitmap pixels rendered, points the
+        ink points whose distances were computed and queries the SQL
+        statements issued. glyph_set_id is the glyph set the call worked on,
+        where known. calls holds the profiles of the instrumented calls made
+        during this one.
+    """
+    stage: str
+    wall_time: float
+    cpu_time: float
+    peak_memory: int
+    pixels: int
+    points: int
+    queries: int
+    glyph_set_id: int
+    calls: tuple
+
+"""
+    Records CallProfiles for instrumented calls while enabled. Memory is
+    traced with tracemalloc, which slows allocations down noticeably; pass
+    trace_memory=False to enable to measure times only. Up to max_profiles
+    completed top-level profiles are kept.
+"""
+class Profiler:
+    def __init__(self, max_profiles=10000):
+        self.enabled = False
+        self.trace_memory = False
+        self.profiles = deque(maxlen=max_profiles)
+        self._stack = []
+        self._started_tracing = False
+
+    def enable(self, trace_memory=True):
+        self.enabled = True
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def disable(self):
+        self.enabled = False
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def clear(self):
+        self.profiles.clear()
+
+    """
+        Whether an instrumented call is in progress, so counts are wanted.
+    """
+    @property
+    def active(self):
+        return self.enabled and len(self._stack) > 0
+
+    """
+        Runs function(*args, **kwargs) as an instrumented call of the named
+        stage. Returns its result and CallProfile. If the function raises,
+        the profile is still recorded before the exception propagates.
+    """
+    def call(self, stage, function, *args, **kwargs):
+        frame = self.start(stage)
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            profile = self.stop(frame)
+        return result, profile
+
+    def start(self, stage):
+        frame = CallFrame(stage)
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(self._stack) > 0:
+                # Keep the enclosing call's peak so far before starting afresh
+                self._stack[-1].peak = max(self._stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            frame.memory = current
+            frame.peak = current
+
+        frame.queries = data.db.statements
+        frame.cpu_time = time.process_time()
+        frame.wall_time = time.perf_counter()
+        self._stack.append(frame)
+        return frame
+
+    def stop(self, frame):
+        wall_time = time.perf_counter() - frame.wall_time
+        cpu_time = time.process_time() - frame.cpu_time
+        self._stack.remove(frame)
+
+        peak_memory = 0
+        if self.trace_memory and tracemalloc.is_tracing():
+            frame.peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+            peak_memory = frame.peak - frame.memory
+            if len(self._stack) > 0:
+                self._stack[-1].peak = max(self._stack[-1].peak, frame.peak)
+
+        profile = CallProfile(
+            stage = frame.stage,
+            wall_time = wall_time,
+            cpu_time = cpu_time,
+            peak_memory = peak_memory,
+            pixels = frame.pixels,
+            points = frame.points,
+            queries = data.db.statements - frame.queries,
+            glyph_set_id = frame.glyph_set_id,
+            calls = tuple(frame.calls))
+
+        if len(self._stack) > 0:
+            self._stack[-1].calls.append(profile)
+        else:
+            self.profiles.append(profile)
+        return profile
+
+    """
+        Adds pixel and point counts to the calls in progress.
+    """
+    def count(self, pixels=0, points=0):
+        for frame in self._stack:
+            frame.pixels += pixels
+            frame.points += points
+
+    """
+        Records the glyph set the innermost call in progress works on.
+    """
+    def set_glyph_set(self, glyph_set_id):
+        if len(self._stack) > 0:
+            self._stack[-1].glyph_set_id = glyph_set_id
+
+    """
+        Adds a profile recorded elsewhere, such as in a worker process, to
+        the innermost call in progress. Its counts are added to the calls in
+        progress, but not its times, which were spent in another process.
+    """
+    def add_call(self, profile):
+        if len(self._stack) == 0:
+            self.profiles.append(profile)
+            return
+        self.count(profile.pixels, profile.points)
+        self._stack[-1].calls.append(profile)
+
+    """
+        Removes and returns the most recent top-level profile for a glyph
+        set, or None if there is none.
+    """
+    def take(self, glyph_set_id):
+        for profile in reversed(self.profiles):
+            if profile.glyph_set_id == glyph_set_id:
+                self.profiles.remove(profile)
+                return profile
+        return None
+
+class CallFrame:
+    """Class to track an instrumented call in progress. """
+    def __init__(self, stage):
+        self.stage = stage
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.memory = 0
+        self.peak = 0
+        self.queries = 0
+        self.pixels = 0
+        self.points = 0
+        self.glyph_set_id = None
+        self.calls = []
+
+# Profiler shared by everything in this process
+profiler = Profiler()
+
+"""
+    Decorator that records calls to the function as the named stage while
+    the shared profiler is enabled.
+"""
+def profiled(stage):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            return profiler.call(stage, function, *args, **kwargs)[0]
+        return wrapper
+    return decorate
+
+"""
+    Returns a profile and all the profiles nested in it.
+"""
+def flatten(profile):
+    profiles = [profile]
+    for call in profile.calls:
+        profiles += flatten(call)
+    return profiles
+
+"""
+    Adds the stages of an evaluation's profile to the totals recorded for an
+    experiment, one ExperimentProfile per stage. Times and counts are summed,
+    and peak memory is the largest of any call.
+"""
+def save_profile(experiment_id, profile):
+    totals = {}
+    for call in flatten(profile):
+        total = totals.setdefault(call.stage,
+            {"calls": 0, "wall_time": 0.0, "cpu_time": 0.0, "peak_memory": 0, "pixels": 0, "points": 0, "queries": 0})
+        total["calls"] += 1
+        total["wall_time"] += call.wall_time
+        total["cpu_time"] += call.cpu_time
+        total["peak_memory"] = max(total["peak_memory"], call.peak_memory)
+        total["pixels"] += call.pixels
+        total["points"] += call.points
+        total["queries"] += call.queries
+
+    with data.db.atomic():
+        for stage, total in totals.items():
+            record = (ExperimentProfile
+                        .select()
+                        .where(
+                            (ExperimentProfile.experiment_id == experiment_id) &
+                            (ExperimentProfile.stage == stage))
+                        .first())
+            if record is None:
+                record = ExperimentProfile(experiment=experiment_id, stage=stage, **total)
+            else:
+                record.calls += total["calls"]
+                record.wall_time += total["wall_time"]
+                record.cpu_time += total["cpu_time"]
+                record.peak_memory = max(record.peak_memory, total["peak_memory"])
+                record.pixels += total["pixels"]
+                record.points += total["points"]
+                record.queries += total["queries"]
+            record.save()
@@ -0,0 +1,185 @@
+import math
+import warnings
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+    Optional compiled kernels for point extraction and Hausdorff distances,
+    used by shapes in place of NumPy and SciPy when shapes.kernel_backend
+    selects them. They need Numba (pip install numba); without it, shapes
+    falls back to NumPy.
+
+    Kernels extract exactly the same points, and give exactly the same
+    distances, as the NumPy path. Contributing points can differ where
+    several realize a directed distance: the kernels report the first in
+    row-major order, as hausdorff_matrix does, with the first of its nearest
+    points in row-major order. SciPy's directed_hausdorff reports the last of
+    them in the order of its seeded shuffle instead, and hausdorff_matrix
+    whichever nearest point the distance transform finds.
+"""
+
+available = numba is not None
+
+_warned = False
+
+"""
+    Returns the backend to use for a kernel_backend setting: "numba" or
+    "numpy". "auto" uses numba when it is installed. "numba" falls back to
+    numpy, with a warning the first time, when it is not.
+"""
+def resolve(backend):
+    global _warned
+    if backend == "numpy":
+        return "numpy"
+    if backend == "auto":
+        return "numba" if available else "numpy"
+    if backend != "numba":
+        raise ValueError("Unknown kernel backend: {0}".format(backend))
+
+    if not available:
+        if not _warned:
+            warnings.warn("Numba is not installed, so compiled kernels are unavailable. Using NumPy instead.")
+            _warned = True
+        return "numpy"
+    return "numba"
+
+"""
+    Returns the (row, column) coordinates of a bitmap's ink pixels in
+    row-major order, as shapes.get_points does. With boundary set, only ink
+    pixels with a background 4-neighbour or on the edge of the bitmap.
+"""
+def get_points(bitmap, boundary=False):
+    return _get_points(np.ascontiguousarray(bitmap), boundary)
+
+"""
+    Hausdorff distance between two point clouds, in the form of
+    shapes.points_hausdorff_distance.
+"""
+def points_hausdorff_distance(points1, points2):
+    points1 = np.ascontiguousarray(points1, dtype=np.int32)
+    points2 = np.ascontiguousarray(points2, dtype=np.int32)
+    forward = _directed_hausdorff(points1, points2)
+    backward = _directed_hausdorff(points2, points1)
+    return ((math.sqrt(forward[0]), points1[forward[1]], points2[forward[2]]),
+            (math.sqrt(backward[0]), points2[backward[1]], points1[backward[2]]))
+
+"""
+    Hausdorff distances between every pair of point clouds, in the order of
+    itertools.combinations and in the form of
+    shapes.points_hausdorff_distance. Pairs are compared in parallel.
+"""
+def pairwise_hausdorff_distances(points):
+    counts = np.array([len(p) for p in points], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    all_points = np.ascontiguousarray(np.concatenate(points), dtype=np.int32)
+    first, second = np.triu_indices(len(points), k=1)
+
+    distances, indices = _pairwise_hausdorff(all_points, starts, counts, first.astype(np.int64), second.astype(np.int64))
+
+    results = []
+    for k in range(len(first)):
+        i, j = first[k], second[k]
+        results.append((
+            (math.sqrt(distances[k, 0]), points[i][indices[k, 0]], points[j][indices[k, 1]]),
+            (math.sqrt(distances[k, 1]), points[j][indices[k, 2]], points[i][indices[k, 3]])))
+    return results
+
+if available:
+    @numba.njit(cache=True)
+    def _get_points(bitmap, boundary):
+        rows, cols = bitmap.shape
+        points = np.empty((rows * cols, 2), dtype=np.int32)
+        count = 0
+        for r in range(rows):
+            for c in range(cols):
+                if bitmap[r, c] != 0:
+                    continue
+                if boundary and (0 < r < rows - 1 and 0 < c < cols - 1 and
+                        bitmap[r - 1, c] == 0 and bitmap[r + 1, c] == 0 and
+                        bitmap[r, c - 1] == 0 and bitmap[r, c + 1] == 0):
+                    continue
+                points[count, 0] = r
+                points[count, 1] = c
+                count += 1
+        return points[:count].copy()
+
+    """
+        Squared directed Hausdorff distance from points1 to points2, with the
+        indices of the contributing point and its nearest point. A point's
+        search for its nearest stops as soon as it finds one closer than the
+        largest distance so far (Taha and Hanbury's early break), and starts
+        from the previous point's nearest, which for neighbouring pixels is
+        usually close. A few points spread over points1 are measured first,
+        so that searches can stop early from the start.
+    """
+    @numba.njit(cache=True)
+    def _directed_hausdorff(points1, points2, samples=64):
+        n1 = len(points1)
+        stride = _get_stride(n1)
+        cmax = -1
+        i_ret = 0
+        j_ret = 0
+        start = 0
+        for m in range(min(samples, n1)):
+            i = (m * stride) % n1
+            cmin, j_min, start = _nearest(points1, points2, i, start, cmax)
+            if cmin > cmax or (cmin == cmax and i < i_ret):
+                cmax, i_ret, j_ret = cmin, i, j_min
+
+        for i in range(n1):
+            cmin, j_min, start = _nearest(points1, points2, i, start, cmax)
+            if cmin > cmax or (cmin == cmax and i < i_ret):
+                cmax, i_ret, j_ret = cmin, i, j_min
+        return cmax, i_ret, j_ret
+
+    """
+        Squared distance from points1[i] to its nearest point in points2,
+        the first such point, and where the next search should start. The
+        distance is -1 if the search stopped at a point closer than cmax.
+    """
+    @numba.njit(cache=True)
+    def _nearest(points1, points2, i, start, cmax):
+        n2 = len(points2)
+        cmin = -1
+        j_min = 0
+        for k in range(n2):
+            j = start + k
+            if j >= n2:
+                j -= n2
+            dr = np.int64(points1[i, 0]) - points2[j, 0]
+            dc = np.int64(points1[i, 1]) - points2[j, 1]
+            d = dr * dr + dc * dc
+            if d < cmax:
+                return -1, j, j
+            if cmin < 0 or d < cmin or (d == cmin and j < j_min):
+                cmin = d
+                j_min = j
+        return cmin, j_min, j_min
+
+    """
+        A step near n times the golden ratio that shares no factor with n, so
+        that stepping by it visits every index below n once, spread evenly.
+    """
+    @numba.njit(cache=True)
+    def _get_stride(n):
+        stride = max(1, int(n * 0.6180339887))
+        while math.gcd(stride, n) != 1:
+            stride += 1
+        return stride
+
+    @numba.njit(parallel=True, cache=True)
+    def _pairwise_hausdorff(all_points, starts, counts, first, second):
+        pair_count = len(first)
+        distances = np.zeros((pair_count, 2), dtype=np.int64)
+        indices = np.zeros((pair_count, 4), dtype=np.int64)
+        for k in numba.prange(pair_count):
+            a = all_points[starts[first[k]]:starts[first[k]] + counts[first[k]]]
+            b = all_points[starts[second[k]]:starts[second[k]] + counts[second[k]]]
+            distances[k, 0], indices[k, 0], indices[k, 1] = _directed_hausdorff(a, b)
+            distances[k, 1], indices[k, 2], indices[k, 3] = _directed_hausdorff(b, a)
+        return distances, indices
@@ -1,4 +1,3 @@
-import io
 import json
 import random
 from collections import defaultdict
@@ -23,7 +22,22 @@ def render_hausdorff_distance(shape_distance_id):
                     .join(Glyph2, on=ShapeDistance.glyph2)
                     .where(
                         ShapeDistance.id == shape_distance_id))
-    result = query[0]
+    return render_shape_distance(query[0])
+
+"""
+    Renders the Hausdorff distance between two characters of a glyph set,
+    however its shape distances are stored.
+"""
+def render_glyph_set_distance(glyph_set_id, char1, char2):
+    characters = {glyph.id: glyph.character for glyph in 
+                    Glyph.select(Glyph.id, Glyph.character).where(Glyph.glyph_set_id == glyph_set_id)}
+    for shape_distance in systematicity.get_shape_distance_records(glyph_set_id):
+        pair = (characters[shape_distance.glyph1_id], characters[shape_distance.glyph2_id])
+        if pair == (char1, char2) or pair == (char2, char1):
+            return render_shape_distance(shape_distance)
+    raise Exception("No shape distance for {0} and {1} in glyph set {2}".format(char1, char2, glyph_set_id))
+
+def render_shape_distance(result):
     points1 = json.loads(result.points1)
     points2 = json.loads(result.points2)
     bitmap1 = result.glyph1.bitmap
@@ -62,7 +76,6 @@ def get_chinese_distances():
     )
     
     for font in fonts:
-        renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
         glyph_set_id = systematicity.get_glyphs(chars, font, 96)
         distances = systematicity.get_shape_distances(glyph_set_id)
 
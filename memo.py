@@ -0,0 +1,181 @@
+from collections import OrderedDict
+import math
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import shapes
+import systematicity
+
+"""
+    In-process memo of evaluation outcomes for the experiment drivers, so that
+    search methods revisiting a point skip rendering, distance calculations and
+    database lookups entirely.
+"""
+
+# Coordinates are compared at the precision experiments generate them
+COORDINATE_DECIMALS = 4
+
+"""
+    Memo of SystematicityResults (or the FailedRenderException raised), keyed by
+    character list, font, size, shape metric settings and quantized
+    coordinates, bounded to max_size entries with least-recently-used eviction.
+    Outcomes memoized under one shape metric are not returned after
+    systematicity.shape_metric or its settings change.
+
+    With a tolerance above zero, a candidate within that distance of a visited
+    point also reuses its outcome. The distance is the largest difference along
+    any axis, as a fraction of that axis's range, so a tolerance of 0.001
+    treats points within a thousandth of every axis range as the same design.
+    Visited points are kept in a k-d tree per font and size for these lookups.
+"""
+class EvaluationMemo:
+    def __init__(self, max_size=10000, tolerance=0.0):
+        self.max_size = max_size
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+        self._outcomes = OrderedDict()
+        self._spaces = {}
+        self._axes = {}
+
+    """
+        Returns the memoized outcome for the coordinates, or None.
+    """
+    def get(self, chars, font, font_size, coords):
+        space = self.get_space(chars, font, font_size)
+        key = (space, quantize(coords))
+
+        outcome = self._outcomes.get(key)
+        if outcome is None and self.tolerance > 0 and coords is not None:
+            key = self.find_near(space, coords, self.get_axes(font))
+            outcome = None if key is None else self._outcomes.get(key)
+
+        if outcome is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._outcomes.move_to_end(key)
+        return outcome
+
+    def put(self, chars, font, font_size, coords, outcome):
+        space = self.get_space(chars, font, font_size)
+        key = (space, quantize(coords))
+
+        if key not in self._outcomes and self.tolerance > 0 and coords is not None:
+            visited = self._spaces.setdefault(space, VisitedPoints())
+            visited.add(key, normalize(coords, self.get_axes(font)))
+
+        self._outcomes[key] = outcome
+        self._outcomes.move_to_end(key)
+
+        while len(self._outcomes) > self.max_size:
+            evicted, _ = self._outcomes.popitem(last=False)
+            visited = self._spaces.get(evicted[0])
+            if visited is not None:
+                visited.remove(evicted)
+
+    def find_near(self, space, coords, axes):
+        visited = self._spaces.get(space)
+        if visited is None:
+            return None
+        return visited.nearest(normalize(coords, axes), self.tolerance)
+
+    def get_space(self, chars, font, font_size):
+        return (tuple(chars), font.id, font_size, systematicity.get_metric_settings())
+
+    def get_axes(self, font):
+        axes = self._axes.get(font.id)
+        if axes is None:
+            axes = shapes.renderer_pool.get(font.id, font.font_source)._axes
+            self._axes[font.id] = axes
+        return axes
+
+    def clear(self):
+        self._outcomes.clear()
+        self._spaces.clear()
+        self._axes.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._outcomes)
+
+"""
+    Normalized coordinates of the visited points of one font and size, with a
+    k-d tree of them for nearest-point lookups. Searches alternate adding
+    points and looking them up, so the tree is not rebuilt for every point
+    added: points added since it was built are scanned one by one, and
+    points removed from it are skipped, until there are more of either than
+    the square root of the number of points. Each lookup then costs about
+    the square root of the number of points, rather than a rebuild.
+"""
+class VisitedPoints:
+    def __init__(self):
+        self._points = {}
+        self._tree = None
+        # Keys of the tree's points by index, None once removed
+        self._keys = []
+        self._indices = {}
+        self._removed = 0
+        # Keys added since the tree was built
+        self._recent = []
+
+    def add(self, key, point):
+        self.remove(key)
+        self._points[key] = point
+        self._recent.append(key)
+
+    def remove(self, key):
+        if self._points.pop(key, None) is None:
+            return
+        index = self._indices.pop(key, None)
+        if index is None:
+            self._recent.remove(key)
+        else:
+            self._keys[index] = None
+            self._removed += 1
+
+    """
+        Returns the key of the closest point within tolerance (Chebyshev
+        distance, less than tolerance), or None.
+    """
+    def nearest(self, point, tolerance):
+        if len(self._points) == 0:
+            return None
+
+        if len(self._recent) + self._removed > math.isqrt(len(self._points)):
+            self._rebuild()
+
+        candidates = []
+        if self._tree is not None:
+            candidates = [index for index in self._tree.query_ball_point(point, tolerance, p=np.inf)
+                            if self._keys[index] is not None]
+        keys = [self._keys[index] for index in candidates] + self._recent
+        if len(keys) == 0:
+            return None
+
+        distances = np.max(np.abs(np.array([self._points[key] for key in keys]) - point), axis=1, initial=0)
+        best = int(np.argmin(distances))
+        if distances[best] >= tolerance:
+            return None
+        return keys[best]
+
+    def _rebuild(self):
+        self._keys = list(self._points.keys())
+        self._indices = {key: index for index, key in enumerate(self._keys)}
+        self._tree = cKDTree(np.array([self._points[key] for key in self._keys]))
+        self._removed = 0
+        self._recent = []
+
+def quantize(coords):
+    if coords is None or len(coords) == 0:
+        return None
+    # Adding 0.0 turns -0.0 into 0.0
+    return tuple(round(float(coord), COORDINATE_DECIMALS) + 0.0 for coord in coords)
+
+def normalize(coords, axes):
+    return np.array([
+        (coord - axis.minimum) / (axis.maximum - axis.minimum) if axis.maximum > axis.minimum else 0.0
+        for coord, axis in zip(coords, axes)])
@@ -1,16 +1,34 @@
+from collections import OrderedDict
+import hashlib
+import io
+from itertools import combinations
+import math
 from typing import NamedTuple
 import _ctypes
+import ctypes
 
 import freetype
 import numpy as np
+from scipy.ndimage import distance_transform_edt
+from scipy.spatial import cKDTree
 
 from ft_structs_mm import FT_MM_VarPtr
 from distance import HaussdorffDistance
+import kernels
 
 # Factors for integer/fixed point float conversions
 FIXED_POINT_16_16 = 65536   # 16.16 fixed point
 FIXED_POINT_26_6 = 64       # 26.6 fixed point
 
+# Default flattening tolerance of glyph outlines, as a fraction of the em
+OUTLINE_TOLERANCE = 0.01
+
+# Implementation of get_points and the Hausdorff distances between point
+# clouds: "numpy" for NumPy and SciPy, "numba" for the compiled kernels in
+# kernels.py, or "auto" for numba when it is installed. "numba" falls back to
+# numpy with a warning when Numba is not installed.
+kernel_backend = "numpy"
+
 """
     Renders monochrome bitmap glyphs and associated metrics using the FreeType
     typography library. Includes support for OpeType font variations.
@@ -18,20 +36,10 @@ FIXED_POINT_26_6 = 64       # 26.6 fixed point
 class GlyphRenderer:
     def __init__(self, fileName):
         self._face = freetype.Face(fileName)
+        self._variations, self._axes = get_variations(self._face)
 
-        self._variations = FT_MM_VarPtr()
-        freetype.FT_Get_MM_Var(self._face._FT_Face, _ctypes.byref(self._variations))
-
-        self._axes = []
-        if self._variations: # NULL pointers have false boolean value
-            for i in range(self._variations.contents.num_axis):
-                axis = self._variations.contents.axis[i]
-                if axis is None:
-                    break
-
-                font_axis = FontAxis(
-                    axis.name.decode('utf-8'), axis.tag, axis.minimum/FIXED_POINT_16_16, axis.maximum/FIXED_POINT_16_16, getattr(axis, 'def')/FIXED_POINT_16_16)
-                self._axes.append(font_axis)
+        # Design coordinates last applied, or None while at the font defaults
+        self._coords = None
     
     """
         Renders a monochrome character bitmap using the specified size and optional 
@@ -46,13 +54,20 @@ class GlyphRenderer:
         optional variable font coordinates.
     """
     def bitmaps(self, chars, size, coords):
+        return self.align_glyphs(self.glyph_bitmaps(chars, size, coords))
+
+    """
+        Renders the character bitmaps and metrics using the specified size and
+        optional variable font coordinates, without aligning them.
+    """
+    def glyph_bitmaps(self, chars, size, coords):
         self.configure_font(size, coords)
         
         glpyh_bitmaps = []
         for char in chars:
             glpyh_bitmaps.append(self.render(char))
         
-        return self.align_glyphs(glpyh_bitmaps)
+        return glpyh_bitmaps
 
     """
         Sets base font configuration, including font size and font variation
@@ -63,10 +78,26 @@ class GlyphRenderer:
         self._face.set_char_size(size*FIXED_POINT_26_6)
         
         if coords is not None:
-            fixed = [int(coord*FIXED_POINT_16_16) for coord in coords]
-            coords_type = freetype.FT_Fixed * len(fixed)
-            ft_coords = coords_type(*fixed)
-            freetype.FT_Set_Var_Design_Coordinates(self._face._FT_Face, len(fixed), ft_coords)
+            self.set_design_coordinates(coords)
+            self._coords = list(coords)
+        elif self._coords is not None:
+            # An earlier call varied the design, so return to the defaults
+            self.reset_coordinates()
+
+    """
+        Returns all variation axes to their default design coordinates, as on
+        a newly created renderer.
+    """
+    def reset_coordinates(self):
+        if len(self._axes) > 0:
+            self.set_design_coordinates([axis.default for axis in self._axes])
+        self._coords = None
+
+    def set_design_coordinates(self, coords):
+        fixed = [int(coord*FIXED_POINT_16_16) for coord in coords]
+        coords_type = freetype.FT_Fixed * len(fixed)
+        ft_coords = coords_type(*fixed)
+        freetype.FT_Set_Var_Design_Coordinates(self._face._FT_Face, len(fixed), ft_coords)
 
     """
         Render glyph bitmap and return with positioning metrics.
@@ -76,22 +107,48 @@ class GlyphRenderer:
         metrics = self._face.glyph.metrics
         bitmap = self._face.glyph.bitmap
 
-        data = []
-        for i in range(bitmap.rows):
-            row = []
-            for j in range(bitmap.pitch):
-                row.extend(self.pixels_to_list(bitmap.buffer[i*bitmap.pitch+j]))
-            data.extend(row[:bitmap.width])
-        
+        # Read the raw buffer in one call; freetype-py's Bitmap.buffer property
+        # copies it into a Python list one byte at a time.
+        buffer = ctypes.string_at(bitmap._FT_Bitmap.buffer, bitmap.rows*bitmap.pitch)
+
         return GlyphBitmap(
-            bitmap = np.array(data).reshape(bitmap.rows, bitmap.width),
+            bitmap = unpack_mono_buffer(buffer, bitmap.rows, bitmap.width, bitmap.pitch),
             height = int(metrics.height/FIXED_POINT_26_6), 
             width = int(metrics.width/FIXED_POINT_26_6),
             y_bearing = int(metrics.horiBearingY/FIXED_POINT_26_6), 
             x_bearing = int(metrics.horiBearingX)/FIXED_POINT_26_6)      
 
+    """
+        Reads a character's outline at the configured size and coordinates,
+        without rasterizing it, and flattens it to points in pixels (see
+        flatten_outline). tolerance is a fraction of the em, so a glyph has
+        about as many points at any size. Outlines are not hinted, so they
+        scale exactly with size.
+    """
+    def outline(self, char, tolerance=OUTLINE_TOLERANCE):
+        self._face.load_char(char, freetype.FT_LOAD_NO_BITMAP | freetype.FT_LOAD_NO_HINTING)
+        return flatten_outline(self._face.glyph.outline, tolerance * self._face.size.x_ppem)
+
+    """
+        Reads the flattened outlines of a set of characters using the
+        specified size and optional variable font coordinates, without
+        aligning them.
+    """
+    def glyph_outlines(self, chars, size, coords, tolerance=OUTLINE_TOLERANCE):
+        self.configure_font(size, coords)
+        return [self.outline(char, tolerance) for char in chars]
+
+    """
+        Reads the flattened outlines of a set of characters, aligned as
+        bitmaps are by align_glyphs (see align_outlines).
+    """
+    def outlines(self, chars, size, coords, tolerance=OUTLINE_TOLERANCE):
+        return align_outlines(self.glyph_outlines(chars, size, coords, tolerance))
+
     """
         Converts monochrome pixel values from a byte of bits to a list of ints.
+        Superseded by unpack_mono_buffer for rendering; kept as the reference
+        decoder.
     """
     def pixels_to_list(self, byte):
         pixels = []
@@ -110,36 +167,84 @@ class GlyphRenderer:
         a common guideline.
     """
     def align_glyphs(self, glyph_bitmaps):
-        # Height above of the guideline will be the maximum Y bearing
-        max_ascent = max([g.y_bearing for g in glyph_bitmaps])
-        
-        # Depth below the guideline will be the max difference between the height and Y bearing
-        max_descent = max([g.height - g.y_bearing for g in glyph_bitmaps])
-        
-        # Width of bitmap  
-        max_width = max([g.width for g in glyph_bitmaps])
-        
-        bitmaps = []
-        for glyph in glyph_bitmaps:
-            bitmap = glyph.bitmap
-            ascent_needed = max_ascent - glyph.y_bearing            
-            descent_needed = max_descent - (bitmap.shape[0] - glyph.y_bearing)
-
-            if (ascent_needed > 0):
-                bitmap = np.concatenate((np.ones((ascent_needed, bitmap.shape[1])), bitmap), axis=0)
-            if (descent_needed > 0):
-                bitmap = np.concatenate((bitmap, np.ones((descent_needed, bitmap.shape[1]))), axis=0)
-
-            cols_needed = max_width - bitmap.shape[1]
-            cols_add_left = np.ones((bitmap.shape[0], int(cols_needed/2)))
-            cols_add_right = np.ones((bitmap.shape[0], cols_needed - int(cols_needed/2)))
-
-            bitmap = np.concatenate((cols_add_left, bitmap), axis=1)
-            bitmap = np.concatenate((bitmap, cols_add_right), axis=1)
-            
-            bitmaps.append(bitmap)
-        
-        return bitmaps
+        alignment = get_alignment([get_metrics(g) for g in glyph_bitmaps])
+        return [align_glyph(glyph, alignment) for glyph in glyph_bitmaps]
+
+"""
+    Reads the variation axes of a FreeType face, returning FreeType's
+    description of the font's variations and a FontAxis per axis. Fonts
+    without variations have no axes.
+"""
+def get_variations(face):
+    variations = FT_MM_VarPtr()
+    freetype.FT_Get_MM_Var(face._FT_Face, _ctypes.byref(variations))
+
+    axes = []
+    if variations: # NULL pointers have false boolean value
+        for i in range(variations.contents.num_axis):
+            axis = variations.contents.axis[i]
+            if axis is None:
+                break
+
+            font_axis = FontAxis(
+                axis.name.decode('utf-8'), axis.tag, axis.minimum/FIXED_POINT_16_16, axis.maximum/FIXED_POINT_16_16, getattr(axis, 'def')/FIXED_POINT_16_16)
+            axes.append(font_axis)
+
+    return variations, axes
+
+"""
+    Bounded least-recently-used pool of GlyphRenderers, so that each font is
+    parsed once per process instead of once per glyph set. Renderers are keyed
+    by font id and a hash of the font content, or the path of a font store
+    file, which is named by that hash, so a font whose file changes under the
+    same id gets a new renderer.
+"""
+class RendererPool:
+    def __init__(self, max_size=16):
+        self.max_size = max_size
+        self._renderers = OrderedDict()
+
+    """
+        Returns the pooled renderer for a font, creating it if needed. The
+        renderer's design coordinates are reset to the font defaults.
+        font_file is the font's binary, or the path of a file to open it
+        from, as given by Font.font_source.
+    """
+    def get(self, font_id, font_file):
+        if isinstance(font_file, str):
+            key = (font_id, font_file)
+        else:
+            key = (font_id, hashlib.sha1(font_file).hexdigest())
+        renderer = self._renderers.get(key)
+
+        if renderer is None:
+            # Drop renderers for earlier versions of this font
+            self.evict(font_id)
+            renderer = GlyphRenderer(font_file if isinstance(font_file, str) else io.BytesIO(font_file))
+            self._renderers[key] = renderer
+            while len(self._renderers) > self.max_size:
+                self._renderers.popitem(last=False)
+        else:
+            self._renderers.move_to_end(key)
+            renderer.reset_coordinates()
+
+        return renderer
+
+    """
+        Removes any renderers for the font from the pool.
+    """
+    def evict(self, font_id):
+        for key in [key for key in self._renderers if key[0] == font_id]:
+            del self._renderers[key]
+
+    def clear(self):
+        self._renderers.clear()
+
+    def __len__(self):
+        return len(self._renderers)
+
+# Renderers shared by everything in this process
+renderer_pool = RendererPool()
 
 class FontAxis(NamedTuple):
     """Class to represent a font variation axis. """
@@ -157,27 +262,484 @@ class GlyphBitmap(NamedTuple):
     y_bearing: int
     x_bearing: int
 
-def hausdorff_distance(bitmap1, bitmap2):
+class GlyphOutline(NamedTuple):
+    """Class to represent a flattened glyph outline and its extents, in pixels with y up. """
+    points: np.ndarray
+    x_min: float
+    x_max: float
+    y_min: float
+    y_max: float
+
+class GlyphMetrics(NamedTuple):
+    """Class to represent the metrics a glyph is aligned by. """
+    height: int
+    width: int
+    y_bearing: int
+    columns: int
+
+class GlyphAlignment(NamedTuple):
+    """Class to represent the common pixel grid of a set of aligned glyphs. """
+    ascent: int
+    descent: int
+    width: int
+
+class HausdorffMatrix(NamedTuple):
+    """Class to represent the pairwise Hausdorff distances of a glyph set. """
+    distances: np.ndarray
+    points1: np.ndarray
+    points2: np.ndarray
+
+"""
+    Returns the metrics of a rendered glyph that align_glyph uses. columns is
+    the width of the bitmap itself, which can differ from the metric width.
+"""
+def get_metrics(glyph):
+    return GlyphMetrics(
+        height = int(glyph.height),
+        width = int(glyph.width),
+        y_bearing = int(glyph.y_bearing),
+        columns = int(glyph.bitmap.shape[1]))
+
+"""
+    Returns the common pixel grid for glyphs with the specified metrics. The
+    height above the guideline is the maximum Y bearing, the depth below it
+    the maximum difference between the height and Y bearing, and the width
+    the maximum glyph width.
+"""
+def get_alignment(metrics):
+    return GlyphAlignment(
+        ascent = max([m.y_bearing for m in metrics]),
+        descent = max([m.height - m.y_bearing for m in metrics]),
+        width = max([m.width for m in metrics]))
+
+"""
+    Returns the (row, column) position of a glyph's bitmap within the pixel
+    grid of the specified alignment. Horizontal alignment is centered and
+    vertical alignment is fixed to a common guideline.
+"""
+def get_offset(metrics, alignment):
+    return (alignment.ascent - metrics.y_bearing, int((alignment.width - metrics.columns)/2))
+
+"""
+    Pads a rendered glyph's bitmap to the pixel grid of the specified
+    alignment.
+"""
+def align_glyph(glyph, alignment):
+    bitmap = glyph.bitmap
+    ascent_needed = alignment.ascent - glyph.y_bearing
+    descent_needed = alignment.descent - (bitmap.shape[0] - glyph.y_bearing)
+
+    if (ascent_needed > 0):
+        bitmap = np.concatenate((np.ones((ascent_needed, bitmap.shape[1])), bitmap), axis=0)
+    if (descent_needed > 0):
+        bitmap = np.concatenate((bitmap, np.ones((descent_needed, bitmap.shape[1]))), axis=0)
+
+    cols_needed = alignment.width - bitmap.shape[1]
+    cols_add_left = np.ones((bitmap.shape[0], int(cols_needed/2)))
+    cols_add_right = np.ones((bitmap.shape[0], cols_needed - int(cols_needed/2)))
+
+    bitmap = np.concatenate((cols_add_left, bitmap), axis=1)
+    bitmap = np.concatenate((bitmap, cols_add_right), axis=1)
+
+    return bitmap
+
+"""
+    Moves a glyph bitmap aligned to one pixel grid onto the grid of another
+    alignment, as align_glyph would have placed it there. The result is equal
+    to aligning the glyph's original rendering again, without re-rendering.
+"""
+def realign_bitmap(bitmap, metrics, alignment, new_alignment):
+    top, left = get_offset(metrics, alignment)
+    new_top, new_left = get_offset(metrics, new_alignment)
+    shape = (new_alignment.ascent + new_alignment.descent, new_alignment.width)
+    return shift_bitmap(bitmap, new_top - top, new_left - left, shape)
+
+"""
+    Moves a bitmap by the specified rows and columns within a background
+    bitmap of the given shape. Pixels moved outside of it are dropped.
+"""
+def shift_bitmap(bitmap, rows, cols, shape):
+    shifted = np.ones(shape, dtype=bitmap.dtype)
+
+    source_top, target_top = max(0, -rows), max(0, rows)
+    source_left, target_left = max(0, -cols), max(0, cols)
+    height = min(bitmap.shape[0] - source_top, shape[0] - target_top)
+    width = min(bitmap.shape[1] - source_left, shape[1] - target_left)
+
+    if height > 0 and width > 0:
+        shifted[target_top:target_top + height, target_left:target_left + width] = \
+            bitmap[source_top:source_top + height, source_left:source_left + width]
+    return shifted
+
+"""
+    Flattens a FreeType outline, loaded at a pixel size, to an n x 2 array of
+    (x, y) points in pixels. Curves are replaced by straight segments that
+    stray no more than tolerance pixels from them, and segments are then
+    divided so that consecutive points are no more than tolerance apart, so
+    the points trace every contour to within tolerance.
+"""
+def flatten_outline(outline, tolerance=0.5):
+    contours = []
+    position = []
+
+    def move_to(a, context):
+        contours.append([])
+        position[:] = [(a.x / FIXED_POINT_26_6, a.y / FIXED_POINT_26_6)]
+        contours[-1].append(np.array(position))
+
+    def line_to(a, context):
+        position[:] = [(a.x / FIXED_POINT_26_6, a.y / FIXED_POINT_26_6)]
+        contours[-1].append(np.array(position))
+
+    def conic_to(a, b, context):
+        control = [position[0], (a.x / FIXED_POINT_26_6, a.y / FIXED_POINT_26_6), (b.x / FIXED_POINT_26_6, b.y / FIXED_POINT_26_6)]
+        contours[-1].append(flatten_curve(np.array(control), tolerance))
+        position[:] = [control[-1]]
+
+    def cubic_to(a, b, c, context):
+        control = [position[0], (a.x / FIXED_POINT_26_6, a.y / FIXED_POINT_26_6), 
+                    (b.x / FIXED_POINT_26_6, b.y / FIXED_POINT_26_6), (c.x / FIXED_POINT_26_6, c.y / FIXED_POINT_26_6)]
+        contours[-1].append(flatten_curve(np.array(control), tolerance))
+        position[:] = [control[-1]]
+
+    if outline.n_points > 0:
+        outline.decompose(None, move_to=move_to, line_to=line_to, conic_to=conic_to, cubic_to=cubic_to)
+
+    polylines = [densify_polyline(np.concatenate(contour), tolerance) for contour in contours]
+    points = np.concatenate(polylines) if len(polylines) > 0 else np.zeros((0, 2))
+    if len(points) == 0:
+        return GlyphOutline(points=points, x_min=0.0, x_max=0.0, y_min=0.0, y_max=0.0)
+
+    return GlyphOutline(
+        points = points,
+        x_min = float(points[:, 0].min()),
+        x_max = float(points[:, 0].max()),
+        y_min = float(points[:, 1].min()),
+        y_max = float(points[:, 1].max()))
+
+"""
+    Points along a quadratic or cubic Bezier curve, given its control points,
+    after the first point, so that the straight segments between them stray
+    no more than tolerance from the curve.
+"""
+def flatten_curve(control, tolerance):
+    degree = len(control) - 1
+    # The deviation of a chord over a parameter interval h is at most h^2/8
+    # times the largest second derivative of the curve
+    second_differences = control[:-2] - 2 * control[1:-1] + control[2:]
+    curvature = degree * (degree - 1) * np.linalg.norm(second_differences, axis=1).max()
+    segments = max(1, int(math.ceil(math.sqrt(curvature / (8 * tolerance)))))
+
+    t = np.linspace(0.0, 1.0, segments + 1)[1:, None]
+    if degree == 2:
+        return (1 - t) ** 2 * control[0] + 2 * (1 - t) * t * control[1] + t ** 2 * control[2]
+    return ((1 - t) ** 3 * control[0] + 3 * (1 - t) ** 2 * t * control[1] + 
+            3 * (1 - t) * t ** 2 * control[2] + t ** 3 * control[3])
+
+"""
+    Adds points along each segment of a polyline so that no two consecutive
+    points are more than spacing apart.
+"""
+def densify_polyline(points, spacing):
+    if len(points) < 2:
+        return points
+
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    counts = np.maximum(1, np.ceil(lengths / spacing).astype(int))
+    starts = np.repeat(points[:-1], counts, axis=0)
+    steps = np.repeat(np.diff(points, axis=0) / counts[:, None], counts, axis=0)
+    offsets = np.concatenate([np.arange(count) for count in counts])[:, None]
+    return np.concatenate([starts + steps * offsets, points[-1:]])
+
+"""
+    Places flattened outlines in the (row, column) pixel coordinates bitmaps
+    of the same glyphs would have after align_glyphs: rows are measured down
+    from the highest point of any glyph, with every glyph on a common
+    baseline, and each glyph is centered horizontally within the widest.
+    Unlike align_glyph, centering is not rounded to whole pixels. Returns an
+    n x 2 array of points per outline.
+"""
+def align_outlines(outlines):
+    inked = [outline for outline in outlines if len(outline.points) > 0]
+    if len(inked) == 0:
+        return [outline.points for outline in outlines]
+
+    ascent = max(outline.y_max for outline in inked)
+    width = max(outline.x_max - outline.x_min for outline in inked)
+
+    aligned = []
+    for outline in outlines:
+        left = (width - (outline.x_max - outline.x_min)) / 2
+        aligned.append(np.column_stack((
+            ascent - outline.points[:, 1],
+            outline.points[:, 0] - outline.x_min + left)))
+    return aligned
+
+"""
+    Computes the Hausdorff distance between every pair of aligned outline
+    point sets, as align_outlines returns them, in the layout of
+    hausdorff_matrix. Contributing points are (row, column) floats. Returns
+    None if any outline has no points.
+"""
+def outline_hausdorff_matrix(outlines):
+    count = len(outlines)
+    if any(len(points) == 0 for points in outlines):
+        return None
+
+    # All points of the set, grouped by outline
+    counts = np.array([len(points) for points in outlines], dtype=np.int64)
+    all_points = np.concatenate(outlines)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # directed[i, j] is the directed distance from outline i to outline j,
+    # source[i, j] outline i's contributing point and nearest[i, j] the
+    # closest point of outline j to it
+    directed = np.zeros((count, count))
+    source = np.zeros((count, count, 2))
+    nearest = np.zeros((count, count, 2))
+    for j in range(count):
+        dist, indices = cKDTree(outlines[j]).query(all_points)
+        maxima = np.maximum.reduceat(dist, starts)
+
+        # First point of each outline that attains its maximum
+        hits = np.flatnonzero(dist == np.repeat(maxima, counts))
+        first = hits[np.searchsorted(hits, starts)]
+
+        directed[:, j] = maxima
+        source[:, j] = all_points[first]
+        nearest[:, j] = outlines[j][indices[first]]
+
+    i, j = np.triu_indices(count, k=1)
+    if len(i) == 0:
+        return HausdorffMatrix(distances=np.zeros(0), points1=np.zeros((0, 2, 2)), points2=np.zeros((0, 2, 2)))
+
+    return HausdorffMatrix(
+        distances = np.maximum(directed[i, j], directed[j, i]),
+        points1 = np.stack([source[i, j], nearest[j, i]], axis=1),
+        points2 = np.stack([nearest[i, j], source[j, i]], axis=1))
+
+"""
+    Converts a FreeType monochrome bitmap buffer to a rows x width array in a
+    single vectorized step. Pixels are most-significant bit first within each
+    byte and each row is padded to pitch bytes. As with pixels_to_list, ink
+    pixels are 0 and background ("white") pixels are 1.
+"""
+def unpack_mono_buffer(buffer, rows, width, pitch):
+    packed = np.frombuffer(buffer, dtype=np.uint8, count=rows*pitch).reshape(rows, pitch)
+    bits = np.unpackbits(packed, axis=1)[:, :width]
+    return (1 - bits).astype(int)
+
+"""
+    Hausdorff distance between two glyph bitmaps, with the contributing point
+    coordinates. With point_mode "boundary", only the glyph boundaries are
+    searched for nearest points (see boundary_hausdorff_distance); the
+    distances are the same as with "all".
+"""
+def hausdorff_distance(bitmap1, bitmap2, point_mode="all"):
+    if point_mode == "boundary":
+        return boundary_hausdorff_distance(bitmap1, bitmap2)
+    if point_mode != "all":
+        raise ValueError("Unknown point mode: {0}".format(point_mode))
+
     # Transform bitmaps into points
     points1 = get_points(bitmap1)
     points2 = get_points(bitmap2)
     
+    return points_hausdorff_distance(points1, points2)
+
+"""
+    Hausdorff distance computed against glyph boundaries only, returning the
+    same distances as points_hausdorff_distance. The nearest ink pixel of a
+    glyph to any pixel outside it is always a boundary pixel (an ink pixel with
+    a background 4-neighbour), and pixels inside the other glyph are at
+    distance zero, so each directed distance only compares the ink pixels
+    outside the other glyph with that glyph's boundary. The farthest point
+    itself can lie inside a stroke, so those points are all kept.
+
+    Points and boundaries from get_points can be passed in to reuse them
+    across pairs. Where several points tie, the contributing points may differ
+    from those found by points_hausdorff_distance, but always realize the
+    same distances.
+"""
+def boundary_hausdorff_distance(bitmap1, bitmap2, points1=None, points2=None, boundary1=None, boundary2=None):
+    points1 = get_points(bitmap1) if points1 is None else points1
+    points2 = get_points(bitmap2) if points2 is None else points2
+
+    if len(points1) == 0 or len(points2) == 0:
+        # One glyph or the other has failed to render at all. 
+        return None
+
+    boundary1 = get_points(bitmap1, "boundary") if boundary1 is None else boundary1
+    boundary2 = get_points(bitmap2, "boundary") if boundary2 is None else boundary2
+
+    return (directed_boundary_hausdorff(points1, bitmap2, boundary2),
+            directed_boundary_hausdorff(points2, bitmap1, boundary1))
+
+"""
+    Directed Hausdorff distance from a set of points to the glyph with the
+    specified bitmap and boundary points, with the contributing points.
+"""
+def directed_boundary_hausdorff(points, bitmap, boundary):
+    rows = points[:, 0]
+    cols = points[:, 1]
+    in_bounds = (rows < bitmap.shape[0]) & (cols < bitmap.shape[1])
+    inside = np.zeros(len(points), dtype=bool)
+    inside[in_bounds] = bitmap[rows[in_bounds], cols[in_bounds]] == 0
+
+    outside = points[~inside]
+    if len(outside) == 0:
+        # Every point is covered by the other glyph
+        return (0.0, points[0], points[0])
+
+    hauss = HaussdorffDistance.get_directed_distance(outside, boundary)
+    return (hauss[0], outside[hauss[1]], boundary[hauss[2]])
+
+"""
+    Hausdorff distance between two point clouds produced by get_points. Callers
+    comparing one glyph against many should extract its points once and reuse
+    them for every pair. Contributing points are returned as int32 rows of the
+    point arrays.
+"""
+def points_hausdorff_distance(points1, points2):
     if len(points1) == 0 or len(points2) == 0:
         # One glyph or the other has failed to render at all. 
         # This can happen at very small resolutions, particularly for unusual
         # variable designs at unexpected coordinates.
         return None
 
+    if kernels.resolve(kernel_backend) == "numba":
+        return kernels.points_hausdorff_distance(points1, points2)
+
     hauss = HaussdorffDistance.get_distance(points1, points2)
     
     # Return haussdorff distancs and the contributing point coordinates
     return ((hauss[0][0], points1[hauss[0][1]], points2[hauss[0][2]]), 
             (hauss[1][0], points2[hauss[1][1]], points1[hauss[1][2]]))
 
-def get_points(bitmap):
-    points = []
-    for i in range(bitmap.shape[0]):
-        for j in range(bitmap.shape[1]):
-            if bitmap[i][j] == 0:
-                points.append((i,j))
-    return points
\ No newline at end of file
+"""
+    Hausdorff distances between every pair of point clouds produced by
+    get_points, in the order of itertools.combinations and in the form of
+    points_hausdorff_distance. With the numba kernel backend, pairs are
+    compared in parallel. Returns None if any point cloud is empty.
+"""
+def pairwise_hausdorff_distances(points):
+    if any(len(p) == 0 for p in points):
+        return None
+    if kernels.resolve(kernel_backend) == "numba":
+        return kernels.pairwise_hausdorff_distances(points)
+    return [points_hausdorff_distance(points[i], points[j]) for i, j in combinations(range(len(points)), 2)]
+
+"""
+    Computes the Hausdorff distance between every pair of bitmaps in a single
+    pass. The bitmaps must share a common pixel grid, as they do after
+    GlyphRenderer.align_glyphs, so one Euclidean distance transform per glyph
+    gives its directed distance from every other glyph as a max over that
+    glyph's ink pixels.
+
+    Returns a HausdorffMatrix with distances in condensed order (the order of
+    itertools.combinations) and, for each pair, the contributing points in
+    the same layout as get_shape_distances stores them: points1[k] holds the
+    first glyph's contributing point and its nearest point to the second
+    glyph's contributing point, points2[k] the reverse. Distances match
+    points_hausdorff_distance exactly; where several points tie, the first in
+    row-major order is reported. Returns None if any bitmap has no ink.
+"""
+def hausdorff_matrix(bitmaps):
+    count = len(bitmaps)
+    if any(bitmap.shape != bitmaps[0].shape for bitmap in bitmaps):
+        raise ValueError("Bitmaps must share a common pixel grid. Align them with GlyphRenderer.align_glyphs first.")
+
+    points = [get_points(bitmap) for bitmap in bitmaps]
+    counts = np.array([len(p) for p in points], dtype=np.int64)
+    if np.any(counts == 0):
+        return None
+
+    pair_count = count * (count - 1) // 2
+    if pair_count == 0:
+        return HausdorffMatrix(
+            distances = np.zeros(0),
+            points1 = np.zeros((0, 2, 2), dtype=np.int32),
+            points2 = np.zeros((0, 2, 2), dtype=np.int32))
+
+    # All ink pixels of the set, grouped by glyph
+    all_points = np.concatenate(points)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rows = all_points[:, 0]
+    cols = all_points[:, 1]
+
+    # directed[i, j] is the directed distance from glyph i to glyph j, source[i, j]
+    # the index in all_points of glyph i's contributing point and nearest[i, j]
+    # the closest pixel of glyph j to it.
+    directed = np.zeros((count, count))
+    source = np.zeros((count, count), dtype=np.int64)
+    nearest = np.zeros((count, count, 2), dtype=np.int32)
+
+    for j in range(count):
+        # Background pixels are non-zero, so this is the distance to glyph j's ink
+        dist, indices = distance_transform_edt(bitmaps[j], return_indices=True)
+        point_dist = dist[rows, cols]
+        maxima = np.maximum.reduceat(point_dist, starts)
+
+        # First point of each glyph that attains its maximum
+        hits = np.flatnonzero(point_dist == np.repeat(maxima, counts))
+        first = hits[np.searchsorted(hits, starts)]
+
+        directed[:, j] = maxima
+        source[:, j] = first
+        nearest[:, j] = indices[:, rows[first], cols[first]].T
+
+    i, j = np.triu_indices(count, k=1)
+    return HausdorffMatrix(
+        distances = np.maximum(directed[i, j], directed[j, i]),
+        points1 = np.stack([all_points[source[i, j]], nearest[j, i]], axis=1),
+        points2 = np.stack([nearest[i, j], all_points[source[j, i]]], axis=1))
+
+"""
+    Completes a partial HausdorffMatrix of aligned bitmaps, in the layout of
+    hausdorff_matrix. Pairs whose distance in known is not NaN are taken as
+    they are; the rest are compared one pair at a time, which is faster than
+    a full hausdorff_matrix when only a few glyphs are new. Returns None if
+    any bitmap has no ink.
+"""
+def complete_hausdorff_matrix(bitmaps, known):
+    points = [get_points(bitmap) for bitmap in bitmaps]
+    if any(len(p) == 0 for p in points):
+        return None
+
+    distances = np.array(known.distances, dtype=np.float64)
+    points1 = np.array(known.points1, dtype=np.int32)
+    points2 = np.array(known.points2, dtype=np.int32)
+
+    pairs = combinations(range(len(bitmaps)), 2)
+    for k, (i, j) in enumerate(pairs):
+        if not np.isnan(distances[k]):
+            continue
+
+        haus = points_hausdorff_distance(points[i], points[j])
+        distances[k] = max(haus[0][0], haus[1][0])
+        points1[k] = np.stack([haus[0][1], haus[1][2]])
+        points2[k] = np.stack([haus[0][2], haus[1][1]])
+
+    return HausdorffMatrix(distances=distances, points1=points1, points2=points2)
+
+"""
+    Returns the (row, column) coordinates of ink pixels as a contiguous n x 2
+    int32 array, in row-major order. point_mode "all" returns every ink pixel,
+    "boundary" only those with a background 4-neighbour or on the edge of the
+    bitmap.
+"""
+def get_points(bitmap, point_mode="all"):
+    if point_mode not in ("all", "boundary"):
+        raise ValueError("Unknown point mode: {0}".format(point_mode))
+    if kernels.resolve(kernel_backend) == "numba":
+        return kernels.get_points(bitmap, point_mode == "boundary")
+
+    ink = bitmap == 0
+
+    if point_mode == "boundary":
+        padded = np.pad(ink, 1, mode="constant", constant_values=False)
+        interior = (padded[:-2, 1:-1] & padded[2:, 1:-1] & 
+                    padded[1:-1, :-2] & padded[1:-1, 2:])
+        ink = ink & ~interior
+
+    return np.ascontiguousarray(np.argwhere(ink), dtype=np.int32)
@@ -1,3 +1,8 @@
+-- Glyph sets saved with systematicity.shape_distance_storage = "matrix" keep
+-- their distances in shapedistancematrix. Run
+-- systematicity.materialize_shape_distances(glyph_set_id) first to write the
+-- per-pair shapedistance rows these queries read.
+
 select sd.id, g1.id, g2.id, g1.character, g2.character, sd.distance, sd.points1, sd.points2 
 from shapedistance sd
 	inner join glyph g1 on sd.glyph1_id = g1.id
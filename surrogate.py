@@ -0,0 +1,117 @@
+import math
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.stats import norm
+
+"""
+    Surrogate models of correlation over axis coordinates, for optimizers that
+    choose which point to evaluate next from the points evaluated so far
+    rather than by trial and error. Everything runs on the CPU with NumPy and
+    SciPy.
+"""
+
+"""
+    Gaussian process regression with a squared exponential kernel, over
+    coordinates scaled to [0, 1] along each axis. Observations are
+    standardized before fitting. The length scale is chosen from
+    length_scales by marginal likelihood each time the model is fitted.
+    noise is the variance of observation noise relative to the variance of
+    the observations, which allows for points too close together to tell
+    apart once rendered.
+"""
+class GaussianProcess:
+    def __init__(self, length_scales=(0.05, 0.1, 0.2, 0.4, 0.8), noise=1e-3):
+        self.length_scales = length_scales
+        self.noise = noise
+        self.length_scale = None
+
+    def fit(self, x, y):
+        self.x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.0
+        self.y = (y - self.y_mean) / self.y_std
+
+        best_likelihood = -math.inf
+        for length_scale in self.length_scales:
+            factor = cho_factor(self.kernel(self.x, self.x, length_scale) + self.noise * np.eye(len(self.x)))
+            alpha = cho_solve(factor, self.y)
+            likelihood = -0.5 * self.y.dot(alpha) - np.log(np.diag(factor[0])).sum()
+            if likelihood > best_likelihood:
+                best_likelihood = likelihood
+                self.length_scale = length_scale
+                self.factor = factor
+                self.alpha = alpha
+        return self
+
+    """
+        Returns the predicted mean and standard deviation at each point of x,
+        in the units of the observations.
+    """
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        cross = self.kernel(x, self.x, self.length_scale)
+        mean = cross.dot(self.alpha)
+        variance = 1.0 - np.einsum("ij,ji->i", cross, cho_solve(self.factor, cross.T))
+        std = np.sqrt(np.maximum(variance, 0.0))
+        return mean * self.y_std + self.y_mean, std * self.y_std
+
+    @staticmethod
+    def kernel(x1, x2, length_scale):
+        distances = ((x1[:, None, :] - x2[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-0.5 * distances / length_scale ** 2)
+
+"""
+    Expected amount by which each predicted point improves on best when
+    maximizing. xi trades exploitation for exploration: larger values favour
+    points the model is unsure of.
+"""
+def expected_improvement(mean, std, best, xi=0.01):
+    improvement = mean - best - xi
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(std > 0, improvement / std, 0.0)
+    ei = improvement * norm.cdf(z) + std * norm.pdf(z)
+    return np.where(std > 0, ei, np.maximum(improvement, 0.0))
+
+"""
+    Scales coordinates to [0, 1] along each axis, and back.
+"""
+def to_unit(coords, axes):
+    return [(c - axis.minimum) / (axis.maximum - axis.minimum) if axis.maximum > axis.minimum else 0.0
+                for c, axis in zip(coords, axes)]
+
+def from_unit(point, axes):
+    return [round(axis.minimum + p * (axis.maximum - axis.minimum), 4) for p, axis in zip(point, axes)]
+
+"""
+    Chooses batch_size points to evaluate next, given the points observed so
+    far (in [0, 1] coordinates) and their values, by maximizing expected
+    improvement over num_candidates random points and as many again drawn
+    close to the best observation. When choosing several points, each chosen
+    point is added to the model as if it had been observed at its predicted
+    mean, so that the rest are chosen elsewhere. random_state is a NumPy
+    RandomState.
+"""
+def propose(x, y, batch_size, random_state, num_candidates=500, xi=0.01):
+    x = [list(p) for p in x]
+    y = list(y)
+    dims = len(x[0])
+    model = GaussianProcess()
+
+    proposals = []
+    for _ in range(batch_size):
+        model.fit(x, y)
+        best = x[int(np.argmax(y))]
+        candidates = np.vstack([
+            random_state.uniform(size=(num_candidates, dims)),
+            np.clip(random_state.normal(best, 0.05, size=(num_candidates, dims)), 0.0, 1.0)])
+
+        mean, std = model.predict(candidates)
+        chosen = candidates[int(np.argmax(expected_improvement(mean, std, max(y), xi)))]
+        proposals.append(chosen.tolist())
+
+        x.append(chosen.tolist())
+        y.append(float(model.predict(chosen[None, :])[0][0]))
+
+    return proposals
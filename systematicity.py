@@ -1,32 +1,82 @@
-import io
+import hashlib
 from itertools import combinations
 import json
 from typing import NamedTuple
 
 import numpy as np
+from scipy.special import betainc
 from scipy.stats.stats import pearsonr
-from peewee import DoesNotExist
+from peewee import DoesNotExist, IntegrityError
 
+from arena import BitmapArena
 import data
-from data import Font, GlyphSet, Glyph, SoundDistance, ShapeDistance, Correlation
+import instrumentation
+from data import Font, GlyphSet, Glyph, SoundDistance, ShapeDistance, ShapeDistanceMatrix, Correlation
 import shapes
 
+# How new shape distances are saved: "matrix" stores one ShapeDistanceMatrix
+# record per glyph set, "rows" one ShapeDistance row per pair of glyphs.
+shape_distance_storage = "matrix"
+
+# Shape distance evaluations correlate with sound distances. "hausdorff" compares
+# the ink pixels of the rendered bitmaps. "outline_hausdorff" compares glyph
+# outlines read from the font without rasterizing them, flattened to points
+# outline_tolerance of an em apart, at a cost that does not grow with size.
+# Shape distances and correlations are stored under the metric they were
+# calculated with, including the tolerance for outlines (see
+# get_stored_metric), and the experiments' evaluation_memo keys outcomes by
+# get_metric_settings.
+shape_metric = "hausdorff"
+outline_tolerance = shapes.OUTLINE_TOLERANCE
+
+# Whether evaluate builds a new glyph set from a stored one of the same font,
+# size and coordinates whose characters are a subset or superset of the new
+# set's, rendering and comparing only what the stored set lacks.
+extend_glyph_sets = True
+
+"""
+    The settings that shape distances, and so evaluation outcomes, depend on:
+    the shape metric and, for outlines, the flattening tolerance.
+"""
+def get_metric_settings():
+    if shape_metric == "outline_hausdorff":
+        return (shape_metric, outline_tolerance)
+    return (shape_metric,)
+
+"""
+    The name shape distances and correlations of a metric are stored under.
+    Outline distances depend on the flattening tolerance, so it is part of
+    their name, as in "outline_hausdorff@0.01", and distances calculated at
+    one tolerance are never taken for another's.
+"""
+def get_stored_metric(metric, tolerance=None):
+    if metric != "outline_hausdorff":
+        return metric
+    if tolerance is None:
+        tolerance = outline_tolerance
+    return "{0}@{1:g}".format(metric, tolerance)
+
 """
     Delete any glyph sets that match the specified criteria. All glyphs, shapedistances,
     and correlations will be deleted as well.
 """
 def delete_glyph_set(chars, font, size, coords=None):
-    coords_serial = json.dumps(coords)
+    cache_key = get_glyph_set_key(get_font_hash(font), size, coords, chars)
     chars_serial = json.dumps(chars)
 
     with data.db.atomic():
-        glyph_sets = (GlyphSet
-                    .select()
-                    .where(
-                        GlyphSet.font_id == font.id, 
-                        GlyphSet.size == size,
-                        GlyphSet.coords == coords_serial, 
-                        GlyphSet.chars == chars_serial))
+        glyph_sets = list(GlyphSet.select().where(GlyphSet.cache_key == cache_key))
+
+        # Duplicates saved before cache keys existed have no key of their own
+        coords_key = quantize_coords(coords)
+        glyph_sets += [glyph_set for glyph_set in GlyphSet
+                        .select()
+                        .where(
+                            GlyphSet.cache_key.is_null() &
+                            (GlyphSet.font_id == font.id) &
+                            (GlyphSet.size == size) &
+                            (GlyphSet.chars == chars_serial))
+                        if quantize_coords(None if glyph_set.coords is None else json.loads(glyph_set.coords)) == coords_key]
         print("Found {0} matching glyph sets".format(len(glyph_sets)))
 
         for glyph_set in glyph_sets:
@@ -34,100 +84,559 @@ def delete_glyph_set(chars, font, size, coords=None):
             result = glyph_set.delete_instance(recursive=True)
             print(result, "glyph sets deleted")
 
+"""
+    Returns the id of an existing glyph set matching the specified criteria, or
+    None if the glyphs have not been rendered yet.
+"""
+def find_glyph_set(chars, font, size, coords=None):
+    cache_key = get_glyph_set_key(get_font_hash(font), size, coords, chars)
+
+    glyph_set = (GlyphSet
+                    .select(GlyphSet.id)
+                    .where(GlyphSet.cache_key == cache_key)
+                    .first())
+    if glyph_set is not None:
+        return glyph_set.id
+
+    return None
+
+"""
+    Canonical cache key of a glyph set: a SHA-1 over the font content hash,
+    size, coordinates rounded to 4 decimal places (the precision experiments
+    generate) and the character list. Unlike the JSON in GlyphSet.coords,
+    equal coordinates always give equal keys, however the floats are written.
+"""
+def get_glyph_set_key(font_hash, size, coords, chars):
+    key = json.dumps([font_hash, int(size), quantize_coords(coords), list(chars)], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+"""
+    Key shared by every glyph set of a font at one size and set of
+    coordinates, whatever its characters: a SHA-1 over the same font hash,
+    size and rounded coordinates as get_glyph_set_key. Indexed as
+    GlyphSet.coords_key, for find_related_glyph_set.
+"""
+def get_coords_key(font_hash, size, coords):
+    key = json.dumps([font_hash, int(size), quantize_coords(coords)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+"""
+    Coordinates as strings rounded to 4 decimal places, or None for a font's
+    defaults, so that equal coordinates compare equal however their floats
+    were written.
+"""
+def quantize_coords(coords):
+    if coords is None or len(coords) == 0:
+        return None
+    # Adding 0.0 turns -0.0 into 0.0
+    return ["{0:.4f}".format(round(float(coord), 4) + 0.0) for coord in coords]
+
+# Content hashes of fonts kept in the database rather than the font store, by
+# font id, so that each is hashed once per process
+font_hashes = {}
+
+def get_font_hash(font):
+    if font.file_hash is not None:
+        return font.file_hash
+    if font.id not in font_hashes:
+        font_hashes[font.id] = hashlib.sha1(font.font_file).hexdigest()
+    return font_hashes[font.id]
+
 """
     Gets or creates a set of glyphs using the specified criteria. If a glyph set for this
     criteria already exists, the glyphset id is loaded and returned. If a set does not
     exist, a new glyphset is created and glyphs are rendered and saved.
+
+    With bitmaps False, as outline measurements need, new glyphs are saved
+    without rendering them. Their bitmaps are rendered by
+    render_missing_bitmaps if they are asked for later.
+"""
+@instrumentation.profiled("get_glyphs")
+def get_glyphs(chars, font, size, coords=None, bitmaps=True):
+    # Check if glyphs already exist    
+    glyph_set_id = find_glyph_set(chars, font, size, coords)
+    if glyph_set_id is None and not bitmaps:
+        glyph_set_id = save_glyphs(chars, font, size, coords, None)
+    elif glyph_set_id is None:
+        rendered = render_glyphs(font.id, font.font_source, chars, size, coords)
+        glyph_set_id = save_glyphs(chars, font, size, coords, rendered.bitmaps, rendered.metrics)
+    elif bitmaps:
+        render_missing_bitmaps(glyph_set_id)
+
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+    return glyph_set_id
+
+"""
+    Renders the aligned bitmaps for a set of characters, with the metrics they
+    were aligned by. Does not touch the database, so it can run in a worker
+    process. Renderers come from the process's renderer pool.
+"""
+def render_glyphs(font_id, font_file, chars, size, coords=None):
+    renderer = shapes.renderer_pool.get(font_id, font_file)
+    glyph_bitmaps = renderer.glyph_bitmaps(chars, size, coords)
+    bitmaps = renderer.align_glyphs(glyph_bitmaps)
+
+    if instrumentation.profiler.active:
+        instrumentation.profiler.count(pixels=sum(bitmap.size for bitmap in bitmaps))
+
+    return RenderedGlyphs(
+        bitmaps = bitmaps,
+        metrics = [shapes.get_metrics(glyph) for glyph in glyph_bitmaps])
+
+"""
+    Renders and saves the bitmaps of a glyph set whose glyphs were saved
+    without them, for outline measurements, so that bitmap distances can be
+    measured on it. rendered may give the RenderedGlyphs (or
+    GlyphSetMeasurement) of chars if they are already at hand. Does nothing
+    if the set has all its bitmaps.
+"""
+def render_missing_bitmaps(glyph_set_id, chars=None, rendered=None):
+    if not (Glyph
+            .select(Glyph.id)
+            .where((Glyph.glyph_set_id == glyph_set_id) & Glyph.bitmap.is_null())
+            .exists()):
+        return
+
+    glyphs = [glyph for glyph in Glyph
+                .select(Glyph.id, Glyph.character)
+                .where(Glyph.glyph_set_id == glyph_set_id)
+                .order_by(Glyph.id)]
+    if rendered is None:
+        glyph_set = GlyphSet.get_by_id(glyph_set_id)
+        chars = [glyph.character for glyph in glyphs]
+        coords = None if glyph_set.coords is None else json.loads(glyph_set.coords)
+        rendered = render_glyphs(glyph_set.font_id, glyph_set.font.font_source, chars, glyph_set.size, coords)
+
+    rendered_glyphs = dict(zip(chars, zip(rendered.bitmaps, rendered.metrics)))
+    with data.db.atomic():
+        for glyph in glyphs:
+            bitmap, metrics = rendered_glyphs[glyph.character]
+            (Glyph
+                .update(bitmap=bitmap, metrics=json.dumps(metrics._asdict()))
+                .where(Glyph.id == glyph.id)
+                .execute())
+
+"""
+    Saves a new glyph set and its rendered bitmaps, returning the glyph set id.
+    Glyphs saved with their metrics can be reused by extend_glyph_set. With
+    bitmaps None, the glyphs are saved without bitmaps or metrics.
 """
-def get_glyphs(chars, font, size, coords=None):
+def save_glyphs(chars, font, size, coords, bitmaps, metrics=None):
     coords_serial = None if (coords is None or len(coords) == 0) else json.dumps(coords)
     chars_serial = json.dumps(chars)
-    
-    # Check if glyphs already exist    
-    glyph_sets = (GlyphSet
-                    .select()
-                    .where(
-                        GlyphSet.font_id == font.id, 
-                        GlyphSet.size == size,
-                        GlyphSet.coords == coords_serial, 
-                        GlyphSet.chars == chars_serial)
-                    .execute())
-    if len(glyph_sets) > 0:
-        return glyph_sets[0].id
-
-    renderer = shapes.GlyphRenderer(io.BytesIO(font.font_file))
-    bitmaps = renderer.bitmaps(chars, size, coords)
-
-    glyph_set = GlyphSet(font=font, size=size, coords=coords_serial, chars=chars_serial)
-    glyph_set.save()
-    
-    glyphs = []
-    for i in range(len(chars)):
-        glyph = Glyph(
-            glyph_set_id = glyph_set.id,
-            character = chars[i],
-            bitmap = bitmaps[i]
-        )
-        glyphs.append(glyph)
 
+    font_hash = get_font_hash(font)
+    cache_key = get_glyph_set_key(font_hash, size, coords, chars)
+    coords_key = get_coords_key(font_hash, size, coords)
+
+    # The set and its glyphs are saved together, so that a set is never
+    # found without its glyphs
     with data.db.atomic():
+        glyph_set = GlyphSet(font=font, size=size, coords=coords_serial, chars=chars_serial, 
+                                cache_key=cache_key, coords_key=coords_key)
+        glyph_set.save()
+        
+        glyphs = []
+        for i in range(len(chars)):
+            glyph = Glyph(
+                glyph_set_id = glyph_set.id,
+                character = chars[i],
+                bitmap = None if bitmaps is None else bitmaps[i],
+                metrics = None if metrics is None else json.dumps(metrics[i]._asdict())
+            )
+            glyphs.append(glyph)
+
         Glyph.bulk_create(glyphs, batch_size=100)
 
     return glyph_set.id
 
+"""
+    Returns the id of a stored glyph set of the same font, size and
+    coordinates whose characters are a subset or superset of chars, and
+    whose glyphs were saved with their metrics, or None if there is none.
+    Glyphs saved without bitmaps have no metrics either, so their sets are
+    never found.
+    Prefers the set sharing the most characters, then the smallest.
+"""
+def find_related_glyph_set(chars, font, size, coords=None):
+    coords_key = get_coords_key(get_font_hash(font), size, coords)
+
+    candidates = []
+    for glyph_set in (GlyphSet
+                        .select(GlyphSet.id, GlyphSet.chars)
+                        .where(GlyphSet.coords_key == coords_key)):
+        stored = set(json.loads(glyph_set.chars))
+        if stored <= set(chars) or stored >= set(chars):
+            shared = len(stored & set(chars))
+            candidates.append((-shared, len(stored), glyph_set.id))
+
+    for _, _, glyph_set_id in sorted(candidates):
+        if not (Glyph
+                .select(Glyph.id)
+                .where((Glyph.glyph_set_id == glyph_set_id) & Glyph.metrics.is_null())
+                .exists()):
+            return glyph_set_id
+
+    return None
+
+"""
+    Saves a new glyph set for chars by extending or narrowing a related
+    stored set found by find_related_glyph_set, rather than starting over.
+    Only the characters the stored set lacks are rendered. Stored glyphs are
+    moved onto the new set's pixel grid, which changes when the new glyphs
+    widen its extents or the dropped glyphs narrow them, and keep their
+    distances to each other unless centring moves one by a different number
+    of columns than the other. All other pairs are compared afresh.
+
+    Returns the new glyph set id and its HausdorffMatrix, or (None, None) if
+    there is no related glyph set. Distances are the same as a full
+    evaluation gives; where points tie, the contributing points may differ.
+"""
+@instrumentation.profiled("extend_glyph_set")
+def extend_glyph_set(chars, font, size, coords=None):
+    base_id = find_related_glyph_set(chars, font, size, coords)
+    if base_id is None:
+        return None, None
+
+    stored = {glyph.character: glyph for glyph in Glyph
+                .select()
+                .where(Glyph.glyph_set_id == base_id)}
+    stored_metrics = {char: shapes.GlyphMetrics(**json.loads(glyph.metrics)) for char, glyph in stored.items()}
+    base_alignment = shapes.get_alignment(list(stored_metrics.values()))
+
+    # Render only the characters the stored set does not have
+    new_chars = [char for char in chars if char not in stored]
+    new_glyphs = {}
+    if len(new_chars) > 0:
+        renderer = shapes.renderer_pool.get(font.id, font.font_source)
+        new_glyphs = dict(zip(new_chars, renderer.glyph_bitmaps(new_chars, size, coords)))
+
+    metrics = [stored_metrics[char] if char in stored else shapes.get_metrics(new_glyphs[char]) for char in chars]
+    alignment = shapes.get_alignment(metrics)
+
+    bitmaps = []
+    shifts = {}
+    for char, glyph_metrics in zip(chars, metrics):
+        if char in stored:
+            bitmaps.append(shapes.realign_bitmap(stored[char].bitmap, glyph_metrics, base_alignment, alignment))
+            shifts[char] = np.subtract(shapes.get_offset(glyph_metrics, alignment), 
+                                        shapes.get_offset(glyph_metrics, base_alignment))
+        else:
+            bitmaps.append(shapes.align_glyph(new_glyphs[char], alignment))
+
+    if instrumentation.profiler.active:
+        instrumentation.profiler.count(pixels=sum(bitmaps[i].size for i, char in enumerate(chars) if char in new_glyphs))
+        count_points(bitmaps)
+
+    # Stored distances of pairs whose glyphs moved together, shifted onto the new grid
+    characters = {glyph.id: char for char, glyph in stored.items()}
+    records = {(characters[s.glyph1_id], characters[s.glyph2_id]): s for s in get_shape_distance_records(base_id)}
+
+    pair_count = len(chars) * (len(chars) - 1) // 2
+    known = shapes.HausdorffMatrix(
+        distances = np.full(pair_count, np.nan),
+        points1 = np.zeros((pair_count, 2, 2), dtype=np.int32),
+        points2 = np.zeros((pair_count, 2, 2), dtype=np.int32))
+
+    for k, (char1, char2) in enumerate(combinations(chars, 2)):
+        if char1 not in shifts or char2 not in shifts or np.any(shifts[char1] != shifts[char2]):
+            continue
+
+        if (char1, char2) in records:
+            record = records[(char1, char2)]
+            points1, points2 = json.loads(record.points1), json.loads(record.points2)
+        elif (char2, char1) in records:
+            record = records[(char2, char1)]
+            points2, points1 = json.loads(record.points1), json.loads(record.points2)
+        else:
+            continue
+
+        known.distances[k] = record.distance
+        known.points1[k] = np.array(points1) + shifts[char1]
+        known.points2[k] = np.array(points2) + shifts[char2]
+
+    matrix = shapes.complete_hausdorff_matrix(bitmaps, known)
+
+    glyph_set_id = save_glyphs(chars, font, size, coords, bitmaps, metrics)
+    glyph_ids = [glyph.id for glyph in Glyph
+                    .select(Glyph.id)
+                    .where(Glyph.glyph_set_id == glyph_set_id)
+                    .order_by(Glyph.id)]
+    save_shape_distances(glyph_set_id, glyph_ids, matrix)
+
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+    return glyph_set_id, matrix
+
+"""
+    Renders a glyph set and computes its pairwise shape distances without
+    touching the database. This is the CPU-bound part of evaluate, and is
+    what worker processes run in parallel experiments; the results are saved
+    by the parent process with evaluate_measurement. With the
+    outline_hausdorff metric nothing is rendered, and the measurement has no
+    bitmaps or metrics.
+
+    With profile set, the measurement carries the CallProfile of the work,
+    since the profiler of a worker process is not the caller's.
+"""
+def measure_glyphs(font_id, font_file, chars, size, coords=None, profile=False, metric="hausdorff", tolerance=None):
+    if profile:
+        if not instrumentation.profiler.enabled:
+            instrumentation.profiler.enable()
+        measurement, call_profile = instrumentation.profiler.call(
+            "measure_glyphs", measure_glyphs, font_id, font_file, chars, size, coords, False, metric, tolerance)
+        return measurement._replace(profile=call_profile)
+
+    if metric == "outline_hausdorff":
+        if tolerance is None:
+            tolerance = outline_tolerance
+        rendered = RenderedGlyphs(bitmaps=None, metrics=None)
+        matrix = measure_outlines(font_id, font_file, chars, size, coords, tolerance)
+    else:
+        rendered = render_glyphs(font_id, font_file, chars, size, coords)
+        if instrumentation.profiler.active:
+            count_points(rendered.bitmaps)
+        matrix = shapes.hausdorff_matrix(rendered.bitmaps)
+
+    return GlyphSetMeasurement(
+        bitmaps = rendered.bitmaps,
+        metrics = rendered.metrics,
+        matrix = matrix,
+        metric = get_stored_metric(metric, tolerance))
+
+"""
+    Computes the bitmap shape distances of a stored glyph set whose bitmaps
+    are in a bitmap arena, from the offsets found by get_arena_offsets,
+    without touching the database. Worker processes map the arena read-only
+    and measure the bitmaps in place, sharing its pages with every other
+    process reading it instead of each receiving a copy. The measurement has
+    no bitmaps or metrics, since the glyph set already has them.
+"""
+def measure_arena_glyphs(arena_path, offsets, profile=False):
+    if profile:
+        if not instrumentation.profiler.enabled:
+            instrumentation.profiler.enable()
+        measurement, call_profile = instrumentation.profiler.call(
+            "measure_arena_glyphs", measure_arena_glyphs, arena_path, offsets, False)
+        return measurement._replace(profile=call_profile)
+
+    arena = get_bitmap_arena(arena_path)
+    bitmaps = [arena.get(offset) for offset in offsets]
+    if instrumentation.profiler.active:
+        count_points(bitmaps)
+
+    return GlyphSetMeasurement(
+        bitmaps = None,
+        metrics = None,
+        matrix = shapes.hausdorff_matrix(bitmaps))
+
+# Bitmap arenas mapped by this process for measure_arena_glyphs, by path
+bitmap_arenas = {}
+
+def get_bitmap_arena(path):
+    if path not in bitmap_arenas:
+        bitmap_arenas[path] = BitmapArena(path)
+    return bitmap_arenas[path]
+
+"""
+    Returns the arena offsets of a glyph set's bitmaps in the order of its
+    glyphs, for measure_arena_glyphs, or None if any of them is not stored
+    in the arena. Reads only the glyphs' references, not their pixels.
+"""
+def get_arena_offsets(glyph_set_id):
+    references = [glyph.reference for glyph in Glyph
+                    .select(Glyph.bitmap.cast("BLOB").alias("reference"))
+                    .where(Glyph.glyph_set_id == glyph_set_id)
+                    .order_by(Glyph.id)]
+    if len(references) == 0 or not all(reference is not None and data.ArenaBitmapField.is_reference(reference)
+                                        for reference in references):
+        return None
+    return [data.ArenaBitmapField.get_offset(reference) for reference in references]
+
+"""
+    Computes the outline Hausdorff distances of a set of characters, in the
+    layout of shapes.hausdorff_matrix. Does not touch the database. tolerance
+    is a fraction of the em, by default outline_tolerance.
+"""
+@instrumentation.profiled("measure_outlines")
+def measure_outlines(font_id, font_file, chars, size, coords=None, tolerance=None):
+    if tolerance is None:
+        tolerance = outline_tolerance
+
+    renderer = shapes.renderer_pool.get(font_id, font_file)
+    outlines = renderer.outlines(chars, size, coords, tolerance)
+    if instrumentation.profiler.active:
+        instrumentation.profiler.count(points=sum(len(points) for points in outlines))
+
+    return shapes.outline_hausdorff_matrix(outlines)
+
 """
     Calculate all visual distance measures between all possible combinations
     of glyphs belonging to the specified set. If the calculations already 
     exist, the existing records are returned.
 """
+@instrumentation.profiled("get_and_save_shape_distances")
 def get_and_save_shape_distances(glyph_set_id):
-    glyph_query = Glyph.select().where(Glyph.glyph_set_id == glyph_set_id)
-    glyphs = [glyph for glyph in glyph_query]
+    measure_shape_distances(glyph_set_id)
+    return get_shape_distance_records(glyph_set_id)
+
+"""
+    Calculates and saves the shape distances of a glyph set unless they are
+    already stored. Returns the new HausdorffMatrix, or None if the distances
+    already existed. tolerance is the flattening tolerance of outlines, by
+    default outline_tolerance.
+"""
+@instrumentation.profiled("measure_shape_distances")
+def measure_shape_distances(glyph_set_id, metric="hausdorff", tolerance=None):
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+    if metric == "outline_hausdorff" and tolerance is None:
+        tolerance = outline_tolerance
+    stored_metric = get_stored_metric(metric, tolerance)
+    if has_shape_distances(glyph_set_id, stored_metric):
+        return None
+
+    if metric == "outline_hausdorff":
+        glyph_set = GlyphSet.get_by_id(glyph_set_id)
+        glyphs = [glyph for glyph in Glyph
+                    .select(Glyph.id, Glyph.character)
+                    .where(Glyph.glyph_set_id == glyph_set_id)
+                    .order_by(Glyph.id)]
+        coords = None if glyph_set.coords is None else json.loads(glyph_set.coords)
+        matrix = measure_outlines(glyph_set.font_id, glyph_set.font.font_source, [glyph.character for glyph in glyphs],
+                                    glyph_set.size, coords, tolerance)
+    else:
+        render_missing_bitmaps(glyph_set_id)
+        glyphs = [glyph for glyph in Glyph
+                    .select()
+                    .where(Glyph.glyph_set_id == glyph_set_id)
+                    .order_by(Glyph.id)]
+        if instrumentation.profiler.active:
+            count_points([glyph.bitmap for glyph in glyphs])
+        matrix = shapes.hausdorff_matrix([glyph.bitmap for glyph in glyphs])
 
-    # Get existing glyph distances
+    save_shape_distances(glyph_set_id, [glyph.id for glyph in glyphs], matrix, stored_metric)
+
+    return matrix
+
+"""
+    Saves a glyph set's HausdorffMatrix using the configured
+    shape_distance_storage. glyph_ids must be in the order the matrix was
+    computed in.
+"""
+def save_shape_distances(glyph_set_id, glyph_ids, matrix, metric="hausdorff"):
+    if matrix is None:
+        raise FailedRenderException("Unable to determine distance and correlation because at least one glyph failed to render.")
+
+    if shape_distance_storage == "matrix":
+        ShapeDistanceMatrix.create(
+            glyph_set = glyph_set_id,
+            metric = metric,
+            glyph_ids = np.array(glyph_ids, dtype=np.int64),
+            distances = matrix.distances,
+            points1 = matrix.points1,
+            points2 = matrix.points2)
+    else:
+        shape_distances = get_shape_distances_from_matrix(glyph_ids, matrix, metric)
+        with data.db.atomic():
+            ShapeDistance.bulk_create(shape_distances, batch_size=100)
+
+def has_shape_distances(glyph_set_id, metric="hausdorff"):
+    if (ShapeDistanceMatrix
+            .select(ShapeDistanceMatrix.id)
+            .where(
+                (ShapeDistanceMatrix.glyph_set_id == glyph_set_id) &
+                (ShapeDistanceMatrix.metric == metric))
+            .exists()):
+        return True
+    return get_shape_distance_rows(glyph_set_id, metric).exists()
+
+"""
+    Returns a glyph set's shape distances as ShapeDistance records, whichever
+    way they are stored. Records built from a ShapeDistanceMatrix are not
+    saved and have no id.
+"""
+def get_shape_distance_records(glyph_set_id, metric="hausdorff"):
+    record = get_shape_distance_matrix_record(glyph_set_id, metric)
+    if record is not None:
+        matrix = shapes.HausdorffMatrix(
+            distances = record.distances,
+            points1 = record.points1,
+            points2 = record.points2)
+        return get_shape_distances_from_matrix(record.glyph_ids.tolist(), matrix, metric)
+
+    return [s for s in get_shape_distance_rows(glyph_set_id, metric)]
+
+def get_shape_distance_matrix_record(glyph_set_id, metric="hausdorff"):
+    return (ShapeDistanceMatrix
+                .select()
+                .where(
+                    (ShapeDistanceMatrix.glyph_set_id == glyph_set_id) &
+                    (ShapeDistanceMatrix.metric == metric))
+                .first())
+
+def get_shape_distance_rows(glyph_set_id, metric="hausdorff"):
     Glyph1 = Glyph.alias()
     Glyph2 = Glyph.alias()
 
-    shape_query = (ShapeDistance
-                    .select()
-                    .join(Glyph1, on=ShapeDistance.glyph1)
-                    .switch(ShapeDistance)
-                    .join(Glyph2, on=ShapeDistance.glyph2)
-                    .where(
-                        (Glyph1.glyph_set_id == glyph_set_id) &
-                        (Glyph2.glyph_set_id == glyph_set_id)))
-    if len(shape_query) > 0:
-        # distances already calculated, return existing values
-        return [s for s in shape_query]
+    return (ShapeDistance
+                .select()
+                .join(Glyph1, on=ShapeDistance.glyph1)
+                .switch(ShapeDistance)
+                .join(Glyph2, on=ShapeDistance.glyph2)
+                .where(
+                    (Glyph1.glyph_set_id == glyph_set_id) &
+                    (Glyph2.glyph_set_id == glyph_set_id) &
+                    (ShapeDistance.metric == metric)))
 
-    shape_distances = get_shape_distances(glyphs)
-    
-    with data.db.atomic():
-        ShapeDistance.bulk_create(shape_distances, batch_size=100)
-    
-    return shape_distances
+"""
+    Writes per-pair ShapeDistance rows for a glyph set stored as a distance
+    matrix, so that ad hoc SQL such as sql/shape_distances.sql and
+    main.render_hausdorff_distance, which address pairs by ShapeDistance id,
+    can be used with it. Returns the saved rows.
+"""
+def materialize_shape_distances(glyph_set_id, metric="hausdorff"):
+    rows = get_shape_distance_rows(glyph_set_id, metric)
+    if not rows.exists():
+        with data.db.atomic():
+            ShapeDistance.bulk_create(get_shape_distance_records(glyph_set_id, metric), batch_size=100)
+
+    return [s for s in rows.clone()]
 
-def get_shape_distances(glyphs):
+def get_shape_distances(glyphs, point_mode="all"):
     shape_distances = []
 
+    # Extract each glyph's point cloud once and reuse it for all of its pairs
+    points = [shapes.get_points(glyph.bitmap) for glyph in glyphs]
+    if point_mode == "boundary":
+        boundaries = [shapes.get_points(glyph.bitmap, "boundary") for glyph in glyphs]
+    elif point_mode != "all":
+        raise ValueError("Unknown point mode: {0}".format(point_mode))
+
+    if point_mode == "all":
+        # Compared together, in parallel with the compiled kernel backend
+        distances = shapes.pairwise_hausdorff_distances(points)
+        if distances is None:
+            raise FailedRenderException("Unable to determine distance and correlation because at least one glyph failed to render.")
+
     # Generate all pairs of chars and calculate distance
     pairs = list(combinations(range(len(glyphs)),2))
-    for pair in pairs:
+    for k, pair in enumerate(pairs):
         i = pair[0]
         j = pair[1]
         
         glyph_1 = glyphs[i]
         glyph_2 = glyphs[j]
-        bitmap_1 = glyph_1.bitmap
-        bitmap_2 = glyph_2.bitmap
 
-        haus = shapes.hausdorff_distance(bitmap_1, bitmap_2)
+        if point_mode == "boundary":
+            haus = shapes.boundary_hausdorff_distance(glyph_1.bitmap, glyph_2.bitmap, 
+                points[i], points[j], boundaries[i], boundaries[j])
+        else:
+            haus = distances[k]
 
         if haus is None:
             raise FailedRenderException("Unable to determine distance and correlation because at least one glyph failed to render.")
 
-        contrib_points1 = json.dumps([haus[0][1], haus[1][2]])
-        contrib_points2 = json.dumps([haus[0][2], haus[1][1]])
+        contrib_points1 = json.dumps(np.stack([haus[0][1], haus[1][2]]).tolist())
+        contrib_points2 = json.dumps(np.stack([haus[0][2], haus[1][1]]).tolist())
         
         s = ShapeDistance(
             glyph1 = glyph_1.id, 
@@ -142,13 +651,52 @@ def get_shape_distances(glyphs):
     
     return shape_distances
 
+"""
+    Calculate the Hausdorff distances between all pairs of glyphs in a set in
+    one batched pass, rather than comparing each pair separately as
+    get_shape_distances does. Glyphs must be aligned to a common pixel grid,
+    which is the case for every stored glyph set.
+"""
+def get_shape_distance_matrix(glyphs):
+    matrix = shapes.hausdorff_matrix([glyph.bitmap for glyph in glyphs])
+    return get_shape_distances_from_matrix([glyph.id for glyph in glyphs], matrix)
+
+"""
+    Builds ShapeDistance records for a glyph set from a precomputed
+    HausdorffMatrix. The glyph ids must be in the order the matrix was
+    computed in.
+"""
+def get_shape_distances_from_matrix(glyph_ids, matrix, metric="hausdorff"):
+    if matrix is None:
+        raise FailedRenderException("Unable to determine distance and correlation because at least one glyph failed to render.")
+
+    shape_distances = []
+
+    pairs = combinations(range(len(glyph_ids)), 2)
+    for k, (i, j) in enumerate(pairs):
+        s = ShapeDistance(
+            glyph1 = glyph_ids[i], 
+            glyph2 = glyph_ids[j], 
+            metric = metric,
+            distance = float(matrix.distances[k]),
+            points1 = json.dumps(matrix.points1[k].tolist()),
+            points2 = json.dumps(matrix.points2[k].tolist())
+        )
+
+        shape_distances.append(s)
+
+    return shape_distances
+
 """
     Calculate correlation between the sound and shape distances for the 
     specified glyph set, using the distance metric specified. If the 
     correlation has already been calculated, the existing results are 
     returned.
 """
+@instrumentation.profiled("get_correlation")
 def get_correlation(glyph_set_id, sound_metric, shape_metric):
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+
     # Fetch from db if it's already calculated
     query = (Correlation
                     .select()
@@ -164,21 +712,15 @@ def get_correlation(glyph_set_id, sound_metric, shape_metric):
                     .where(SoundDistance.metric == sound_metric)
                     .order_by(SoundDistance.char1, SoundDistance.char2))
     
-    Glyph1 = Glyph.alias()
-    Glyph2 = Glyph.alias()
-    shape_query = (ShapeDistance
-                    .select()
-                    .join(Glyph1, on=ShapeDistance.glyph1)
-                    .switch(ShapeDistance)
-                    .join(Glyph2, on=ShapeDistance.glyph2)
-                    .where(
-                        (Glyph1.glyph_set_id == glyph_set_id) &
-                        (Glyph2.glyph_set_id == glyph_set_id) &
-                        (ShapeDistance.metric == shape_metric))
-                    .order_by(Glyph1.character, Glyph2.character))
+    characters = {glyph.id: glyph.character for glyph in Glyph
+                    .select(Glyph.id, Glyph.character)
+                    .where(Glyph.glyph_set_id == glyph_set_id)}
+    shape_records = sorted(
+        get_shape_distance_records(glyph_set_id, shape_metric),
+        key=lambda s: (characters[s.glyph1_id], characters[s.glyph2_id]))
 
     sound_distances = [s.distance for s in sound_query]
-    shape_distances = [s.distance for s in shape_query]
+    shape_distances = [s.distance for s in shape_records]
 
     if (len(sound_distances) != len(shape_distances)):
         raise Exception("Numer of shape ({0}) and sound ({1}) distances are not equal for glyph set {2}, sound metric {3}, shape metric {4}".format(
@@ -209,25 +751,225 @@ def get_correlation(glyph_set_id, sound_metric, shape_metric):
 
     This method returns only the correlation using the Edit distance.
 """
+@instrumentation.profiled("evaluate")
 def evaluate(chars, font, font_size, coords=None, overwrite=False):
     if (overwrite):
         delete_glyph_set(chars, font, font_size, coords)
     
-    glyph_set_id = get_glyphs(chars, font, font_size, coords)
+    glyph_set_id = find_glyph_set(chars, font, font_size, coords)
 
-    get_and_save_shape_distances(glyph_set_id)
+    matrix = None
+    if glyph_set_id is None and extend_glyph_sets and shape_metric == "hausdorff":
+        glyph_set_id, matrix = extend_glyph_set(chars, font, font_size, coords)
+
+    if glyph_set_id is None:
+        glyph_set_id = get_glyphs(chars, font, font_size, coords, shape_metric != "outline_hausdorff")
+
+    if matrix is None:
+        matrix = measure_shape_distances(glyph_set_id, shape_metric, outline_tolerance)
+
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+
+    return get_systematicity(glyph_set_id, chars, None if matrix is None else matrix.distances, 
+                                get_stored_metric(shape_metric, outline_tolerance))
+
+"""
+    Completes an evaluation from a GlyphSetMeasurement computed by
+    measure_glyphs, typically in a worker process. Saves the glyphs and shape
+    distances and calculates the correlations, as evaluate does. If the
+    glyph set was saved by another evaluation in the meantime, that set is
+    used instead, and only distances it lacks are saved. A stored set saved
+    without bitmaps gets those of the measurement, if it has them.
+"""
+@instrumentation.profiled("evaluate_measurement")
+def evaluate_measurement(chars, font, font_size, coords, measurement):
+    if measurement.profile is not None:
+        instrumentation.profiler.add_call(measurement.profile)
+
+    glyph_set_id = find_glyph_set(chars, font, font_size, coords)
+    if glyph_set_id is None:
+        try:
+            glyph_set_id = save_glyphs(chars, font, font_size, coords, measurement.bitmaps, measurement.metrics)
+        except IntegrityError:
+            # Another process saved the set between the lookup and the insert
+            glyph_set_id = find_glyph_set(chars, font, font_size, coords)
+    elif measurement.bitmaps is not None:
+        render_missing_bitmaps(glyph_set_id, chars, measurement)
+    instrumentation.profiler.set_glyph_set(glyph_set_id)
+
+    if not has_shape_distances(glyph_set_id, measurement.metric):
+        glyph_ids = [glyph.id for glyph in Glyph
+                        .select(Glyph.id)
+                        .where(Glyph.glyph_set_id == glyph_set_id)
+                        .order_by(Glyph.id)]
+        save_shape_distances(glyph_set_id, glyph_ids, measurement.matrix, measurement.metric)
+
+    return get_systematicity(glyph_set_id, chars, measurement.matrix.distances, measurement.metric)
+
+"""
+    Calculates the sound-shape correlations of a glyph set whose shape
+    distances have been saved, for each of the sound metrics reported in a
+    SystematicityResult. Correlations that already exist are returned as they
+    are. Otherwise all metrics are correlated in one pass against the cached
+    sound distances and saved.
+
+    shape_distances may give the set's distances for shape_metric in the
+    order of combinations(chars, 2), as computed by hausdorff_matrix, to avoid
+    reading them back from the database.
+"""
+@instrumentation.profiled("get_systematicity")
+def get_systematicity(glyph_set_id, chars, shape_distances=None, shape_metric="hausdorff"):
+    sound_metrics = ["Euclidean", "Edit_Sum", "Edit"]
+
+    correlations = {c.sound_metric: c for c in Correlation
+                    .select()
+                    .where(
+                        (Correlation.glyph_set_id == glyph_set_id) & 
+                        (Correlation.sound_metric.in_(sound_metrics)) &
+                        (Correlation.shape_metric == shape_metric))}
+
+    missing = [metric for metric in sound_metrics if metric not in correlations]
+    if len(missing) > 0:
+        if shape_distances is None:
+            shape_distances = get_shape_vector(glyph_set_id, chars, shape_metric)
+
+        if np.std(shape_distances) == 0:
+            raise Exception("Unable to calculate correlation for glyph set {0}: standard deviation of shape distances is zero."
+                .format(glyph_set_id))
+
+        r_values, p_values = correlate(shape_distances, sound_distances.get(chars, missing))
+
+        new_correlations = []
+        for i, metric in enumerate(missing):
+            correlation = Correlation(
+                glyph_set = glyph_set_id,
+                shape_metric = shape_metric,
+                sound_metric = metric,
+                r_value = float(r_values[i]),
+                p_value = float(p_values[i])
+            )
+            correlations[metric] = correlation
+            new_correlations.append(correlation)
+
+        with data.db.atomic():
+            Correlation.bulk_create(new_correlations)
 
-    euclidean_corr = get_correlation(glyph_set_id, "Euclidean", "hausdorff")
-    edit_sum_corr = get_correlation(glyph_set_id, "Edit_Sum", "hausdorff")
-    edit_corr = get_correlation(glyph_set_id, "Edit", "hausdorff")
-    
     return SystematicityResult(
         glyph_set_id = glyph_set_id,
-        edit_correlation = edit_corr.r_value,
-        edit_sum_correlation = edit_sum_corr.r_value,
-        euclidean_correlation = euclidean_corr.r_value
+        edit_correlation = correlations["Edit"].r_value,
+        edit_sum_correlation = correlations["Edit_Sum"].r_value,
+        euclidean_correlation = correlations["Euclidean"].r_value
     )
 
+"""
+    Loads a glyph set's stored shape distances as a vector in the order of
+    combinations(chars, 2).
+"""
+def get_shape_vector(glyph_set_id, chars, shape_metric):
+    characters = {glyph.id: glyph.character for glyph in Glyph
+                    .select(Glyph.id, Glyph.character)
+                    .where(Glyph.glyph_set_id == glyph_set_id)}
+    pair_index = {pair: i for i, pair in enumerate(combinations(chars, 2))}
+
+    record = get_shape_distance_matrix_record(glyph_set_id, shape_metric)
+    if record is not None:
+        matrix_chars = [characters[glyph_id] for glyph_id in record.glyph_ids.tolist()]
+        if matrix_chars == list(chars):
+            return np.array(record.distances, dtype=np.float64)
+        stored = zip(combinations(matrix_chars, 2), record.distances)
+    else:
+        stored = (((characters[s.glyph1_id], characters[s.glyph2_id]), s.distance) 
+                    for s in get_shape_distance_rows(glyph_set_id, shape_metric))
+
+    distances = np.full(len(pair_index), np.nan)
+    for (char1, char2), distance in stored:
+        index = pair_index.get((char1, char2), pair_index.get((char2, char1)))
+        distances[index] = distance
+
+    if np.any(np.isnan(distances)):
+        raise Exception("Shape distances for glyph set {0}, shape metric {1} are incomplete".format(glyph_set_id, shape_metric))
+
+    return distances
+
+"""
+    Adds the ink points of bitmaps whose distances are computed to the
+    instrumented calls in progress.
+"""
+def count_points(bitmaps):
+    instrumentation.profiler.count(points=sum(int(np.count_nonzero(bitmap == 0)) for bitmap in bitmaps))
+
+"""
+    Pearson correlation of one shape distance vector with each row of a matrix
+    of sound distance vectors, computed together. Returns arrays of r values
+    and two-sided p values, as scipy.stats.pearsonr would give for each row.
+"""
+def correlate(shape_distances, sound_distances):
+    x = np.asarray(shape_distances, dtype=np.float64)
+    y = np.asarray(sound_distances, dtype=np.float64)
+
+    x = x - x.mean()
+    y = y - y.mean(axis=1, keepdims=True)
+    r_values = (y @ x) / (np.linalg.norm(y, axis=1) * np.linalg.norm(x))
+    r_values = np.clip(r_values, -1.0, 1.0)
+
+    dof = len(x) - 2
+    with np.errstate(divide="ignore"):
+        t_squared = r_values**2 * (dof / ((1.0 - r_values) * (1.0 + r_values)))
+    p_values = betainc(0.5*dof, 0.5, dof / (dof + t_squared))
+
+    return r_values, p_values
+
+"""
+    In-memory cache of sound distances. The sound distances never change during
+    an experiment, so each metric is read from the database once and kept as
+    vectors aligned to the pairs of each character list it is used with.
+"""
+class SoundDistanceCache:
+    def __init__(self):
+        self._distances = {}
+        self._vectors = {}
+
+    """
+        Returns an array with one row per metric, holding the sound distances
+        for each pair in combinations(chars, 2).
+    """
+    def get(self, chars, metrics):
+        return np.stack([self.get_vector(chars, metric) for metric in metrics])
+
+    def get_vector(self, chars, metric):
+        key = (tuple(chars), metric)
+        vector = self._vectors.get(key)
+        if vector is None:
+            distances = self.get_distances(metric)
+            pairs = list(combinations(chars, 2))
+            try:
+                vector = np.array([distances[pair] for pair in pairs])
+            except KeyError as e:
+                raise Exception("No {0} sound distance for characters {1}".format(metric, e.args[0]))
+            vector.setflags(write=False)
+            self._vectors[key] = vector
+        return vector
+
+    def get_distances(self, metric):
+        distances = self._distances.get(metric)
+        if distances is None:
+            distances = {}
+            for char1, char2, distance in (SoundDistance
+                    .select(SoundDistance.char1, SoundDistance.char2, SoundDistance.distance)
+                    .where(SoundDistance.metric == metric)
+                    .tuples()):
+                distances[(char1, char2)] = distance
+                distances[(char2, char1)] = distance
+            self._distances[metric] = distances
+        return distances
+
+    def clear(self):
+        self._distances.clear()
+        self._vectors.clear()
+
+# Sound distances shared by all evaluations in this process
+sound_distances = SoundDistanceCache()
+
 class SystematicityResult(NamedTuple):
     """Class to represent the results of a systematiciy evaluation. """
     glyph_set_id: int
@@ -235,6 +977,19 @@ class SystematicityResult(NamedTuple):
     edit_sum_correlation: float
     euclidean_correlation: float
 
+class RenderedGlyphs(NamedTuple):
+    """Class to represent the aligned bitmaps of a glyph set and their metrics. """
+    bitmaps: list
+    metrics: list
+
+class GlyphSetMeasurement(NamedTuple):
+    """Class to represent a rendered glyph set and its shape distances. """
+    bitmaps: list
+    metrics: list
+    matrix: shapes.HausdorffMatrix
+    profile: instrumentation.CallProfile = None
+    metric: str = "hausdorff"
+
 class FailedRenderException(Exception):
     """Exception for when a glyph renders with no pixels"""
     pass
@@ -0,0 +1,82 @@
+import os
+
+import numpy as np
+import pytest
+from peewee import Model, SqliteDatabase
+
+import benchmarks
+import data
+from arena import BitmapArena
+from data import ArenaBitmapField, PackedBitmapField, PickleBlobField
+
+SIZES = (12, 24, 48, 96)
+FIELDS = {"pickle": PickleBlobField, "packed": PackedBitmapField, "arena": ArenaBitmapField}
+
+@pytest.fixture(params=sorted(FIELDS))
+def field_class(request, monkeypatch, tmp_path):
+    if request.param == "arena":
+        arena = BitmapArena(os.path.join(str(tmp_path), "glyphs.arena"))
+        monkeypatch.setattr(data, "bitmap_storage", "arena")
+        monkeypatch.setattr(data, "bitmap_arena", arena)
+        yield FIELDS[request.param]
+        arena.close()
+    else:
+        yield FIELDS[request.param]
+
+@pytest.mark.parametrize("size", SIZES)
+def test_values_round_trip(field_class, size):
+    field = field_class()
+    bitmaps = benchmarks.get_sample_bitmaps(size, 50)
+
+    decoded = [field.python_value(field.db_value(bitmap)) for bitmap in bitmaps]
+
+    assert len(decoded) == len(bitmaps)
+    for bitmap, value in zip(bitmaps, decoded):
+        assert value.shape == bitmap.shape
+        assert np.array_equal(value, bitmap)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_rows_round_trip(field_class, size):
+    bitmaps = benchmarks.get_sample_bitmaps(size, 50)
+
+    db = SqliteDatabase(":memory:")
+    class StoredBitmap(Model):
+        bitmap = field_class(null=True)
+        class Meta:
+            database = db
+    db.create_tables([StoredBitmap])
+
+    with db.atomic():
+        StoredBitmap.bulk_create([StoredBitmap(bitmap=bitmap) for bitmap in bitmaps] + [StoredBitmap(bitmap=None)], batch_size=20)
+    loaded = [row.bitmap for row in StoredBitmap.select().order_by(StoredBitmap.id)]
+    db.close()
+
+    assert len(loaded) == len(bitmaps) + 1
+    for bitmap, value in zip(bitmaps, loaded):
+        assert np.array_equal(value, bitmap)
+    assert loaded[-1] is None
+
+def test_arena_values_are_references(monkeypatch, tmp_path):
+    arena = BitmapArena(os.path.join(str(tmp_path), "glyphs.arena"))
+    monkeypatch.setattr(data, "bitmap_storage", "arena")
+    monkeypatch.setattr(data, "bitmap_arena", arena)
+    bitmap = benchmarks.get_sample_bitmaps(24, 1)[0]
+
+    value = ArenaBitmapField().db_value(bitmap)
+
+    assert ArenaBitmapField.is_reference(value)
+    assert len(value) == ArenaBitmapField.REFERENCE.size
+    loaded = ArenaBitmapField().python_value(value)
+    assert not loaded.flags.writeable
+    assert np.array_equal(loaded, bitmap)
+    del loaded
+    arena.close()
+
+def test_packed_values_load_without_arena_storage(monkeypatch):
+    monkeypatch.setattr(data, "bitmap_storage", "packed")
+    bitmap = benchmarks.get_sample_bitmaps(24, 1)[0]
+
+    value = ArenaBitmapField().db_value(bitmap)
+
+    assert PackedBitmapField.is_packed(value)
+    assert np.array_equal(ArenaBitmapField().python_value(value), bitmap)
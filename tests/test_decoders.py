@@ -0,0 +1,33 @@
+import ctypes
+
+import numpy as np
+import pytest
+
+import benchmarks
+import shapes
+
+SIZES = (6, 9, 12, 24, 48, 96)
+CHARS = benchmarks.LATIN_CHARS + benchmarks.LARGE_CHARS[:50]
+
+@pytest.fixture(scope="module")
+def renderers():
+    return benchmarks.get_fixture_renderers(CHARS)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_unpack_mono_buffer_matches_reference(renderers, size):
+    for name, renderer, coords_list in renderers:
+        for coords in coords_list:
+            renderer.configure_font(size, coords)
+            for char in CHARS:
+                glyph = renderer.render(char)
+                bitmap = renderer._face.glyph.bitmap
+                buffer = ctypes.string_at(bitmap._FT_Bitmap.buffer, bitmap.rows*bitmap.pitch)
+
+                decoded = shapes.unpack_mono_buffer(buffer, bitmap.rows, bitmap.width, bitmap.pitch)
+                expected = benchmarks.decode_reference(renderer, bitmap)
+
+                context = "{0} font, {1} at {2}pt, coordinates {3}".format(name, char, size, coords)
+                assert decoded.shape == expected.shape, context
+                assert decoded.dtype == expected.dtype, context
+                assert np.array_equal(decoded, expected), context
+                assert np.array_equal(glyph.bitmap, expected), context
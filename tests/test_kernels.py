@@ -0,0 +1,71 @@
+from contextlib import contextmanager
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import benchmarks
+import kernels
+import shapes
+
+pytestmark = pytest.mark.skipif(not kernels.available, reason="Numba is not installed")
+
+SIZES = (12, 24, 48, 96)
+
+@pytest.fixture
+def bitmaps(request):
+    return benchmarks.get_sample_bitmaps(request.param, 20)
+
+@contextmanager
+def kernel_backend(backend):
+    previous = shapes.kernel_backend
+    shapes.kernel_backend = backend
+    try:
+        yield
+    finally:
+        shapes.kernel_backend = previous
+
+def get_points(bitmaps, backend, point_mode="all"):
+    with kernel_backend(backend):
+        return [shapes.get_points(bitmap, point_mode) for bitmap in bitmaps]
+
+def get_distances(points, backend):
+    with kernel_backend(backend):
+        return shapes.pairwise_hausdorff_distances(points)
+
+@pytest.mark.parametrize("bitmaps", SIZES, indirect=True)
+@pytest.mark.parametrize("point_mode", ["all", "boundary"])
+def test_points_match_numpy(bitmaps, point_mode):
+    for expected, actual in zip(get_points(bitmaps, "numpy", point_mode), get_points(bitmaps, "numba", point_mode)):
+        assert actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
+
+@pytest.mark.parametrize("bitmaps", SIZES, indirect=True)
+def test_distances_match_numpy(bitmaps):
+    points = get_points(bitmaps, "numpy")
+    for expected, actual in zip(get_distances(points, "numpy"), get_distances(points, "numba")):
+        for (distance, _, _), (kernel_distance, point, nearest) in zip(expected, actual):
+            assert kernel_distance == distance
+            assert np.sqrt(np.sum((point - nearest) ** 2.0)) == kernel_distance
+
+@pytest.mark.parametrize("bitmaps", SIZES, indirect=True)
+def test_contributing_points_match_hausdorff_matrix(bitmaps):
+    matrix = shapes.hausdorff_matrix(bitmaps)
+    distances = get_distances(get_points(bitmaps, "numpy"), "numba")
+    for k, (forward, backward) in enumerate(distances):
+        assert max(forward[0], backward[0]) == matrix.distances[k]
+        assert np.array_equal(forward[1], matrix.points1[k][0])
+        assert np.array_equal(backward[1], matrix.points2[k][1])
+
+@pytest.mark.parametrize("bitmaps", SIZES, indirect=True)
+def test_single_pairs_match_pairwise(bitmaps):
+    points = get_points(bitmaps, "numpy")
+    with kernel_backend("numba"):
+        single = [shapes.points_hausdorff_distance(points[i], points[j]) 
+                    for i, j in combinations(range(len(points)), 2)]
+
+    for expected, actual in zip(get_distances(points, "numba"), single):
+        for (distance, point, nearest), (kernel_distance, kernel_point, kernel_nearest) in zip(expected, actual):
+            assert kernel_distance == distance
+            assert np.array_equal(kernel_point, point)
+            assert np.array_equal(kernel_nearest, nearest)
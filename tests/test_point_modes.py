@@ -0,0 +1,35 @@
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import benchmarks
+import shapes
+
+SIZES = (12, 24, 48, 96)
+
+def check_point_modes(bitmaps, pairs):
+    for i, j in pairs:
+        expected = shapes.hausdorff_distance(bitmaps[i], bitmaps[j], "all")
+        actual = shapes.hausdorff_distance(bitmaps[i], bitmaps[j], "boundary")
+        for (distance, _, _), (boundary_distance, point, nearest) in zip(expected, actual):
+            assert boundary_distance == distance, (i, j)
+            assert np.sqrt(np.sum((point - nearest) ** 2.0)) == boundary_distance, (i, j)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_boundary_distances_match_all_points(size):
+    bitmaps = benchmarks.get_sample_bitmaps(size, 20)
+    check_point_modes(bitmaps, list(combinations(range(len(bitmaps)), 2)))
+
+@pytest.fixture(scope="module")
+def renderers():
+    return benchmarks.get_fixture_renderers(benchmarks.LATIN_CHARS)
+
+@pytest.mark.parametrize("size", SIZES)
+def test_boundary_distances_match_all_points_of_rendered_glyphs(renderers, size):
+    chars = benchmarks.LATIN_CHARS
+    pairs = list(combinations(range(len(chars)), 2))[:100]
+    for name, renderer, coords_list in renderers:
+        for coords in coords_list:
+            bitmaps = renderer.align_glyphs(renderer.glyph_bitmaps(chars, size, coords))
+            check_point_modes(bitmaps, pairs)
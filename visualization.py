@@ -27,7 +27,7 @@ def show_image(bitmap):
 """
 def render_image_set(bitmaps, title):
     plt.clf()
-    bitmap = np.concatenate(bitmaps, axis=1)
+    bitmap = np.concatenate(bitmaps, axis=1).astype(np.float64)
     bitmap = np.dstack([bitmap, bitmap, bitmap])
     plt.title(title)
     return bitmap
@@ -38,7 +38,7 @@ def render_image_set(bitmaps, title):
 """
 def render_distance_adjacent(char1, char2, bitmap1, bitmap2, points1, points2, dist1, dist2):
     plt.clf()
-    bitmap = np.concatenate((bitmap1, bitmap2), axis=1)
+    bitmap = np.concatenate((bitmap1, bitmap2), axis=1).astype(np.float64)
     
     if points1 is not None or points2 is not None:
         bitmap = np.dstack([bitmap, bitmap, bitmap])
@@ -81,8 +81,8 @@ def render_distance_overlay(char1, char2, bitmap1, bitmap2, points1, points2, di
     blue = (.05, .17, .33)
     yellow = (1.0, .71, 0)
 
-    bitmap1 = np.dstack([bitmap1, bitmap1, bitmap1])
-    bitmap2 = np.dstack([bitmap2, bitmap2, bitmap2])
+    bitmap1 = np.dstack([bitmap1, bitmap1, bitmap1]).astype(np.float64)
+    bitmap2 = np.dstack([bitmap2, bitmap2, bitmap2]).astype(np.float64)
 
     black_pixel_mask = np.all(bitmap2 == [0,0,0], axis = -1)
     bitmap2[black_pixel_mask] = blue